@@ -0,0 +1,248 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+from flask import g, request
+
+from profiling_service import PHASES, on_response_close
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process, rotation needs no lock
+    fcntl = None
+
+
+DEFAULT_LOG_PATH = Path.home() / ".fts_logs" / "access.log"
+
+
+class AccessLog:
+    """JSON-lines access log written off the request path.
+
+    Requests only build a small dict and put it on a bounded queue; one
+    writer thread per process does all file I/O. When the queue is full the
+    record is dropped and counted (the next record written carries the
+    count), so a slow disk can never stall a transfer.
+
+    The file is rotated when it reaches `max_bytes` or `rotate_sec` after its
+    first record, keeping `backups` old files (access.log.1 is the newest).
+    Worker processes share the file: rotation happens under an flock, and
+    the other writers notice the new inode and reopen.
+    """
+
+    QUEUE_SIZE = 10000
+    BATCH = 500
+    REOPEN_CHECK_SEC = 1.0
+
+    def __init__(self, path=None, max_bytes=50 * 1024 * 1024, rotate_sec=24 * 3600, backups=7, queue_size=None):
+        self.path = Path(path or DEFAULT_LOG_PATH)
+        self.max_bytes = int(max_bytes or 0)
+        self.rotate_sec = float(rotate_sec or 0)
+        self.backups = max(1, int(backups))
+        self._queue = queue.Queue(maxsize=queue_size or self.QUEUE_SIZE)
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._fh = None
+        self._inode = None
+        self._born = None  # time of the first record in the current file
+        self._checked_at = 0.0
+        self._thread = None
+        self._closed = False
+
+    @classmethod
+    def from_env(cls):
+        """None when FTS_ACCESS_LOG is "off"."""
+        path = os.environ.get("FTS_ACCESS_LOG") or None
+        if path is not None and path.lower() in ("off", "0", "false", "none"):
+            return None
+        return cls(
+            path=path,
+            max_bytes=_env_int("FTS_ACCESS_LOG_MAX_BYTES", 50 * 1024 * 1024),
+            rotate_sec=_env_int("FTS_ACCESS_LOG_ROTATE_HOURS", 24) * 3600,
+            backups=_env_int("FTS_ACCESS_LOG_BACKUPS", 7),
+        )
+
+    # --- request side -----------------------------------------------------
+
+    def begin_request(self):
+        g.fts_access_start = time.perf_counter()
+
+    def end_request(self, response, client_ip):
+        start = g.get("fts_access_start")
+        if start is None:
+            return
+        rule = request.url_rule.rule if request.url_rule is not None else None
+        record = {
+            "ip": client_ip,
+            "method": request.method,
+            "route": rule,
+            "path": request.path,
+            "status": response.status_code,
+            "bytes_in": request.content_length or 0,
+            # Content-Length of what was sent (None for streamed pages).
+            "bytes_out": 0 if request.method == "HEAD" or response.status_code == 304 else response.content_length,
+        }
+        # References, as in RequestProfiler: streamed bodies keep annotating.
+        info = g.setdefault("fts_request_info", {})
+        timings = g.setdefault("fts_phase_timings", {})
+
+        def _finish():
+            entry = dict(record)
+            entry.update(
+                ts=round(time.time(), 3),
+                folder=info.get("folder"),
+                file=info.get("file"),
+                encrypted=bool(info.get("encrypted")),
+                cache=info.get("cache") or ("hit" if record["status"] == 304 else None),
+                duration_ms=round((time.perf_counter() - start) * 1000, 2),
+            )
+            for name in PHASES:
+                if name in timings:
+                    entry[f"{name}_ms"] = round(timings[name] * 1000, 2)
+            self.submit(entry)
+
+        on_response_close(response, _finish)
+
+    def submit(self, entry):
+        if self._closed:
+            return
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._dropped_lock:
+                self._dropped += 1
+
+    # --- writer side ------------------------------------------------------
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="fts-access-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def close(self, timeout=2.0):
+        """Write out what is queued and stop the writer."""
+        if self._closed or self._thread is None:
+            return
+        self._closed = True
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            batch = [entry]
+            while entry is not None and len(batch) < self.BATCH:
+                try:
+                    entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(entry)
+            records = [item for item in batch if item is not None]
+            if records:
+                try:
+                    self._write(records)
+                except OSError:
+                    pass
+            if entry is None:
+                if self._fh is not None:
+                    self._fh.close()
+                return
+
+    def _write(self, records):
+        with self._dropped_lock:
+            dropped, self._dropped = self._dropped, 0
+        if dropped:
+            records[0]["dropped_before"] = dropped
+        data = "".join(json.dumps(record, default=str) + "\n" for record in records).encode("utf-8")
+        fh = self._open()
+        if self._born is None:
+            self._born = records[0]["ts"]
+        if self._needs_rotation(len(data)):
+            self._rotate()
+            fh = self._open()
+            self._born = records[0]["ts"]
+        # One write() per batch on an O_APPEND file: lines from workers don't interleave.
+        fh.write(data)
+
+    def _open(self):
+        now = time.monotonic()
+        if self._fh is not None and now - self._checked_at < self.REOPEN_CHECK_SEC:
+            return self._fh
+        self._checked_at = now
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            inode = None
+        if self._fh is None or inode != self._inode:
+            # First write, or another process rotated the file.
+            if self._fh is not None:
+                self._fh.close()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._fh = open(self.path, "ab", buffering=0)
+            self._inode = os.fstat(self._fh.fileno()).st_ino
+            self._born = self._first_record_time()
+        return self._fh
+
+    def _first_record_time(self):
+        try:
+            with open(self.path, "rb") as fh:
+                return float(json.loads(fh.readline() or b"{}").get("ts") or 0) or None
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def _needs_rotation(self, incoming):
+        size = os.fstat(self._fh.fileno()).st_size
+        if size == 0:
+            return False
+        if self.max_bytes and size + incoming > self.max_bytes:
+            return True
+        return bool(self.rotate_sec and self._born and time.time() - self._born >= self.rotate_sec)
+
+    def _rotate(self):
+        lock_fh = open(str(self.path) + ".lock", "a")
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_fh, fcntl.LOCK_EX)
+            try:
+                current = os.stat(self.path).st_ino
+            except OSError:
+                current = None
+            if current == self._inode:  # nobody rotated it while we waited
+                for index in range(self.backups - 1, 0, -1):
+                    older = Path(f"{self.path}.{index}")
+                    if older.exists():
+                        os.replace(older, f"{self.path}.{index + 1}")
+                os.replace(self.path, f"{self.path}.1")
+        finally:
+            lock_fh.close()
+        self._fh.close()
+        self._fh = None
+        self._checked_at = 0.0
+
+
+def register_access_log_hooks(app, access_log, get_client_ip):
+    app.extensions["fts_access_log"] = access_log
+
+    @app.before_request
+    def _access_log_begin():
+        access_log.begin_request()
+
+    @app.after_request
+    def _access_log_end(response):
+        access_log.end_request(response, get_client_ip())
+        return response
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,140 @@
+from werkzeug.utils import secure_filename
+
+from flask import request
+
+from profiling_service import annotate_request, timed_phase
+
+
+# Upper bound on operations in one batch request.
+MAX_BATCH_OPS = 1000
+
+
+def register_batch_routes(app, pin_service, storage, usage_service, digest_service, get_client_ip):
+    def _owned(client_ip, folder):
+        return client_ip == folder or client_ip in ("127.0.0.1", "::1")
+
+    def _fek(folder):
+        """The folder key (base64) for an encrypted folder, else None."""
+        if not pin_service.folder_has_encryption(folder):
+            return None
+        return pin_service.get_fek_b64_for_folder(folder)
+
+    def _move(folder, name, dest_folder, dest_name, overwrite):
+        """Move or rename one file; returns an error message or None."""
+        stored = storage.stat(folder, name)
+        if stored is None:
+            return "File not found."
+        if (dest_folder, dest_name) == (folder, name):
+            return None
+        existing = storage.stat(dest_folder, dest_name)
+        if existing is not None and not overwrite:
+            return "A file with that name already exists."
+        if dest_folder != folder:
+            replaced = (existing.size, 1) if existing is not None else (0, 0)
+            quota_error = usage_service.check_quota(dest_folder, stored.size, 1, *replaced)
+            if quota_error:
+                return quota_error
+        digest = digest_service.get(folder, name, stored)
+        if _fek(folder) == _fek(dest_folder):
+            # Same key (or both plaintext): the stored bytes move as they are.
+            with timed_phase("io"):
+                storage.move(folder, name, dest_folder, dest_name)
+        else:
+            source_fernet = pin_service.get_fek_for_folder(folder) if pin_service.folder_has_encryption(folder) else None
+            dest_fernet = (
+                pin_service.get_fek_for_folder(dest_folder) if pin_service.folder_has_encryption(dest_folder) else None
+            )
+            with timed_phase("io"):
+                content = storage.read_bytes(folder, name)
+            with timed_phase("crypto"):
+                if source_fernet:
+                    content = source_fernet.decrypt(content)
+                if dest_fernet:
+                    content = dest_fernet.encrypt(content)
+            with timed_phase("io"):
+                storage.write_bytes(dest_folder, dest_name, content)
+                storage.delete(folder, name)
+        if digest:
+            digest_service.record(dest_folder, dest_name, digest["sha256"], digest["size"])
+        return None
+
+    @app.route("/api/folders/<folder>/batch", methods=["POST"])
+    def api_folder_batch(folder):
+        """Delete, rename or move many files of your folders in one request.
+
+        Body: `{"ops": [{"op": "delete", "name": ...}, {"op": "rename",
+        "name": ..., "to": ...}, {"op": "move", "name": ..., "folder": ...,
+        "to": <optional>}]}`; `"overwrite": true` on an op replaces an
+        existing target. Ownership and PINs are checked once, for every
+        folder the batch touches, before anything changes; the response
+        lists one result per op, in order.
+        """
+        data = request.get_json(force=True, silent=True) or {}
+        ops = data.get("ops")
+        if not isinstance(ops, list) or not ops:
+            return {"ok": False, "error": "ops must be a non-empty list."}, 400
+        if len(ops) > MAX_BATCH_OPS:
+            return {"ok": False, "error": f"At most {MAX_BATCH_OPS} operations per batch."}, 400
+        annotate_request(folder=folder, file_count=len(ops))
+
+        client_ip = get_client_ip().strip()
+        folders = {folder}
+        for op in ops:
+            if isinstance(op, dict) and op.get("op") == "move" and isinstance(op.get("folder"), str):
+                folders.add(op["folder"])
+        for name in sorted(folders):
+            if not _owned(client_ip, name):
+                return {"ok": False, "error": "You can only change files in your own folders."}, 403
+        if not storage.folder_exists(folder):
+            return {"ok": False, "error": "Folder not found."}, 404
+        for name in sorted(folders):
+            if not storage.folder_exists(name):
+                continue
+            if pin_service.folder_has_pin(name) and not pin_service.is_folder_unlocked(name):
+                return {"ok": False, "locked": True, "folder": name, "error": f"Unlock {name} with its PIN first."}, 403
+            if pin_service.folder_has_encryption(name) and not pin_service.get_fek_for_folder(name):
+                return {"ok": False, "locked": True, "folder": name, "error": f"Unlock {name} with its PIN first."}, 403
+
+        results = []
+        for op in ops:
+            if not isinstance(op, dict):
+                results.append({"ok": False, "error": "Each op must be an object."})
+                continue
+            kind = op.get("op")
+            name = op.get("name") if isinstance(op.get("name"), str) else ""
+            result = {"op": kind, "name": name}
+            results.append(result)
+            if not name:
+                result.update(ok=False, error="name is required.")
+                continue
+            try:
+                if kind == "delete":
+                    with timed_phase("io"):
+                        deleted = storage.delete(folder, name)
+                    error = None if deleted else "File not found."
+                elif kind in ("rename", "move"):
+                    dest_folder = op.get("folder") if kind == "move" else folder
+                    if not isinstance(dest_folder, str) or not dest_folder:
+                        result.update(ok=False, error="folder is required.")
+                        continue
+                    dest_name = secure_filename(str(op.get("to") or (name if kind == "move" else "")))
+                    if not dest_name:
+                        result.update(ok=False, error="to must be a valid file name.")
+                        continue
+                    if not storage.folder_exists(dest_folder):
+                        if dest_folder != client_ip:
+                            result.update(ok=False, error="Folder not found.")
+                            continue
+                        storage.create_folder(dest_folder)
+                    result.update(folder=dest_folder, to=dest_name)
+                    error = _move(folder, name, dest_folder, dest_name, bool(op.get("overwrite")))
+                else:
+                    error = "op must be delete, rename or move."
+            except ValueError as exc:
+                error = str(exc) or "Operation failed."
+            except Exception:
+                error = "Operation failed."
+            result["ok"] = error is None
+            if error is not None:
+                result["error"] = error
+        return {"ok": all(result["ok"] for result in results), "results": results}
@@ -9,15 +9,25 @@ from pathlib import Path
 
 
 PID_FILE = Path.home() / ".fts_server.pid"
+# Same relative location server.py uses.
+UPLOAD_FOLDER = "uploads"
 
 
 def _read_pid():
+    # First line: the server (or pool supervisor) PID; further lines: pool workers.
     try:
-        return int(PID_FILE.read_text(encoding="utf-8").strip())
+        return int(PID_FILE.read_text(encoding="utf-8").split()[0])
     except Exception:
         return None
 
 
+def _read_worker_pids():
+    try:
+        return [int(line) for line in PID_FILE.read_text(encoding="utf-8").split()[1:]]
+    except Exception:
+        return []
+
+
 def _is_running(pid):
     if not pid:
         return False
@@ -28,8 +38,8 @@ def _is_running(pid):
         return False
 
 
-def _write_pid(pid):
-    PID_FILE.write_text(str(pid), encoding="utf-8")
+def _write_pid(pid, workers=()):
+    PID_FILE.write_text("\n".join(str(p) for p in (pid, *workers)), encoding="utf-8")
 
 
 def _clear_pid_if_matches(pid):
@@ -98,13 +108,13 @@ def _listening_pids(port):
     return sorted(pids)
 
 
-def _terminate_pid(pid):
+def _terminate_pid(pid, timeout=2.0):
     try:
         os.kill(pid, signal.SIGTERM)
     except Exception:
         return False
 
-    for _ in range(20):
+    for _ in range(int(timeout * 10)):
         if not _is_running(pid):
             return True
         time.sleep(0.1)
@@ -119,7 +129,7 @@ def _terminate_pid(pid):
     return not _is_running(pid)
 
 
-def start_server(host, port):
+def start_server(host, port, workers=0):
     existing_pid = _read_pid()
     if _is_running(existing_pid):
         print(f"Server already running (PID {existing_pid}).")
@@ -131,6 +141,12 @@ def start_server(host, port):
         print(f"Run `fts stop --port {port}` or free that port first.")
         return 1
 
+    if workers and not _supports_workers():
+        print("--workers needs fork(); starting a single server process instead.")
+        workers = 0
+    if workers:
+        return _start_pool(host, port, workers)
+
     _write_pid(os.getpid())
     _print_startup_info(host, port)
     try:
@@ -153,12 +169,351 @@ def start_server(host, port):
     return 0
 
 
+def _supports_workers():
+    from worker_pool import supports_workers
+
+    return supports_workers()
+
+
+def _start_pool(host, port, workers):
+    from worker_pool import WorkerPool
+
+    master_pid = os.getpid()
+    _write_pid(master_pid)
+    _print_startup_info(host, port)
+    print(f"Workers: {workers}")
+    pool = WorkerPool(host, port, workers, on_pids_changed=lambda pids: _write_pid(master_pid, pids))
+    try:
+        return pool.run()
+    except OSError as exc:
+        print(f"Could not start server on {host}:{port}: {exc}")
+        return 1
+    finally:
+        if os.getpid() == master_pid:
+            _clear_pid_if_matches(master_pid)
+            print("\nServer stopped.")
+
+
+def _profiler():
+    # Lazy import: profiling_service pulls in Flask.
+    from profiling_service import RequestProfiler
+
+    return RequestProfiler.from_env()
+
+
+def configure_profiling(sample_rate=None, slow_ms=None, off=False):
+    profiler = _profiler()
+    if off:
+        profiler.save_settings(0.0, 0)
+    elif sample_rate is not None or slow_ms is not None:
+        if sample_rate is not None and not 0.0 <= sample_rate <= 1.0:
+            print("--sample must be between 0 and 1.")
+            return 1
+        profiler.save_settings(
+            profiler.sample_rate if sample_rate is None else sample_rate,
+            profiler.slow_ms if slow_ms is None else max(0, slow_ms),
+        )
+    state = "on" if profiler.enabled else "off"
+    print(f"Profiling is {state} (sample rate {profiler.sample_rate:g}, slow threshold {profiler.slow_ms} ms).")
+    print(f"Profiles and slow-request log: {profiler.profile_dir}")
+    return 0
+
+
+def _usage_service():
+    # Lazy imports, same as start_server: the server modules need Flask.
+    from metadata_store import MetadataStore
+    from storage_service import create_storage
+    from usage_service import UsageService
+
+    upload_folder = UPLOAD_FOLDER
+    os.makedirs(upload_folder, exist_ok=True)
+    metadata = MetadataStore(os.path.join(upload_folder, ".fts_meta.sqlite3"))
+    service = UsageService.from_env(metadata, create_storage(upload_folder))
+    service.ensure_initialized()
+    return service
+
+
+def manage_quota(folder=None, quota_bytes=None, quota_files=None):
+    service = _usage_service()
+    if folder and (quota_bytes is not None or quota_files is not None):
+        service.set_quota(
+            folder,
+            None if quota_bytes is None else max(0, quota_bytes),
+            None if quota_files is None else max(0, quota_files),
+        )
+    folders = [folder] if folder else sorted(service.all_usage())
+    if not folders:
+        print("No folders yet.")
+    for name in folders:
+        usage = service.get_usage(name)
+        quota = service.get_quota(name)
+        limit_bytes = quota["bytes"] or "unlimited"
+        limit_files = quota["files"] or "unlimited"
+        print(f"{name}: {usage['bytes']} bytes / {limit_bytes}, {usage['files']} files / {limit_files}")
+    return 0
+
+
+def manage_retention(folder=None, max_age_hours=None, max_idle_hours=None, max_bytes=None, sweep=False):
+    from pin_service import PinService
+    from retention_service import RetentionService
+
+    usage = _usage_service()
+    pin_service = PinService(UPLOAD_FOLDER, os.environ.get("FLASK_SECRET_KEY", ""), usage.storage)
+    # Sweep deletes must reach search, digests, live listings and replication too.
+    listeners = _storage_listeners(usage, pin_service)
+    for listener in listeners:
+        usage.storage.subscribe(listener.on_storage_change)
+    service = next(listener for listener in listeners if isinstance(listener, RetentionService))
+    if folder and (max_age_hours is not None or max_idle_hours is not None or max_bytes is not None):
+        service.set_policy(
+            folder,
+            None if max_age_hours is None else max(0.0, max_age_hours) * 3600,
+            None if max_idle_hours is None else max(0.0, max_idle_hours) * 3600,
+            None if max_bytes is None else max(0, max_bytes),
+        )
+    if sweep:
+        print(f"Sweep removed {service.sweep_once()} file(s).")
+    folders = [folder] if folder else sorted(usage.all_usage())
+    for name in folders:
+        policy = service.get_policy(name)
+        parts = []
+        if policy["max_age"]:
+            parts.append(f"max age {policy['max_age'] / 3600:g} h")
+        if policy["max_idle"]:
+            parts.append(f"max idle {policy['max_idle'] / 3600:g} h")
+        if policy["max_bytes"]:
+            parts.append(f"max size {policy['max_bytes']} bytes")
+        print(f"{name}: {', '.join(parts) or 'keep forever'}")
+    return 0
+
+
+def rebalance_volumes(dry_run=False):
+    import shutil
+
+    from storage_service import MultiVolumeStorage, create_storage
+
+    storage = create_storage(UPLOAD_FOLDER)
+    if not isinstance(storage, MultiVolumeStorage):
+        print("Only one volume is configured (set FTS_VOLUMES to add more).")
+        return 0
+    target = storage.target_volumes()
+    moves = [(folder, storage.volume_for(folder), volume) for folder, volume in target.items()]
+    moves = [(folder, source, volume) for folder, source, volume in moves if source is not volume]
+    failed = 0
+    for folder, source, volume in moves:
+        if dry_run:
+            print(f"{folder}: {source.root} -> {volume.root}")
+            continue
+        started = time.monotonic()
+        try:
+            copied = storage.move_folder(folder, volume)
+        except (OSError, TimeoutError) as exc:
+            print(f"{folder}: not moved ({exc}); run again later.")
+            failed += 1
+            continue
+        print(f"{folder}: {source.root} -> {volume.root} ({copied} bytes in {time.monotonic() - started:.1f}s)")
+    for volume in storage.volumes:
+        count = sum(1 for v in target.values() if v is volume)
+        free = shutil.disk_usage(volume.root).free
+        print(f"{volume.root}: {count} folder(s), {free // (1024 * 1024)} MB free")
+    verb = "would move" if dry_run else "moved"
+    print(f"Rebalance {verb} {len(moves) - failed} of {len(target)} folder(s).")
+    return 1 if failed else 0
+
+
+def replication_status():
+    from pin_service import PinService
+    from replication_service import ReplicationService
+
+    usage = _usage_service()
+    pin_service = PinService(UPLOAD_FOLDER, os.environ.get("FLASK_SECRET_KEY", ""), usage.storage)
+    try:
+        service = ReplicationService.from_env(usage.metadata, usage.storage, pin_service)
+    except RuntimeError as exc:
+        print(exc)
+        return 1
+    if service is None:
+        print("Replication is off (set FTS_REPLICATION_PEERS and FTS_REPLICATION_SECRET).")
+        return 0
+    for peer in service.status():
+        if peer["last_ok"]:
+            ago = f"last success {int(time.time() - peer['last_ok'])}s ago"
+        else:
+            ago = "never reached"
+        line = f"{peer['peer']}: {peer['pending']} change(s) pending, {ago}"
+        if peer["last_error"]:
+            line += f", {peer['failures']} failure(s) in a row: {peer['last_error']}"
+        print(line)
+    return 0
+
+
+def _transfer_client(server, jobs, pin):
+    # Lazy import, like the server modules.
+    import getpass
+
+    from transfer_client import TransferClient
+
+    def ask_pin(folder):
+        if not sys.stdin.isatty():
+            return None
+        return getpass.getpass(f"PIN for folder {folder}: ").strip()
+
+    return TransferClient(server, jobs=jobs, pin=pin, ask_pin=ask_pin)
+
+
+def push_files(source, server=None, jobs=4, pin=None):
+    from transfer_client import TransferError
+
+    if not os.path.exists(source):
+        print(f"{source}: no such file or directory.")
+        return 1
+    try:
+        return _transfer_client(server, jobs, pin).push(source)
+    except (TransferError, OSError) as exc:
+        print(f"Push failed: {exc}")
+        return 1
+
+
+def pull_files(folder, dest, server=None, jobs=4, pin=None):
+    from transfer_client import TransferError
+
+    try:
+        return _transfer_client(server, jobs, pin).pull(folder, dest)
+    except (TransferError, OSError) as exc:
+        print(f"Pull failed: {exc}")
+        return 1
+
+
+def _storage_listeners(usage, pin_service):
+    """The storage listeners the server keeps, for commands that add or remove files.
+
+    With them attached, folder usage, the search index, retention, digests,
+    open listings and the replication journal follow the change.
+    """
+    from digest_service import DigestService
+    from live_service import LiveUpdates
+    from replication_service import ReplicationService
+    from retention_service import RetentionService
+    from search_service import SearchService
+
+    retention = RetentionService.from_env(usage.metadata, usage.storage, usage)
+    retention.ensure_initialized()
+    search = SearchService(usage.metadata, usage.storage)
+    search.ensure_initialized()
+    listeners = [usage, retention, search, DigestService(usage.metadata, usage.storage), LiveUpdates(usage.metadata)]
+    try:
+        replication = ReplicationService.from_env(usage.metadata, usage.storage, pin_service)
+    except RuntimeError:
+        replication = None
+    if replication is not None:
+        listeners.append(replication)
+    return listeners
+
+
+def import_files(source, folder, jobs=None, pin=None, overwrite=False):
+    import getpass
+
+    from digest_service import DigestService
+    from import_service import BulkImport, BulkImportError
+    from pin_service import PinService
+
+    usage = _usage_service()
+    storage, metadata = usage.storage, usage.metadata
+    pin_service = PinService(UPLOAD_FOLDER, os.environ.get("FLASK_SECRET_KEY", ""), storage)
+    fek_b64 = None
+    if pin_service.folder_has_encryption(folder):
+        if pin is None and sys.stdin.isatty():
+            pin = getpass.getpass(f"PIN for folder {folder}: ")
+        fek_b64 = pin_service.fek_b64_for_pin(folder, pin)
+        if not fek_b64:
+            print(f"Wrong or missing PIN for {folder}; nothing imported.")
+            return 1
+
+    listeners = _storage_listeners(usage, pin_service)
+    for listener in listeners:
+        storage.subscribe(listener.on_storage_change)
+    digests = next(listener for listener in listeners if isinstance(listener, DigestService))
+
+    importer = BulkImport(storage, metadata, digests, UPLOAD_FOLDER, fek_b64=fek_b64, jobs=jobs)
+    try:
+        summary = importer.run(folder, source, overwrite=overwrite)
+    except (BulkImportError, ValueError) as exc:
+        print(f"Import failed: {exc}")
+        return 1
+    encrypted = " (encrypted)" if fek_b64 else ""
+    print(
+        f"Imported {summary['imported']} file(s){encrypted}, {summary['bytes'] / (1024 * 1024):.1f} MB "
+        f"in {summary['seconds']:.1f}s; {summary['skipped']} already there, {summary['failed']} failed."
+    )
+    return 1 if summary["failed"] else 0
+
+
+def verify_files(folders=None, jobs=None, pin=None, quarantine=False, restart=False):
+    import getpass
+
+    from digest_service import DigestService
+    from pin_service import PinService
+    from verify_service import BAD, IntegrityScan
+
+    usage = _usage_service()
+    storage, metadata = usage.storage, usage.metadata
+    pin_service = PinService(UPLOAD_FOLDER, os.environ.get("FLASK_SECRET_KEY", ""), storage)
+    DigestService(metadata, storage)  # makes sure file_digests exists on a fresh tree
+    if folders:
+        missing = [name for name in folders if not storage.folder_exists(name)]
+        if missing:
+            print(f"No such folder: {', '.join(missing)}")
+            return 1
+    else:
+        folders = sorted(storage.list_folders())
+
+    # Encrypted folders are fully checked only with their key; without it, files are
+    # checked for the shape of an encrypted file.
+    keys = {}
+    for folder in folders:
+        if not pin_service.folder_has_encryption(folder):
+            continue
+        folder_pin = pin
+        if folder_pin is None and sys.stdin.isatty():
+            folder_pin = getpass.getpass(f"PIN for folder {folder} (Enter to skip the key check): ")
+        if not folder_pin:
+            continue
+        fek_b64 = pin_service.fek_b64_for_pin(folder, folder_pin)
+        if fek_b64:
+            keys[folder] = fek_b64
+        elif pin is None or len(folders) == 1:
+            print(f"Wrong PIN for {folder}; checking the shape of its files only.")
+
+    if quarantine:
+        # Quarantined files leave their folder: keep usage and the rest in step.
+        for listener in _storage_listeners(usage, pin_service):
+            storage.subscribe(listener.on_storage_change)
+    scan = IntegrityScan(storage, metadata, pin_service, UPLOAD_FOLDER, jobs=jobs)
+    result = scan.run(folders, keys, quarantine=quarantine, restart=restart)
+    counts = result["counts"]
+    summary = ", ".join(f"{counts[status]} {status}" for status in sorted(counts)) or "no files"
+    print(f"Scan #{result['run']} of {len(folders)} folder(s): {summary}.")
+    bad = sum(counts.get(status, 0) for status in BAD)
+    if bad and not quarantine:
+        print(f"{bad} damaged file(s); run again with --quarantine to move them to uploads/.fts_quarantine/.")
+    return 1 if bad else 0
+
+
+def load_test(**options):
+    # Lazy import: the harness pulls in the server modules.
+    from load_harness import run_load_test
+
+    return run_load_test(**options)
+
+
 def stop_server(port=8069):
     stopped_any = False
     failed = False
     pid = _read_pid()
     if pid and _is_running(pid):
-        if _terminate_pid(pid):
+        # A worker pool drains in-flight requests before exiting.
+        timeout = 10.0 if _read_worker_pids() else 2.0
+        if _terminate_pid(pid, timeout):
             _clear_pid_if_matches(pid)
             print(f"Server stopped (PID {pid}).")
             stopped_any = True
@@ -183,11 +538,40 @@ def stop_server(port=8069):
     return 1 if failed else 0
 
 
+def reload_server(timeout=60.0):
+    pid = _read_pid()
+    if not pid or not _is_running(pid):
+        print("Server is not running.")
+        return 1
+    old_workers = set(_read_worker_pids())
+    if not old_workers or not hasattr(signal, "SIGHUP"):
+        print("Reload needs a worker pool. Start the server with `fts start --workers N`.")
+        return 1
+    os.kill(pid, signal.SIGHUP)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.5)
+        if not _is_running(pid):
+            print("Server exited during reload.")
+            return 1
+        # Old workers stay listed while they drain; the new ones show up next to them.
+        new_workers = set(_read_worker_pids()) - old_workers
+        if new_workers and len(new_workers) >= len(old_workers):
+            print(f"Reload started: new worker PID(s) {', '.join(map(str, sorted(new_workers)))}.")
+            print("Old workers stop accepting once the new ones are up, then finish their in-flight transfers.")
+            return 0
+    print("Reload signal sent, but new workers did not appear in time; see the server log.")
+    return 1
+
+
 def status_server(port=8069):
     port_pids = _listening_pids(port)
     pid = _read_pid()
     if pid and _is_running(pid) and (pid in port_pids or not port_pids):
         print(f"Server is running (PID {pid}) on port {port}.")
+        workers = [w for w in _read_worker_pids() if _is_running(w)]
+        if workers:
+            print(f"Worker pool: {len(workers)} worker(s) (PID(s): {', '.join(map(str, workers))}).")
         return 0
     if port_pids:
         pids_text = ", ".join(map(str, port_pids))
@@ -214,24 +598,161 @@ def main(argv=None):
     start_parser = sub.add_parser("start", help="Start the server")
     start_parser.add_argument("--host", default="0.0.0.0", help="Host to bind (default: 0.0.0.0)")
     start_parser.add_argument("--port", type=int, default=8069, help="Port to bind (default: 8069)")
+    start_parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Serve from N worker processes sharing the port (default: single process)",
+    )
+    start_parser.add_argument(
+        "--profile-sample",
+        type=float,
+        default=None,
+        help="Fraction of requests (0-1) to run under cProfile",
+    )
+    start_parser.add_argument(
+        "--profile-slow-ms",
+        type=int,
+        default=None,
+        help="Log requests slower than this many milliseconds",
+    )
 
     stop_parser = sub.add_parser("stop", help="Stop the server started by fts")
     stop_parser.add_argument("--port", type=int, default=8069, help="Port to check/stop (default: 8069)")
 
+    sub.add_parser("reload", help="Start fresh workers and drain the old ones (worker pool only)")
+
     status_parser = sub.add_parser("status", help="Show server status")
     status_parser.add_argument("--port", type=int, default=8069, help="Port to check (default: 8069)")
 
+    profile_parser = sub.add_parser(
+        "profile",
+        help="Show or change request profiling on a running server",
+        description="Saved settings apply to running servers right away. FTS_PROFILE_SAMPLE and "
+        "FTS_PROFILE_SLOW_MS, when set, override them when a server starts.",
+    )
+    profile_parser.add_argument("--sample", type=float, default=None, help="Fraction of requests (0-1) to profile")
+    profile_parser.add_argument("--slow-ms", type=int, default=None, help="Slow-request log threshold in milliseconds")
+    profile_parser.add_argument("--off", action="store_true", help="Turn profiling off")
+
+    quota_parser = sub.add_parser("quota", help="Show folder usage or set a folder quota")
+    quota_parser.add_argument("folder", nargs="?", help="Folder to show or change (default: all)")
+    quota_parser.add_argument("--bytes", type=int, default=None, help="Byte quota for the folder (0 = unlimited)")
+    quota_parser.add_argument("--files", type=int, default=None, help="File-count quota for the folder (0 = unlimited)")
+
+    retention_parser = sub.add_parser("retention", help="Show or set retention policies")
+    retention_parser.add_argument("folder", nargs="?", help="Folder to show or change (default: all)")
+    retention_parser.add_argument("--max-age-hours", type=float, default=None, help="Delete files older than this (0 = off)")
+    retention_parser.add_argument("--max-idle-hours", type=float, default=None, help="Delete files not downloaded for this long (0 = off)")
+    retention_parser.add_argument("--max-bytes", type=int, default=None, help="Evict oldest files above this folder size (0 = off)")
+    retention_parser.add_argument("--sweep", action="store_true", help="Run one sweep now")
+
+    server_help = "Server URL (default: $FTS_SERVER or http://127.0.0.1:8069)"
+    sub.add_parser("replication", help="Show replication lag and errors per peer")
+
+    rebalance_parser = sub.add_parser("rebalance", help="Move folders between storage volumes (FTS_VOLUMES)")
+    rebalance_parser.add_argument("--dry-run", action="store_true", help="Only show which folders would move")
+
+    push_parser = sub.add_parser("push", help="Upload a file or directory to your folder on a server")
+    push_parser.add_argument("source", help="File or directory to upload")
+    push_parser.add_argument("--server", default=None, help=server_help)
+    push_parser.add_argument("--jobs", "-j", type=int, default=4, help="Parallel connections (default: 4)")
+    push_parser.add_argument("--pin", default=None, help="Folder PIN (asked for when needed)")
+
+    pull_parser = sub.add_parser("pull", help="Download a folder from a server")
+    pull_parser.add_argument("folder", help="Folder to download")
+    pull_parser.add_argument("dest", nargs="?", default=".", help="Local directory (default: current directory)")
+    pull_parser.add_argument("--server", default=None, help=server_help)
+    pull_parser.add_argument("--jobs", "-j", type=int, default=4, help="Parallel connections (default: 4)")
+    pull_parser.add_argument("--pin", default=None, help="Folder PIN (asked for when needed)")
+
+    import_parser = sub.add_parser("import", help="Copy a local directory tree straight into an uploads folder")
+    import_parser.add_argument("source", help="Directory to import")
+    import_parser.add_argument("--folder", required=True, help="Uploads folder to import into")
+    import_parser.add_argument("--jobs", "-j", type=int, default=None, help="Worker processes (default: one per core)")
+    import_parser.add_argument("--pin", default=None, help="Folder PIN for an encrypted folder (asked for when needed)")
+    import_parser.add_argument("--overwrite", action="store_true", help="Replace files the import did not create")
+
+    verify_parser = sub.add_parser("verify", help="Check stored files for damage, in parallel (resumable)")
+    verify_parser.add_argument("folders", nargs="*", help="Folders to check (default: all)")
+    verify_parser.add_argument("--jobs", "-j", type=int, default=None, help="Worker processes (default: one per core)")
+    verify_parser.add_argument("--pin", default=None, help="PIN to try for encrypted folders (asked for when needed)")
+    verify_parser.add_argument("--quarantine", action="store_true", help="Move damaged files to uploads/.fts_quarantine/")
+    verify_parser.add_argument("--restart", action="store_true", help="Start over instead of resuming an interrupted scan")
+
+    load_parser = sub.add_parser("loadtest", help="Load or soak test a local server on a synthetic uploads tree")
+    load_parser.add_argument("--folders", type=int, default=20, help="Synthetic IP folders (default: 20)")
+    load_parser.add_argument("--files", type=int, default=20, help="Files per folder (default: 20)")
+    load_parser.add_argument(
+        "--sizes", default="mixed", help="small, mixed, large or size:weight,... like 4k:70,1m:25,32m:5 (default: mixed)"
+    )
+    load_parser.add_argument("--encrypted", type=float, default=0.3, help="Share of folders with a PIN (default: 0.3)")
+    load_parser.add_argument("--duration", type=float, default=60, help="Seconds of load (default: 60)")
+    load_parser.add_argument("--concurrency", "-c", type=int, default=16, help="Simulated clients (default: 16)")
+    load_parser.add_argument("--workers", type=int, default=0, help="Server worker processes (default: none)")
+    load_parser.add_argument("--port", type=int, default=8169, help="Port for the server under test (default: 8169)")
+    load_parser.add_argument("--interval", type=float, default=5, help="Seconds per report line (default: 5)")
+    load_parser.add_argument(
+        "--mix", default="download:40,list:25,preview:15,upload:15,unlock:5", help="Operation weights"
+    )
+    load_parser.add_argument("--dir", default=None, help="Empty directory for the tree (default: a temp dir)")
+    load_parser.add_argument("--keep", action="store_true", help="Keep the temp dir and server.log afterwards")
+    load_parser.add_argument("--json", default=None, help="Also write the results to this JSON file")
+    load_parser.add_argument("--seed", type=int, default=None, help="Seed for a repeatable tree and workload")
+
     args = parser.parse_args(argv)
     command = args.command or "start"
 
     if command == "start" or command is None:
         host = getattr(args, "host", "0.0.0.0")
         port = getattr(args, "port", 8069)
-        return start_server(host, port)
+        sample_rate = getattr(args, "profile_sample", None)
+        slow_ms = getattr(args, "profile_slow_ms", None)
+        if sample_rate is not None or slow_ms is not None:
+            if configure_profiling(sample_rate, slow_ms) != 0:
+                return 1
+        return start_server(host, port, max(0, getattr(args, "workers", 0) or 0))
     if command == "stop":
         return stop_server(getattr(args, "port", 8069))
+    if command == "reload":
+        return reload_server()
     if command == "status":
         return status_server(getattr(args, "port", 8069))
+    if command == "profile":
+        return configure_profiling(args.sample, args.slow_ms, off=args.off)
+    if command == "quota":
+        return manage_quota(args.folder, args.bytes, args.files)
+    if command == "retention":
+        return manage_retention(args.folder, args.max_age_hours, args.max_idle_hours, args.max_bytes, args.sweep)
+    if command == "rebalance":
+        return rebalance_volumes(args.dry_run)
+    if command == "replication":
+        return replication_status()
+    if command == "push":
+        return push_files(args.source, args.server, args.jobs, args.pin)
+    if command == "pull":
+        return pull_files(args.folder, args.dest, args.server, args.jobs, args.pin)
+    if command == "import":
+        return import_files(args.source, args.folder, args.jobs, args.pin, args.overwrite)
+    if command == "verify":
+        return verify_files(args.folders, args.jobs, args.pin, args.quarantine, args.restart)
+    if command == "loadtest":
+        return load_test(
+            folders=args.folders,
+            files_per_folder=args.files,
+            size_mix=args.sizes,
+            encrypted_ratio=args.encrypted,
+            duration=args.duration,
+            concurrency=args.concurrency,
+            workers=args.workers,
+            port=args.port,
+            interval=args.interval,
+            op_mix=args.mix,
+            workdir=args.dir,
+            keep=args.keep,
+            json_path=args.json,
+            seed=args.seed,
+        )
 
     parser.print_help()
     return 1
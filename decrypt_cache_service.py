@@ -0,0 +1,103 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from profiling_service import timed_phase
+
+
+def key_fingerprint(fek_b64):
+    """Short, one-way id of a folder key; cache entries are only valid under the key that made them."""
+    if isinstance(fek_b64, str):
+        fek_b64 = fek_b64.encode("ascii")
+    return hashlib.sha256(fek_b64).hexdigest()[:16]
+
+
+class DecryptCache:
+    """Bounded in-memory LRU of decrypted files from encrypted folders.
+
+    Entries are keyed by (folder, name) and remember the file version they
+    were decrypted from (size and mtime, plus inode and nanosecond mtime on
+    local disks) and the fingerprint of the folder key. A lookup only hits
+    when both still match, so a file rewritten by another worker process or
+    a folder re-keyed after a PIN change is simply a miss. Storage events
+    and PIN changes in this process drop entries right away. Plaintext is
+    held in memory only; files above `max_file_bytes` are never cached so
+    one large download cannot flush everything else.
+    """
+
+    def __init__(self, storage, max_bytes, max_file_bytes=None):
+        self.storage = storage
+        self.max_bytes = int(max_bytes)
+        self.max_file_bytes = int(max_file_bytes or self.max_bytes // 4)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, storage):
+        """None unless FTS_DECRYPT_CACHE_MB is set to a positive size."""
+        max_mb = _env_int("FTS_DECRYPT_CACHE_MB", 0)
+        if max_mb <= 0:
+            return None
+        max_file_mb = _env_int("FTS_DECRYPT_CACHE_MAX_FILE_MB", 0)
+        return cls(storage, max_mb * 1024 * 1024, max_file_mb * 1024 * 1024 or None)
+
+    def _version(self, folder, name, stored):
+        local = self.storage.local_path(folder, name)
+        if local is not None:
+            try:
+                st = os.stat(local)
+                return (st.st_size, st.st_mtime_ns, st.st_ino)
+            except OSError:
+                return None
+        return (stored.size, stored.mtime)
+
+    def read(self, folder, name, stored, fernet, key_id):
+        """Plaintext of an encrypted file, from the cache or decrypted now. Returns (plaintext, hit)."""
+        version = self._version(folder, name, stored)
+        with self._lock:
+            entry = self._entries.get((folder, name))
+            if entry is not None and entry[0] == version and entry[1] == key_id:
+                self._entries.move_to_end((folder, name))
+                return entry[2], True
+        with timed_phase("io"):
+            ciphertext = self.storage.read_bytes(folder, name)
+        with timed_phase("crypto"):
+            plaintext = fernet.decrypt(ciphertext)
+        if version is not None and len(plaintext) <= self.max_file_bytes:
+            self._put((folder, name), (version, key_id, plaintext))
+        return plaintext, False
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = entry
+            self._size += len(entry[2])
+            while self._size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted[2])
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[2])
+
+    def invalidate(self, folder, name=None):
+        """Forget one file, or with no name every file of the folder."""
+        with self._lock:
+            if name is not None:
+                self._drop((folder, name))
+                return
+            for key in [key for key in self._entries if key[0] == folder]:
+                self._drop(key)
+
+    def on_storage_change(self, event, folder, name, old, new):
+        self.invalidate(folder, None if event == "delete_folder" else name)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
@@ -8,15 +8,13 @@ def decrypt_fek(encrypted_fek_b64, kek_b64):
     return fernet_kek.decrypt(base64.b64decode(encrypted_fek_b64))
 
 
-def decrypt_existing_files(folder_path, fernet):
-    if not folder_path.is_dir():
+def decrypt_existing_files(storage, folder_name, fernet):
+    if not storage.folder_exists(folder_name):
         return
-    for item in folder_path.iterdir():
-        if not item.is_file():
-            continue
+    for item in storage.list_files(folder_name):
         try:
-            data = item.read_bytes()
+            data = storage.read_bytes(folder_name, item.name)
             decrypted = fernet.decrypt(data)
-            item.write_bytes(decrypted)
+            storage.write_bytes(folder_name, item.name, decrypted, preserve_mtime=True)
         except Exception:
             pass
@@ -0,0 +1,319 @@
+import hashlib
+import os
+import struct
+import tempfile
+import zlib
+from io import BytesIO
+
+from storage_service import CHUNK_SIZE
+
+
+# Weak checksum is Adler-32 (zlib.adler32 for whole blocks, rolled one byte at a time
+# in between); strong checksum is a 16-byte BLAKE2b.
+ADLER_MOD = 65521
+MIN_BLOCK_SIZE = 4 * 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+
+# Delta stream records:
+#   b"C" + >QI  copy `count` basis blocks starting at block `index`
+#   b"L" + >I   literal data of that many bytes follows
+#   b"E"        end of stream
+COPY = b"C"
+LITERAL = b"L"
+END = b"E"
+MAX_LITERAL = 4 * 1024 * 1024
+# In a long unmatched run, do a byte-wise search window once every this many blocks.
+RESYNC_EVERY = 64
+
+
+class DeltaError(ValueError):
+    pass
+
+
+def choose_block_size(size):
+    """About sqrt(size), rounded to a power of two: ~64 KB blocks for a 5 GB file."""
+    block = MIN_BLOCK_SIZE
+    while block < MAX_BLOCK_SIZE and block * block < size:
+        block *= 2
+    return block
+
+
+def strong_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def block_signatures(chunks, block_size):
+    """Signatures for a basis given as an iterable of byte chunks.
+
+    Returns {"size", "block_size", "sha256", "blocks": [[weak, strong], ...]};
+    the last block may be short.
+    """
+    blocks = []
+    sha = hashlib.sha256()
+    size = 0
+    pending = bytearray()
+    for chunk in chunks:
+        sha.update(chunk)
+        size += len(chunk)
+        pending += chunk
+        while len(pending) >= block_size:
+            block = bytes(pending[:block_size])
+            del pending[:block_size]
+            blocks.append([zlib.adler32(block), strong_hash(block)])
+    if pending:
+        block = bytes(pending)
+        blocks.append([zlib.adler32(block), strong_hash(block)])
+    return {"size": size, "block_size": block_size, "sha256": sha.hexdigest(), "blocks": blocks}
+
+
+def _roll(weak, out_byte, in_byte, block_size):
+    a = weak & 0xFFFF
+    b = weak >> 16
+    a = (a - out_byte + in_byte) % ADLER_MOD
+    b = (b - block_size * out_byte + a - 1) % ADLER_MOD
+    return (b << 16) | a
+
+
+def generate_delta(fh, signatures, read_size=CHUNK_SIZE):
+    """Yield delta records turning the basis described by `signatures` into `fh`'s content.
+
+    Matches are searched byte by byte right after a mismatch, as rsync does.
+    To keep the pure-Python search affordable on data with no matches at all,
+    a long unmatched run only probes once per block, re-doing a full byte-wise
+    window every RESYNC_EVERY blocks so an insertion is still picked up.
+    """
+    block_size = int(signatures["block_size"])
+    table = {}
+    for index, (weak, strong) in enumerate(signatures["blocks"]):
+        table.setdefault(int(weak), {}).setdefault(strong, index)
+    full_blocks = int(signatures["size"]) // block_size
+
+    buf = bytearray()
+    pos = 0
+    eof = False
+    literal = bytearray()
+    copy_start = None
+    copy_count = 0
+    weak = None
+    rolling_budget = 2 * block_size
+    stride_probes = 0
+
+    def fill(need):
+        nonlocal eof, buf, pos
+        if pos > read_size:
+            del buf[:pos]
+            pos = 0
+        while not eof and len(buf) - pos < need:
+            data = fh.read(read_size)
+            if not data:
+                eof = True
+                break
+            buf += data
+
+    def flush_copy():
+        nonlocal copy_start, copy_count
+        if copy_count:
+            yield COPY + struct.pack(">QI", copy_start, copy_count)
+        copy_start, copy_count = None, 0
+
+    def flush_literal():
+        nonlocal literal
+        for offset in range(0, len(literal), MAX_LITERAL):
+            piece = bytes(literal[offset:offset + MAX_LITERAL])
+            yield LITERAL + struct.pack(">I", len(piece)) + piece
+        literal = bytearray()
+
+    while True:
+        fill(block_size + 1)
+        available = len(buf) - pos
+        if available < block_size:
+            break
+        if weak is None:
+            weak = zlib.adler32(buf[pos:pos + block_size])
+        index = None
+        candidates = table.get(weak)
+        if candidates:
+            index = candidates.get(strong_hash(bytes(buf[pos:pos + block_size])))
+            if index is not None and index >= full_blocks:
+                index = None  # only whole blocks are copied mid-stream
+        if index is not None:
+            if literal:
+                yield from flush_copy()
+                yield from flush_literal()
+            if copy_count and copy_start + copy_count == index:
+                copy_count += 1
+            else:
+                yield from flush_copy()
+                copy_start, copy_count = index, 1
+            pos += block_size
+            weak = None
+            rolling_budget = 2 * block_size
+            stride_probes = 0
+            continue
+        if copy_count:
+            yield from flush_copy()
+        if rolling_budget > 0 and available > block_size:
+            rolling_budget -= 1
+            literal.append(buf[pos])
+            weak = _roll(weak, buf[pos], buf[pos + block_size], block_size)
+            pos += 1
+        else:
+            literal += buf[pos:pos + block_size]
+            pos += block_size
+            weak = None
+            stride_probes += 1
+            if stride_probes >= RESYNC_EVERY:
+                rolling_budget = block_size
+                stride_probes = 0
+        if len(literal) >= MAX_LITERAL:
+            yield from flush_literal()
+
+    # Tail shorter than a block: match the basis' short last block, else send it.
+    tail = bytes(buf[pos:])
+    last = len(signatures["blocks"]) - 1
+    if tail and last >= full_blocks and signatures["blocks"][last][1] == strong_hash(tail):
+        yield from flush_literal()
+        if copy_count and copy_start + copy_count == last:
+            copy_count += 1
+        else:
+            yield from flush_copy()
+            copy_start, copy_count = last, 1
+        yield from flush_copy()
+    else:
+        yield from flush_copy()
+        literal += tail
+        yield from flush_literal()
+    yield END
+
+
+def _read_exact(stream, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise DeltaError("Delta stream ended early.")
+        data += chunk
+    return bytes(data)
+
+
+def apply_delta(stream, read_basis, block_size, basis_size, out, expected_size):
+    """Rebuild the new file into `out` from a delta stream.
+
+    `read_basis(start, end)` yields basis bytes in [start, end). Returns
+    (size, sha256 hexdigest) of what was written. A record that would take
+    the output past `expected_size` is refused before anything is written
+    for it, so a small delta cannot expand into an unbounded file.
+    """
+    sha = hashlib.sha256()
+    size = 0
+    while True:
+        kind = stream.read(1)
+        if kind == END:
+            break
+        if kind == COPY:
+            index, count = struct.unpack(">QI", _read_exact(stream, 12))
+            start = index * block_size
+            end = min(basis_size, start + count * block_size)
+            if count < 1 or start >= basis_size:
+                raise DeltaError("Delta refers to blocks past the end of the file.")
+            if size + (end - start) > expected_size:
+                raise DeltaError("Delta rebuilds more than the declared size.")
+            for data in read_basis(start, end):
+                sha.update(data)
+                out.write(data)
+                size += len(data)
+        elif kind == LITERAL:
+            (length,) = struct.unpack(">I", _read_exact(stream, 4))
+            if length > MAX_LITERAL:
+                raise DeltaError("Literal record too large.")
+            if size + length > expected_size:
+                raise DeltaError("Delta rebuilds more than the declared size.")
+            data = _read_exact(stream, length)
+            sha.update(data)
+            out.write(data)
+            size += length
+        else:
+            raise DeltaError("Malformed delta stream.")
+    return size, sha.hexdigest()
+
+
+class DeltaService:
+    """Server side of delta uploads: signatures for a stored file, and patching it.
+
+    Encrypted folders work on the decrypted content (Fernet tokens are not
+    block-addressable); the rebuilt plaintext is encrypted again before it is
+    stored, exactly like a normal encrypted upload.
+    """
+
+    def __init__(self, storage, digest_service):
+        self.storage = storage
+        self.digest_service = digest_service
+
+    def _plaintext(self, folder, name, fernet):
+        return fernet.decrypt(self.storage.read_bytes(folder, name))
+
+    def signatures(self, folder, name, fernet=None, block_size=None):
+        stored = self.storage.stat(folder, name)
+        if stored is None:
+            return None
+        if fernet is not None:
+            plaintext = self._plaintext(folder, name, fernet)
+            size = len(plaintext)
+            chunks = (plaintext[i:i + CHUNK_SIZE] for i in range(0, size, CHUNK_SIZE))
+        else:
+            size = stored.size
+            chunks = self.storage.iter_range(folder, name, 0, size)
+        block_size = int(block_size or choose_block_size(size))
+        block_size = max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, block_size))
+        signatures = block_signatures(chunks, block_size)
+        # The basis was read in full anyway: refresh its recorded digest.
+        self.digest_service.record(folder, name, signatures["sha256"], signatures["size"], stored)
+        return signatures
+
+    def apply(self, folder, name, stream, block_size, expected_sha256, expected_size, fernet=None):
+        """Rebuild `name` from its current content plus a delta; commit only if it matches.
+
+        Returns the new plaintext size. Raises DeltaError on a bad stream or digest.
+        """
+        if expected_size is None or int(expected_size) < 0:
+            raise DeltaError("The size of the new content is required.")
+        expected_size = int(expected_size)
+        stored = self.storage.stat(folder, name)
+        if stored is None:
+            raise DeltaError("Nothing to patch: the file does not exist.")
+        if fernet is not None:
+            basis = self._plaintext(folder, name, fernet)
+
+            def read_basis(start, end):
+                yield basis[start:end]
+
+            out = BytesIO()
+            size, sha256 = apply_delta(stream, read_basis, block_size, len(basis), out, expected_size)
+            self._check(size, sha256, expected_size, expected_sha256)
+            self.storage.write_bytes(folder, name, fernet.encrypt(out.getvalue()))
+        else:
+
+            def read_basis(start, end):
+                return self.storage.iter_range(folder, name, start, end)
+
+            # Build next to the target so committing is a rename on local disks.
+            fd, tmp_path = tempfile.mkstemp(prefix=".delta-", dir=self.storage.local_path(folder))
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    size, sha256 = apply_delta(stream, read_basis, block_size, stored.size, out, expected_size)
+                self._check(size, sha256, expected_size, expected_sha256)
+                self.storage.put_file(folder, name, tmp_path)
+            except BaseException:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                raise
+        self.digest_service.record(folder, name, sha256, size)
+        return size
+
+    def _check(self, size, sha256, expected_size, expected_sha256):
+        if size != expected_size:
+            raise DeltaError("Rebuilt file has the wrong size; the stored file may have changed.")
+        if expected_sha256 and sha256 != expected_sha256.lower():
+            raise DeltaError("Rebuilt file does not match; the stored file may have changed.")
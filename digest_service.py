@@ -0,0 +1,113 @@
+import hashlib
+import time
+
+
+class HashingReader:
+    """Wrap a binary stream and SHA-256 everything read through it."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        if data:
+            self.sha256.update(data)
+            self.size += len(data)
+        return data
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+class DigestService:
+    """SHA-256 of the plaintext of every file uploaded through the server.
+
+    Each row also remembers the size and mtime of the stored object it was
+    computed for; a digest only counts while the stored file still matches,
+    so files changed behind the server's back are never reported unchanged.
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS file_digests (
+            folder TEXT NOT NULL,
+            name TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            stored_size INTEGER NOT NULL,
+            stored_mtime INTEGER NOT NULL,
+            recorded REAL NOT NULL,
+            PRIMARY KEY (folder, name)
+        )""",
+    ]
+
+    def __init__(self, metadata, storage):
+        self.metadata = metadata
+        self.storage = storage
+        self.metadata.ensure_schema("digests", self.SCHEMA)
+
+    def record(self, folder, name, sha256, size, stored=None):
+        """Remember the plaintext digest for the file just written."""
+        if stored is None:
+            stored = self.storage.stat(folder, name)
+        if stored is None:
+            return
+        self.metadata.execute(
+            "INSERT OR REPLACE INTO file_digests "
+            "(folder, name, sha256, size, stored_size, stored_mtime, recorded) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (folder, name, sha256.lower(), int(size), stored.size, stored.mtime, time.time()),
+        )
+
+    def get(self, folder, name, stored=None):
+        """Return {"sha256", "size"} if a digest is recorded and still current."""
+        row = self.metadata.execute(
+            "SELECT sha256, size, stored_size, stored_mtime FROM file_digests WHERE folder = ? AND name = ?",
+            (folder, name),
+        ).fetchone()
+        if row is None:
+            return None
+        if stored is None:
+            stored = self.storage.stat(folder, name)
+        if stored is None or (stored.size, stored.mtime) != (row[2], row[3]):
+            return None
+        return {"sha256": row[0], "size": int(row[1])}
+
+    def unchanged(self, folder, candidates):
+        """Names from `candidates` ({name: (size, sha256)}) the folder already holds as-is."""
+        if not candidates:
+            return []
+        rows = self.metadata.execute(
+            "SELECT name, sha256, size, stored_size, stored_mtime FROM file_digests WHERE folder = ?",
+            (folder,),
+        ).fetchall()
+        recorded = {row[0]: row[1:] for row in rows if row[0] in candidates}
+        if not recorded:
+            return []
+        # One listing instead of a stat per file (a single request on S3).
+        stored = {item.name: item for item in self.storage.iter_files(folder) if item.name in recorded}
+        same = []
+        for name, (sha256, size, stored_size, stored_mtime) in recorded.items():
+            want_size, want_sha = candidates[name]
+            item = stored.get(name)
+            if item is None or (item.size, item.mtime) != (stored_size, stored_mtime):
+                continue
+            if int(want_size) == size and str(want_sha).lower() == sha256:
+                same.append(name)
+        return sorted(same)
+
+    def on_storage_change(self, event, folder, name, old, new):
+        if event == "delete_folder":
+            self.metadata.execute("DELETE FROM file_digests WHERE folder = ?", (folder,))
+            return
+        if event == "delete":
+            self.metadata.execute("DELETE FROM file_digests WHERE folder = ? AND name = ?", (folder, name))
+            return
+        if old is not None and new is not None and old.mtime == new.mtime:
+            # Encrypt/decrypt passes rewrite files in place and keep the mtime;
+            # the plaintext is the same, so carry the digest over.
+            self.metadata.execute(
+                "UPDATE file_digests SET stored_size = ?, stored_mtime = ? "
+                "WHERE folder = ? AND name = ? AND stored_size = ? AND stored_mtime = ?",
+                (new.size, new.mtime, folder, name, old.size, old.mtime),
+            )
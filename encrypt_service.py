@@ -8,15 +8,13 @@ def encrypt_fek(fek_bytes, kek_b64):
     return base64.b64encode(fernet_kek.encrypt(fek_bytes)).decode("ascii")
 
 
-def encrypt_existing_files(folder_path, fernet):
-    if not folder_path.is_dir():
+def encrypt_existing_files(storage, folder_name, fernet):
+    if not storage.folder_exists(folder_name):
         return
-    for item in folder_path.iterdir():
-        if not item.is_file():
-            continue
+    for item in storage.list_files(folder_name):
         try:
-            data = item.read_bytes()
+            data = storage.read_bytes(folder_name, item.name)
             encrypted = fernet.encrypt(data)
-            item.write_bytes(encrypted)
+            storage.write_bytes(folder_name, item.name, encrypted, preserve_mtime=True)
         except Exception:
             pass
@@ -0,0 +1,240 @@
+import hashlib
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.utils import secure_filename
+
+from storage_service import CHUNK_SIZE
+
+
+class BulkImportError(Exception):
+    pass
+
+
+_FERNET = None
+
+
+def _init_worker(fek_b64):
+    global _FERNET
+    if fek_b64:
+        from cryptography.fernet import Fernet
+
+        _FERNET = Fernet(fek_b64.encode("ascii"))
+
+
+def _prepare(job):
+    """Hash (and encrypt) one source file into its staging copy. Runs in a pool process.
+
+    Returns (sha256, plaintext size, None) or (None, None, error).
+    """
+    src, staged, mtime_ns = job
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(src, "rb") as fh, open(staged, "wb") as out:
+            if _FERNET is None:
+                for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+            else:
+                # Fernet tokens are not streamable: the whole file is one token, as on upload.
+                data = fh.read()
+                digest.update(data)
+                size = len(data)
+                out.write(_FERNET.encrypt(data))
+        os.utime(staged, ns=(mtime_ns, mtime_ns))
+    except OSError as exc:
+        try:
+            os.unlink(staged)
+        except OSError:
+            pass
+        return None, None, str(exc)
+    return digest.hexdigest(), size, None
+
+
+def scan_source(source):
+    """(relative path, absolute path, size, mtime_ns) for every regular file under `source`, sorted."""
+    found = []
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path, follow_symlinks=False)
+            except OSError:
+                continue
+            if not os.path.isfile(path) or os.path.islink(path):
+                continue
+            found.append((os.path.relpath(path, source), path, st.st_size, st.st_mtime_ns))
+    return found
+
+
+def target_name(relative_path):
+    """Folders are flat: `photos/2024/a.jpg` is stored as `photos_2024_a.jpg`."""
+    return secure_filename(relative_path.replace(os.sep, "/").replace("/", "_"))
+
+
+class BulkImport:
+    """Ingest a local directory tree straight into one uploads folder.
+
+    A process pool reads, hashes and (for an encrypted folder) encrypts each
+    file into a staging copy next to the uploads tree; this process then
+    moves it into place through the storage backend, so usage, search,
+    retention, live listings and replication hear about it exactly as they
+    do about an upload, and records the plaintext digest.
+
+    `import_files` remembers each source file (size, mtime) against the
+    stored file it became. A row is written before the file is moved in and
+    completed after, so a re-run skips what is already in place, redoes
+    anything interrupted, and never touches files it did not import unless
+    asked to overwrite.
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS import_files (
+            folder TEXT NOT NULL,
+            name TEXT NOT NULL,
+            source_size INTEGER NOT NULL,
+            source_mtime_ns INTEGER NOT NULL,
+            stored_size INTEGER,
+            stored_mtime REAL,
+            PRIMARY KEY (folder, name)
+        )""",
+    ]
+
+    STAGING_DIR = ".fts_import"
+    REPORT_EVERY_SEC = 2.0
+    # Files staged ahead of installation, per process: bounds the extra disk space used.
+    AHEAD_PER_JOB = 4
+
+    def __init__(self, storage, metadata, digest_service, upload_folder, fek_b64=None, jobs=None, out=print):
+        self.storage = storage
+        self.metadata = metadata
+        self.digest_service = digest_service
+        self.staging_root = os.path.join(upload_folder, self.STAGING_DIR)
+        self.fek_b64 = fek_b64
+        self.jobs = max(1, int(jobs or os.cpu_count() or 1))
+        self.out = out
+        self.metadata.ensure_schema("import", self.SCHEMA)
+
+    def _record(self, folder, name):
+        return self.metadata.execute(
+            "SELECT source_size, source_mtime_ns, stored_size, stored_mtime FROM import_files "
+            "WHERE folder = ? AND name = ?",
+            (folder, name),
+        ).fetchone()
+
+    def plan(self, folder, files, overwrite=False):
+        """Split source files into (todo, skipped, problems)."""
+        todo, skipped, problems = [], 0, []
+        seen = {}
+        for rel, path, size, mtime_ns in files:
+            name = target_name(rel)
+            if not name:
+                problems.append((rel, "no usable file name"))
+                continue
+            if name in seen:
+                problems.append((rel, f"same stored name as {seen[name]} ({name})"))
+                continue
+            seen[name] = rel
+            stored = self.storage.stat(folder, name)
+            row = self._record(folder, name)
+            if stored is not None and not overwrite:
+                # Redo interrupted files (pending row) and re-import changed sources, but
+                # leave files this import did not put there, or that changed since, alone.
+                if row is None or (row[2] is not None and (stored.size, stored.mtime) != (row[2], row[3])):
+                    problems.append((rel, f"{name} already exists (use --overwrite to replace it)"))
+                    continue
+                if row[2] is not None and (row[0], row[1]) == (size, mtime_ns):
+                    skipped += 1
+                    continue
+            todo.append((rel, path, name, size, mtime_ns))
+        return todo, skipped, problems
+
+    def run(self, folder, source, overwrite=False):
+        """Import `source` into `folder`. Returns a summary dict."""
+        if not os.path.isdir(source):
+            raise BulkImportError(f"{source}: not a directory.")
+        self.storage.create_folder(folder)
+        started = time.monotonic()
+        todo, skipped, problems = self.plan(folder, scan_source(source), overwrite)
+        for rel, reason in problems:
+            self.out(f"skipped {rel}: {reason}")
+        total_bytes = sum(job[3] for job in todo)
+        self.out(
+            f"{len(todo)} file(s) to import ({total_bytes / (1024 * 1024):.1f} MB), "
+            f"{skipped} already imported, {self.jobs} process(es)."
+        )
+
+        staging = os.path.join(self.staging_root, folder)
+        # Anything left here is from an interrupted run; its files are redone.
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging, exist_ok=True)
+        imported = failed = done_bytes = 0
+        last_report = time.monotonic()
+        try:
+            with ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker, initargs=(self.fek_b64,)) as pool:
+                queued = enumerate(todo)
+                pending = deque()
+                while True:
+                    while len(pending) < self.jobs * self.AHEAD_PER_JOB:
+                        number, entry = next(queued, (None, None))
+                        if entry is None:
+                            break
+                        staged = os.path.join(staging, f"{number}.part")
+                        pending.append((entry, staged, pool.submit(_prepare, (entry[1], staged, entry[4]))))
+                    if not pending:
+                        break
+                    (rel, _, name, size, mtime_ns), staged, future = pending.popleft()
+                    sha256, plain_size, error = future.result()
+                    if error is None:
+                        error = self._install(folder, name, staged, size, mtime_ns, sha256, plain_size)
+                    if error is not None:
+                        failed += 1
+                        self.out(f"failed {rel}: {error}")
+                    else:
+                        imported += 1
+                        done_bytes += size
+                    if time.monotonic() - last_report >= self.REPORT_EVERY_SEC:
+                        last_report = time.monotonic()
+                        rate = done_bytes / max(0.001, last_report - started) / (1024 * 1024)
+                        self.out(f"{imported + failed}/{len(todo)} file(s), {rate:.1f} MB/s")
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+            try:
+                os.rmdir(self.staging_root)
+            except OSError:
+                pass
+        return {
+            "imported": imported,
+            "skipped": skipped,
+            "failed": failed + len(problems),
+            "bytes": done_bytes,
+            "seconds": time.monotonic() - started,
+        }
+
+    def _install(self, folder, name, staged, size, mtime_ns, sha256, plain_size):
+        """Move one staged file into the folder; returns an error message or None."""
+        # Pending row first: a crash after the move still marks the file as ours.
+        self.metadata.execute(
+            "INSERT OR REPLACE INTO import_files (folder, name, source_size, source_mtime_ns, stored_size, stored_mtime) "
+            "VALUES (?, ?, ?, ?, NULL, NULL)",
+            (folder, name, size, mtime_ns),
+        )
+        try:
+            self.storage.put_file(folder, name, staged)
+        except (OSError, ValueError) as exc:
+            return str(exc)
+        stored = self.storage.stat(folder, name)
+        if stored is None:
+            return "not found after import"
+        self.digest_service.record(folder, name, sha256, plain_size, stored)
+        self.metadata.execute(
+            "UPDATE import_files SET stored_size = ?, stored_mtime = ? WHERE folder = ? AND name = ?",
+            (stored.size, stored.mtime, folder, name),
+        )
+        return None
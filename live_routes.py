@@ -0,0 +1,185 @@
+import json
+import queue
+
+from flask import request
+
+from profiling_service import annotate_request
+from ui_pages import render_listing_row
+from upload_routes import file_listing_item, folder_listing_item
+
+
+# How long the WebSocket loop waits for a client message before checking for events.
+RECEIVE_TIMEOUT_SEC = 0.25
+
+
+def _can_upgrade(environ):
+    """Whether the WSGI server hands the raw socket to the app, as WebSockets need.
+
+    Werkzeug and gunicorn do; waitress (`fts start`) does not, and pages
+    poll /api/changes there instead.
+    """
+    return (
+        "werkzeug.socket" in environ
+        or "gunicorn.socket" in environ
+        or "eventlet.input" in environ
+        or environ.get("SERVER_SOFTWARE", "").startswith("gevent")
+    )
+
+
+def register_live_routes(app, sock, live_updates, pin_service, storage, usage_service, get_client_ip):
+    @app.context_processor
+    def _live_cursor():
+        # Rendered into the page header, before the listing is read, so the
+        # page can ask for exactly the changes it has not seen.
+        return {"live_cursor": live_updates.cursor}
+
+    @app.before_request
+    def _refuse_unsupported_upgrade():
+        if request.endpoint == "websocket" and not _can_upgrade(request.environ):
+            return "WebSockets are not supported by this server; poll /api/changes instead.", 501
+        return None
+
+    def _locked(folder):
+        pin_service.reset_access_context()
+        return pin_service.folder_has_pin(folder) and not pin_service.is_folder_unlocked(folder)
+
+    def _messages(folder, events):
+        """Turn change events into page patches for the folder index (folder None) or one folder.
+
+        Each file is reported once per batch, as of its last event. The
+        index only hears about folders (usage, lock icon), never file names.
+        """
+        if events is None:
+            return [{"type": "reload"}]
+        pin_service.reset_access_context()
+        client_ip = get_client_ip().strip()
+        if folder is None:
+            changed = {}
+            for event in events:
+                changed[event["folder"]] = event["event"]
+            messages = []
+            for name, event in changed.items():
+                if event == "folder_removed" or not storage.folder_exists(name):
+                    messages.append({"type": "remove", "name": name})
+                    continue
+                item = folder_listing_item(pin_service, name, usage_service.get_usage(name), client_ip)
+                messages.append({"type": "upsert", "name": name, "html": render_listing_row(item)})
+            return messages
+
+        latest = {}
+        for event in events:
+            if event["folder"] != folder:
+                continue
+            if event["event"] == "folder_removed":
+                return [{"type": "folder_removed"}]
+            latest[event["name"] or ""] = event
+        if not latest:
+            return []
+        if _locked(folder):
+            return [{"type": "locked"}]
+        can_delete = client_ip == folder or client_ip in ("127.0.0.1", "::1")
+        messages = []
+        for name, event in latest.items():
+            if event["event"] == "remove":
+                messages.append({"type": "remove", "name": name})
+            elif event["event"] in ("add", "modify"):
+                item = file_listing_item(folder, name, event["size"], event["mtime"], can_delete)
+                messages.append({"type": "upsert", "name": name, "html": render_listing_row(item, "files-table")})
+        return messages
+
+    def _subscribe(folder):
+        """Error message for a folder this client may not watch, else None."""
+        if folder is not None and not storage.folder_exists(folder):
+            return {"type": "folder_removed"}
+        if folder is not None and _locked(folder):
+            return {"type": "locked"}
+        return None
+
+    def _parse_cursor(value):
+        try:
+            return max(0, int(value))
+        except (TypeError, ValueError):
+            return None
+
+    @app.route("/api/changes", methods=["GET"])
+    def api_changes():
+        """Listing patches since `since`, for pages that cannot hold a WebSocket open."""
+        folder = request.args.get("folder") or None
+        since = _parse_cursor(request.args.get("since"))
+        if since is None:
+            return {"ok": False, "error": "since must be a number."}, 400
+        if folder:
+            annotate_request(folder=folder)
+        refused = _subscribe(folder)
+        if refused:
+            return {"ok": True, "cursor": since, "messages": [refused]}
+        cursor = live_updates.cursor()
+        events = live_updates.events_since(since)
+        if events:
+            cursor = events[-1]["id"]
+        return {"ok": True, "cursor": cursor, "messages": _messages(folder, events)}
+
+    @sock.route("/websocket")
+    def websocket(ws):
+        """Live listing updates; anything that is not a subscribe command is echoed back.
+
+        `{"type": "subscribe", "folder": <name or null>, "since": <cursor>}`
+        answers with `subscribed`, then pushes `upsert`/`remove` patches as
+        the folder (or, for null, the folder index) changes.
+        """
+        listener = None
+        folder = None
+        cursor = None
+        try:
+            while True:
+                data = ws.receive(timeout=RECEIVE_TIMEOUT_SEC if listener is not None else None)
+                if data is not None:
+                    try:
+                        command = json.loads(data)
+                    except ValueError:
+                        command = None
+                    if not isinstance(command, dict) or command.get("type") != "subscribe":
+                        ws.send(data)
+                        continue
+                    folder = command.get("folder") or None
+                    refused = _subscribe(folder)
+                    if refused:
+                        ws.send(json.dumps(refused))
+                        cursor = None
+                        continue
+                    if listener is None:
+                        listener = live_updates.listen()
+                    since = _parse_cursor(command.get("since"))
+                    cursor = live_updates.cursor() if since is None else since
+                    ws.send(json.dumps({"type": "subscribed", "folder": folder}))
+                    # Catch up from the page's cursor; the listener covers everything after.
+                    events = live_updates.events_since(cursor)
+                    if events:
+                        cursor = events[-1]["id"]
+                    for message in _messages(folder, events):
+                        ws.send(json.dumps(dict(message, cursor=cursor)))
+                    if events is None:
+                        cursor = None
+                if listener is None:
+                    continue
+                while True:
+                    try:
+                        events = listener.get_nowait()
+                    except queue.Empty:
+                        break
+                    if cursor is None:
+                        continue
+                    if events is not None:
+                        events = [event for event in events if event["id"] > cursor]
+                        if not events:
+                            continue
+                        cursor = events[-1]["id"]
+                    for message in _messages(folder, events):
+                        ws.send(json.dumps(dict(message, cursor=cursor)))
+                        if message["type"] in ("locked", "folder_removed", "reload"):
+                            cursor = None
+        except Exception:
+            pass
+        finally:
+            if listener is not None:
+                live_updates.unlisten(listener)
@@ -0,0 +1,129 @@
+import queue
+import threading
+import time
+
+
+class LiveUpdates:
+    """Change feed behind the live uploads listings.
+
+    Storage events are appended to `change_events` in the shared metadata
+    store, so a page connected to one worker process also hears about
+    uploads and deletes handled by the others. Each process runs a single
+    poller thread, only while it has listeners, that reads the rows added
+    since its last pass and hands them to every listener's queue. Rows
+    are pruned after RETAIN_SEC; a page that falls further behind reloads.
+    """
+
+    POLL_INTERVAL_SEC = 0.3
+    RETAIN_SEC = 600
+    PRUNE_EVERY = 1000
+    MAX_BATCH = 500
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS change_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            event TEXT NOT NULL,
+            folder TEXT NOT NULL,
+            name TEXT,
+            size INTEGER,
+            mtime REAL
+        )""",
+        "CREATE INDEX IF NOT EXISTS change_events_ts ON change_events (ts)",
+    ]
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.metadata.ensure_schema("live", self.SCHEMA)
+        self._lock = threading.Lock()
+        self._listeners = set()
+        self._thread = None
+
+    def on_storage_change(self, event, folder, name, old, new):
+        if event == "put":
+            if new is None:
+                return
+            self.publish("add" if old is None else "modify", folder, name, new.size, new.mtime)
+        elif event == "delete":
+            self.publish("remove", folder, name)
+        elif event == "delete_folder":
+            self.publish("folder_removed", folder)
+
+    def publish(self, event, folder, name=None, size=None, mtime=None):
+        """Record one event: add, modify, remove, folder_removed or pin_changed."""
+        inserted = self.metadata.execute(
+            "INSERT INTO change_events (ts, event, folder, name, size, mtime) VALUES (?, ?, ?, ?, ?, ?)",
+            (time.time(), event, folder, name, size, mtime),
+        )
+        if inserted.lastrowid % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        self.metadata.execute("DELETE FROM change_events WHERE ts < ?", (time.time() - self.RETAIN_SEC,))
+
+    def cursor(self):
+        """Id of the newest event; a page rendered now is current up to here."""
+        row = self.metadata.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_events'").fetchone()
+        return row[0] if row else 0
+
+    def events_since(self, cursor, limit=MAX_BATCH):
+        """Events after `cursor`, oldest first; None when they can no longer be replayed.
+
+        That is when more than `limit` happened, or some were already pruned
+        (AUTOINCREMENT ids are never reused, so a missing id means a pruned row).
+        """
+        rows = self.metadata.execute(
+            "SELECT id, event, folder, name, size, mtime FROM change_events WHERE id > ? ORDER BY id LIMIT ?",
+            (cursor, limit + 1),
+        ).fetchall()
+        if len(rows) > limit:
+            return None
+        if (rows[0][0] if rows else self.cursor() + 1) != cursor + 1:
+            return None
+        return [
+            {"id": r[0], "event": r[1], "folder": r[2], "name": r[3], "size": r[4], "mtime": r[5]} for r in rows
+        ]
+
+    def listen(self):
+        """A queue that receives each new batch of events until `unlisten`."""
+        listener = queue.SimpleQueue()
+        with self._lock:
+            self._listeners.add(listener)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, args=(self.cursor(),), name="fts-live-updates", daemon=True
+                )
+                self._thread.start()
+        return listener
+
+    def unlisten(self, listener):
+        with self._lock:
+            self._listeners.discard(listener)
+
+    def _run(self, cursor):
+        last_prune = time.monotonic()
+        while True:
+            time.sleep(self.POLL_INTERVAL_SEC)
+            with self._lock:
+                if not self._listeners:
+                    self._thread = None
+                    return
+                listeners = list(self._listeners)
+            try:
+                rows = self.events_since(cursor, limit=10 * self.MAX_BATCH)
+                if rows is None:
+                    # Far behind: listeners are told to start over from the current state.
+                    cursor = self.cursor()
+                    batch = None
+                else:
+                    batch = rows
+                    if rows:
+                        cursor = rows[-1]["id"]
+                if batch != []:
+                    for listener in listeners:
+                        listener.put(batch)
+                if time.monotonic() - last_prune > 60:
+                    self.prune()
+                    last_prune = time.monotonic()
+            except Exception:
+                time.sleep(1)
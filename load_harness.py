@@ -0,0 +1,527 @@
+import http.client
+import http.cookiejar
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from array import array
+
+from cryptography.fernet import Fernet
+
+
+SIZE_PRESETS = {
+    "small": "1k:50,16k:40,64k:10",
+    "mixed": "4k:60,64k:30,1m:9,8m:1",
+    "large": "1m:50,16m:40,64m:10",
+}
+DEFAULT_OP_MIX = "download:40,list:25,preview:15,upload:15,unlock:5"
+OPS = ("upload", "download", "list", "preview", "unlock")
+# Uploads cycle through this many names, so a long soak replaces files instead of filling the disk.
+UPLOAD_NAMES = 200
+# Server settings the harness never inherits: it must only touch its own synthetic tree.
+_ISOLATED_ENV_PREFIXES = ("FTS_STORAGE", "FTS_S3_", "FTS_VOLUME", "FTS_REPLICATION_", "FTS_READ_ONLY", "FTS_SHARED_STATE_")
+_UNITS = {"": 1, "b": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+
+
+class HarnessError(Exception):
+    pass
+
+
+def parse_size(text):
+    """'64k' -> 65536; plain numbers are bytes."""
+    text = text.strip().lower().rstrip("b") or "0"
+    unit = text[-1] if text[-1] in _UNITS else ""
+    try:
+        return int(float(text[: len(text) - len(unit)]) * _UNITS[unit])
+    except ValueError:
+        raise HarnessError(f"Bad size: {text!r}") from None
+
+
+def _parse_weights(spec, parse_key):
+    weights = []
+    for part in (spec or "").split(","):
+        if not part.strip():
+            continue
+        key, _, weight = part.partition(":")
+        try:
+            weights.append((parse_key(key), float(weight or 1)))
+        except ValueError:
+            raise HarnessError(f"Bad weight in {part!r}") from None
+    if not weights or sum(w for _, w in weights) <= 0:
+        raise HarnessError(f"Nothing to choose from in {spec!r}")
+    return weights
+
+
+def parse_size_mix(spec):
+    """A preset name or 'size:weight,...' (for example '4k:70,1m:25,32m:5')."""
+    return _parse_weights(SIZE_PRESETS.get(spec, spec), parse_size)
+
+
+def parse_op_mix(spec):
+    def _op(name):
+        name = name.strip().lower()
+        if name not in OPS:
+            raise HarnessError(f"Unknown operation {name!r}; use {', '.join(OPS)}")
+        return name
+
+    return _parse_weights(spec, _op)
+
+
+def _choose(rng, weights):
+    return rng.choices([key for key, _ in weights], [w for _, w in weights])[0]
+
+
+def _draw_size(rng, size_mix):
+    # Spread each bucket over half to one and a half times its nominal size.
+    return max(1, int(_choose(rng, size_mix) * rng.uniform(0.5, 1.5)))
+
+
+def _random_bytes(pool, rng, size):
+    start = rng.randrange(max(1, len(pool) - size))
+    return pool[start : start + size]
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def generate_tree(root, folders, files_per_folder, size_mix, encrypted_ratio, seed=None, out=None):
+    """Write a synthetic uploads tree under `root`; returns the manifest the workload draws from.
+
+    Folders are named like client IPs. A share of them (`encrypted_ratio`)
+    get a PIN record in `.folder_pins.json` and have their files stored
+    Fernet-encrypted, exactly as a folder protected from the web UI.
+    """
+    from pin_service import PinService
+    from storage_service import LocalStorage
+
+    out = out or sys.stdout
+    rng = random.Random(seed)
+    upload_folder = os.path.join(root, "uploads")
+    storage = LocalStorage(upload_folder)
+    pin_service = PinService(upload_folder, "fts-load-harness", storage)
+    biggest = max(size for size, _ in size_mix) * 3 // 2 + 1
+    pool = os.urandom(biggest + 64 * 1024)
+    manifest = []
+    pins = {}
+    total = 0
+    for index in range(folders):
+        number = index + 1
+        folder = f"10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}"
+        pin = None
+        fernet = None
+        if rng.random() < encrypted_ratio:
+            pin = f"{rng.randrange(10**6):06d}"
+            pins[folder], fek = pin_service.new_pin_record(pin)
+            fernet = Fernet(fek)
+        storage.create_folder(folder)
+        names = []
+        for position in range(files_per_folder):
+            name = f"file-{position:05d}.bin"
+            data = _random_bytes(pool, rng, _draw_size(rng, size_mix))
+            storage.write_bytes(folder, name, fernet.encrypt(data) if fernet else data)
+            names.append(name)
+            total += len(data)
+        manifest.append({"folder": folder, "pin": pin, "files": names})
+    if pins and not pin_service.replace_pins(pins):
+        raise HarnessError("Could not write .folder_pins.json")
+    print(
+        f"Synthetic tree: {folders} folder(s) ({len(pins)} encrypted), {folders * files_per_folder} file(s), "
+        f"{total / 1024 / 1024:.1f} MB in {upload_folder}",
+        file=out,
+    )
+    return manifest
+
+
+def _process_stats(pids):
+    """(RSS bytes, open fds) summed over `pids`; None where /proc is not available."""
+    rss = 0
+    fds = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status", encoding="ascii", errors="replace") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1]) * 1024
+                        break
+            fds += len(os.listdir(f"/proc/{pid}/fd"))
+        except (OSError, ValueError):
+            return None, None
+    return rss, fds
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Uploads and PIN unlocks answer 302; the redirect target is not part of the measurement.
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class _Client:
+    """One simulated browser: its own cookie jar, so unlocks stick to it."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.unlocked = set()
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+
+    def request(self, method, path, data=None, headers=None):
+        """(status, bytes received); the body is read to the end and dropped."""
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers or {})
+        try:
+            resp = self._opener.open(req, timeout=300)
+        except urllib.error.HTTPError as exc:
+            resp = exc
+        with resp:
+            received = 0
+            while True:
+                chunk = resp.read(256 * 1024)
+                if not chunk:
+                    break
+                received += len(chunk)
+            return resp.getcode(), received
+
+
+class LoadHarness:
+    """Drive a real `fts start` server with a mixed, concurrent workload.
+
+    The server runs as a child process in its own working directory (with
+    HOME pointed there too, so its PID file stays out of the way) over a
+    synthetic tree from generate_tree. `concurrency` threads each play a
+    browser. Every `interval` seconds a line reports that window's
+    throughput, p50/p99 latency, errors, and the RSS and open file
+    descriptors of the server's processes; a per-operation summary follows.
+    """
+
+    OK_STATUSES = (200, 206, 302)
+
+    def __init__(
+        self,
+        workdir,
+        manifest,
+        port=8169,
+        workers=0,
+        concurrency=16,
+        duration=60.0,
+        interval=5.0,
+        op_mix=DEFAULT_OP_MIX,
+        size_mix="mixed",
+        seed=None,
+        out=None,
+    ):
+        self.workdir = workdir
+        self.manifest = manifest
+        self.port = int(port)
+        self.workers = max(0, int(workers))
+        self.concurrency = max(1, int(concurrency))
+        self.duration = float(duration)
+        self.interval = max(0.5, float(interval))
+        self.size_mix = parse_size_mix(size_mix)
+        self.seed = seed
+        self.out = out or sys.stdout
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.encrypted = [entry for entry in manifest if entry["pin"]]
+        self.op_mix = [(op, w) for op, w in parse_op_mix(op_mix) if op != "unlock" or self.encrypted]
+        if not self.op_mix:
+            raise HarnessError("No operation left to run (unlock needs encrypted folders).")
+        self._lock = threading.Lock()
+        self._latencies = {op: array("d") for op in OPS}
+        self._errors = {op: 0 for op in OPS}
+        self._bytes = {op: 0 for op in OPS}
+        self._window = array("d")
+        self._window_errors = 0
+        self._timeline = []
+        self._stop = threading.Event()
+        self._server = None
+        self._pool = os.urandom(max(size for size, _ in self.size_mix) * 3 // 2 + 64 * 1024)
+
+    # --- server ---------------------------------------------------------
+
+    def _server_env(self):
+        env = {k: v for k, v in os.environ.items() if not k.startswith(_ISOLATED_ENV_PREFIXES)}
+        here = os.path.dirname(os.path.abspath(__file__))
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [here, env.get("PYTHONPATH")]))
+        env["HOME"] = self.workdir
+        env.setdefault("FLASK_SECRET_KEY", uuid.uuid4().hex)
+        # Every simulated browser comes from 127.0.0.1: without this the PIN
+        # rate limiter, not the server, would decide the unlock throughput.
+        env.setdefault("FTS_PIN_ATTEMPTS_PER_MINUTE", "1000000")
+        env.setdefault("FTS_PIN_GLOBAL_ATTEMPTS_PER_MINUTE", "1000000")
+        return env
+
+    def start_server(self, timeout=60.0):
+        code = f"import sys, cli; sys.exit(cli.start_server('127.0.0.1', {self.port}, {self.workers}))"
+        with open(os.path.join(self.workdir, "server.log"), "ab") as log:
+            self._server = subprocess.Popen(
+                [sys.executable, "-c", code],
+                cwd=self.workdir,
+                env=self._server_env(),
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._server.poll() is not None:
+                raise HarnessError(f"Server exited with {self._server.returncode}; see {self.workdir}/server.log")
+            try:
+                if _Client(self.base_url).request("GET", "/healthz")[0] == 200 and self.server_pids():
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise HarnessError(f"Server did not come up on port {self.port} within {timeout:.0f}s.")
+
+    def server_pids(self):
+        """The server process and, under --workers, its pool workers (from its PID file)."""
+        try:
+            with open(os.path.join(self.workdir, ".fts_server.pid"), encoding="utf-8") as handle:
+                return [int(line) for line in handle.read().split()]
+        except (OSError, ValueError):
+            return []
+
+    def stop_server(self):
+        if self._server is None or self._server.poll() is not None:
+            return
+        self._server.terminate()
+        try:
+            self._server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self._server.kill()
+            self._server.wait()
+
+    # --- workload -------------------------------------------------------
+
+    def _record(self, op, started, status, received):
+        elapsed = time.perf_counter() - started
+        ok = status in self.OK_STATUSES
+        with self._lock:
+            self._latencies[op].append(elapsed)
+            self._bytes[op] += received
+            self._window.append(elapsed)
+            if not ok:
+                self._errors[op] += 1
+                self._window_errors += 1
+
+    def _unlock(self, client, entry):
+        data = urllib.parse.urlencode({"pin": entry["pin"]}).encode("ascii")
+        started = time.perf_counter()
+        status, received = client.request("POST", f"/uploads/{entry['folder']}/pin", data=data)
+        self._record("unlock", started, status, received)
+        if status == 302:
+            client.unlocked.add(entry["folder"])
+
+    def _open_folder(self, client, rng):
+        entry = rng.choice(self.manifest)
+        if entry["pin"] and entry["folder"] not in client.unlocked:
+            self._unlock(client, entry)
+        return entry
+
+    def _upload(self, client, rng):
+        boundary = uuid.uuid4().hex
+        name = f"load-{rng.randrange(UPLOAD_NAMES):03d}.bin"
+        payload = _random_bytes(self._pool, rng, _draw_size(rng, self.size_mix))
+        body = b"".join([
+            f"--{boundary}\r\n".encode("ascii"),
+            f'Content-Disposition: form-data; name="file"; filename="{name}"\r\n'.encode("ascii"),
+            b"Content-Type: application/octet-stream\r\n\r\n",
+            payload,
+            f"\r\n--{boundary}--\r\n".encode("ascii"),
+        ])
+        started = time.perf_counter()
+        status, _ = client.request("POST", "/", data=body, headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+        self._record("upload", started, status, len(payload))
+
+    def _run_op(self, op, client, rng):
+        if op == "upload":
+            self._upload(client, rng)
+        elif op == "unlock":
+            # A fresh browser each time, so every unlock pays for the PIN check and key unwrap.
+            self._unlock(_Client(self.base_url), rng.choice(self.encrypted))
+        elif op == "list":
+            entry = self._open_folder(client, rng)
+            path = "/uploads" if rng.random() < 0.2 else f"/uploads/{entry['folder']}"
+            started = time.perf_counter()
+            self._record(op, started, *client.request("GET", path))
+        else:
+            entry = self._open_folder(client, rng)
+            path = f"/uploads/{entry['folder']}/{rng.choice(entry['files'])}"
+            if op == "preview":
+                path += "?preview=1"
+            started = time.perf_counter()
+            self._record(op, started, *client.request("GET", path))
+
+    def _worker(self, number):
+        rng = random.Random(None if self.seed is None else self.seed + number)
+        client = _Client(self.base_url)
+        while not self._stop.is_set():
+            op = _choose(rng, self.op_mix)
+            try:
+                self._run_op(op, client, rng)
+            except (OSError, http.client.HTTPException):
+                with self._lock:
+                    self._errors[op] += 1
+                    self._window_errors += 1
+                time.sleep(0.1)
+
+    def _sample(self, started):
+        with self._lock:
+            window, self._window = self._window, array("d")
+            errors, self._window_errors = self._window_errors, 0
+        rss, fds = _process_stats(self.server_pids())
+        row = {
+            "t": round(time.monotonic() - started, 1),
+            "ops_per_sec": len(window) / self.interval,
+            "p50_ms": _percentile(window, 0.50) * 1000,
+            "p99_ms": _percentile(window, 0.99) * 1000,
+            "errors": errors,
+            "rss_mb": None if rss is None else rss / 1024 / 1024,
+            "fds": fds,
+        }
+        self._timeline.append(row)
+        rss_text = "-" if rss is None else f"{row['rss_mb']:.1f}"
+        print(
+            f"{row['t']:>7.0f}s {row['ops_per_sec']:>8.1f} {row['p50_ms']:>8.1f} {row['p99_ms']:>8.1f} "
+            f"{errors:>7} {rss_text:>8} {'-' if fds is None else fds:>5}",
+            file=self.out,
+        )
+
+    def run(self):
+        """Start the server, run the workload for `duration` seconds and return the results."""
+        self.start_server()
+        try:
+            pids = self.server_pids()
+            print(
+                f"Server: {self.base_url} (workers: {self.workers or 'none'}), PID(s) {', '.join(map(str, pids))}; "
+                f"{self.concurrency} client(s) for {self.duration:.0f}s",
+                file=self.out,
+            )
+            print(f"{'time':>8} {'ops/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'RSS MB':>8} {'fds':>5}", file=self.out)
+            threads = [
+                threading.Thread(target=self._worker, args=(n,), name=f"fts-load-{n}", daemon=True)
+                for n in range(self.concurrency)
+            ]
+            started = time.monotonic()
+            for thread in threads:
+                thread.start()
+            deadline = started + self.duration
+            next_sample = started + self.interval
+            while time.monotonic() < deadline:
+                time.sleep(max(0.0, min(next_sample, deadline) - time.monotonic()))
+                if time.monotonic() >= next_sample:
+                    self._sample(started)
+                    next_sample += self.interval
+            self._stop.set()
+            for thread in threads:
+                thread.join(timeout=300)
+            elapsed = time.monotonic() - started
+        finally:
+            self.stop_server()
+        return self._summary(elapsed)
+
+    def _summary(self, elapsed):
+        ops = {}
+        for op in OPS:
+            latencies = self._latencies[op]
+            if not latencies and not self._errors[op]:
+                continue
+            ops[op] = {
+                "count": len(latencies),
+                "errors": self._errors[op],
+                "ops_per_sec": len(latencies) / elapsed,
+                "p50_ms": _percentile(latencies, 0.50) * 1000,
+                "p99_ms": _percentile(latencies, 0.99) * 1000,
+                "max_ms": max(latencies, default=0.0) * 1000,
+                "mb_per_sec": self._bytes[op] / 1024 / 1024 / elapsed,
+            }
+        return {"elapsed_sec": elapsed, "operations": ops, "timeline": self._timeline}
+
+
+def print_summary(results, out=None):
+    out = out or sys.stdout
+    print("", file=out)
+    print(
+        f"{'operation':<10} {'count':>8} {'errors':>7} {'ops/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'MB/s':>8}",
+        file=out,
+    )
+    for op, row in results["operations"].items():
+        print(
+            f"{op:<10} {row['count']:>8} {row['errors']:>7} {row['ops_per_sec']:>8.1f} {row['p50_ms']:>8.1f} "
+            f"{row['p99_ms']:>8.1f} {row['max_ms']:>8.1f} {row['mb_per_sec']:>8.2f}",
+            file=out,
+        )
+    samples = [row for row in results["timeline"] if row["rss_mb"] is not None]
+    if samples:
+        # Steady growth over a soak run points at a leak.
+        print(
+            f"\nServer RSS {samples[0]['rss_mb']:.1f} -> {samples[-1]['rss_mb']:.1f} MB "
+            f"(max {max(r['rss_mb'] for r in samples):.1f}); open fds {samples[0]['fds']} -> {samples[-1]['fds']} "
+            f"(max {max(r['fds'] for r in samples)})",
+            file=out,
+        )
+
+
+def run_load_test(
+    folders=20,
+    files_per_folder=20,
+    size_mix="mixed",
+    encrypted_ratio=0.3,
+    duration=60.0,
+    concurrency=16,
+    workers=0,
+    port=8169,
+    interval=5.0,
+    op_mix=DEFAULT_OP_MIX,
+    workdir=None,
+    keep=False,
+    json_path=None,
+    seed=None,
+):
+    """`fts loadtest`: generate a tree, load a local server with it and print the report."""
+    own_dir = workdir is None
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix="fts-load-"))
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        parse_op_mix(op_mix)
+        if os.path.exists(os.path.join(workdir, "uploads")):
+            raise HarnessError(f"{workdir} already has an uploads/ folder; pick an empty directory.")
+        manifest = generate_tree(workdir, folders, files_per_folder, parse_size_mix(size_mix), encrypted_ratio, seed)
+        harness = LoadHarness(
+            workdir,
+            manifest,
+            port=port,
+            workers=workers,
+            concurrency=concurrency,
+            duration=duration,
+            interval=interval,
+            op_mix=op_mix,
+            size_mix=size_mix,
+            seed=seed,
+        )
+        results = harness.run()
+    except HarnessError as exc:
+        print(f"Load test failed: {exc}")
+        return 1
+    finally:
+        if own_dir and not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print_summary(results)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+        print(f"Results written to {json_path}")
+    if keep or not own_dir:
+        print(f"Tree and server.log kept in {workdir}")
+    return 0
@@ -0,0 +1,63 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class MetadataStore:
+    """Small SQLite database for server-side bookkeeping (usage, indexes...).
+
+    One connection per thread; WAL mode so several worker processes and the
+    CLI can read and write the same file concurrently.
+    """
+
+    BUSY_TIMEOUT_SEC = 30
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schemas = set()
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT_SEC, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def ensure_schema(self, name, statements):
+        """Run CREATE statements for a feature once per process."""
+        if name in self._schemas:
+            return
+        with self._schema_lock:
+            if name in self._schemas:
+                return
+            with self.transaction() as conn:
+                for statement in statements:
+                    conn.execute(statement)
+            self._schemas.add(name)
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
+
+    def get_flag(self, key):
+        self.ensure_schema("flags", ["CREATE TABLE IF NOT EXISTS flags (key TEXT PRIMARY KEY, value TEXT)"])
+        row = self.execute("SELECT value FROM flags WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_flag(self, key, value):
+        self.ensure_schema("flags", ["CREATE TABLE IF NOT EXISTS flags (key TEXT PRIMARY KEY, value TEXT)"])
+        self.execute("INSERT OR REPLACE INTO flags (key, value) VALUES (?, ?)", (key, str(value)))
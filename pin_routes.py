@@ -1,16 +1,44 @@
 import os
-import pathlib
-import shutil
 
 from flask import redirect, request, url_for
-from ui_pages import GIPHY_LOGO_URL
+from ui_pages import logo_url
 
 
-def register_pin_routes(app, pin_service, safe_upload_path, get_client_ip, render_pin_entry_page):
+def register_pin_routes(
+    app,
+    pin_service,
+    pin_limiter,
+    storage,
+    get_client_ip,
+    render_pin_entry_page,
+    read_only=False,
+    live_updates=None,
+    decrypt_cache=None,
+    share_links=None,
+):
+    trusted_proxies = {
+        address.strip() for address in os.environ.get("FTS_TRUSTED_PROXIES", "").split(",") if address.strip()
+    }
+
+    def _attempt_client():
+        """Who a PIN attempt is charged to.
+
+        The connecting address, since X-Forwarded-For is whatever the client
+        sends. Behind a proxy listed in FTS_TRUSTED_PROXIES, the address that
+        proxy forwarded for (the last hop it did not add itself).
+        """
+        address = request.remote_addr or "unknown"
+        if address not in trusted_proxies:
+            return address
+        hops = [hop.strip() for hop in request.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if hop not in trusted_proxies:
+                return hop
+        return address
+
     @app.route("/uploads/<folder>/pin", methods=["GET", "POST"])
     def pin_entry(folder):
-        path = safe_upload_path(folder)
-        if path is None or not os.path.isdir(path):
+        if not storage.folder_exists(folder):
             return "Not found", 404
         if not pin_service.folder_has_pin(folder):
             return redirect(url_for("list_or_download_uploads", subpath=folder))
@@ -18,9 +46,32 @@ def register_pin_routes(app, pin_service, safe_upload_path, get_client_ip, rende
             pin = (request.form.get("pin") or "").strip()
             next_url = request.form.get("next") or url_for("list_or_download_uploads", subpath=folder)
             confirm_final = (request.form.get("confirm_final_attempt") or "").strip() == "1"
+            attempt_client = _attempt_client()
+            # Checked before any key derivation: a rejected attempt costs no PBKDF2
+            # and does not count towards the folder's wrong-PIN limit.
+            retry_after = pin_limiter.acquire(attempt_client)
+            if retry_after:
+                return (
+                    render_pin_entry_page(
+                        folder,
+                        next_url,
+                        error=f"Too many PIN attempts. Try again in {retry_after} second(s).",
+                    ),
+                    429,
+                    {"Retry-After": str(retry_after)},
+                )
+            if read_only and pin_service.get_failed_pin_attempts(folder) >= 10:
+                # A read-only replica cannot delete what it mirrors: the folder stays locked here instead.
+                return (
+                    render_pin_entry_page(
+                        folder, next_url, error="Too many wrong attempts. This folder is locked on this server."
+                    ),
+                    403,
+                )
             if confirm_final:
                 pin_service.confirm_final_attempt(folder)
             if pin_service.verify_folder_pin(folder, pin):
+                pin_limiter.record_success(attempt_client)
                 pin_service.clear_pin_failures(folder)
                 pin_service.unlock_folder_with_fek(folder, pin)
                 resp = redirect(next_url)
@@ -30,7 +81,11 @@ def register_pin_routes(app, pin_service, safe_upload_path, get_client_ip, rende
                         token = pin_service.unlock_store_add(folder, fek_b64)
                         pin_service.set_unlock_cookie_on_response(resp, folder, token)
                 return resp
+            pin_limiter.record_failure(attempt_client)
             failures = pin_service.register_failed_pin_attempt(folder)
+            if read_only:
+                left = max(0, 10 - failures)
+                return render_pin_entry_page(folder, next_url, error=f"Wrong PIN. {left} attempt(s) left."), 401
             if failures == 9:
                 return (
                     render_pin_entry_page(
@@ -53,7 +108,7 @@ def register_pin_routes(app, pin_service, safe_upload_path, get_client_ip, rende
                         401,
                     )
                 try:
-                    shutil.rmtree(path)
+                    storage.delete_folder(folder)
                 except OSError:
                     return "Too many wrong attempts. Failed to delete folder.", 500
                 if not pin_service.remove_folder_details(folder):
@@ -62,7 +117,7 @@ def register_pin_routes(app, pin_service, safe_upload_path, get_client_ip, rende
                     "<!doctype html><html><head>"
                     '<meta charset="UTF-8">'
                     '<meta name="viewport" content="width=device-width, initial-scale=1.0">'
-                    f'<link rel="icon" href="{GIPHY_LOGO_URL}" type="image/gif">'
+                    f'<link rel="icon" href="{logo_url()}" type="image/gif">'
                     "<title>Folder Deleted - File Transfer Server</title>"
                     '</head><body style="font-family:Segoe UI;'
                     'background:#0f172a;color:#e2e8f0;min-height:100vh;display:flex;'
@@ -85,10 +140,9 @@ def register_pin_routes(app, pin_service, safe_upload_path, get_client_ip, rende
         client_ip = get_client_ip().strip()
         if client_ip != folder and client_ip not in ("127.0.0.1", "::1"):
             return {"ok": False, "error": "You can only set a PIN for your own folder."}, 403
-        folder_path = pathlib.Path(app.config["UPLOAD_FOLDER"], folder)
-        folder_path.mkdir(parents=True, exist_ok=True)
-        path = safe_upload_path(folder)
-        if path is None or not os.path.isdir(path):
+        try:
+            storage.create_folder(folder)
+        except (OSError, ValueError):
             return {"ok": False, "error": "Folder not found."}, 404
 
         data = request.get_json(force=True, silent=True) or {}
@@ -100,9 +154,28 @@ def register_pin_routes(app, pin_service, safe_upload_path, get_client_ip, rende
         remove = data.get("remove") is True
         if remove:
             pin = ""
+        attempt_client = _attempt_client()
+        retry_after = pin_limiter.acquire(attempt_client)
+        if retry_after:
+            return (
+                {"ok": False, "error": f"Too many PIN attempts. Try again in {retry_after} second(s)."},
+                429,
+                {"Retry-After": str(retry_after)},
+            )
         ok, err = pin_service.set_folder_pin(folder, pin, current_pin=current_pin)
         if err:
+            if err.startswith("Wrong"):
+                pin_limiter.record_failure(attempt_client)
             return {"ok": False, "error": err}, 400
+        pin_limiter.record_success(attempt_client)
+        if decrypt_cache is not None:
+            decrypt_cache.invalidate(folder)
+        if share_links is not None:
+            # Links issued under the old PIN carry the old key (or none): they stop working.
+            share_links.revoke(folder)
+        if live_updates is not None:
+            # Open listings update the lock icon; viewers of the folder who are now locked out leave it.
+            live_updates.publish("pin_changed", folder)
         return {"ok": True, "has_pin": bool(pin)}
 
     @app.route("/uploads/<folder>/pin-status", methods=["GET"])
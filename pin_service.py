@@ -1,14 +1,16 @@
 import base64
+import heapq
 import json
 import os
 import pathlib
 import secrets
+import threading
 import time
 
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from flask import request, session
+from flask import g, has_request_context, request, session
 from itsdangerous import BadSignature, URLSafeTimedSerializer
 from werkzeug.security import check_password_hash, generate_password_hash
 
@@ -16,6 +18,114 @@ from decrypt_service import decrypt_existing_files, decrypt_fek
 from encrypt_service import encrypt_existing_files, encrypt_fek
 
 
+class UnlockStore:
+    """Unlock tokens handed out in the FT_UNLOCKS cookie: token -> folder + FEK.
+
+    Kept in memory only. With `fts start --workers N` one instance lives in the
+    supervisor and workers reach it through a manager proxy, so a token issued
+    by one worker is honoured by all of them.
+    """
+
+    def __init__(self):
+        self._entries = {}  # token -> {"folder": str, "fek": str, "expires": float}
+        self._by_folder = {}  # folder -> set of tokens
+        self._expiry = []  # heap of (expires, token); revoked tokens are skipped lazily
+        self._lock = threading.Lock()
+
+    def _cleanup(self):
+        # Only the expired head of the heap is touched: O(log n) per expired token.
+        now = time.time()
+        while self._expiry and self._expiry[0][0] <= now:
+            _, token = heapq.heappop(self._expiry)
+            self._remove(token)
+        if len(self._expiry) > 2 * len(self._entries) + 64:
+            # Mostly revoked tokens left in the heap: rebuild it.
+            self._expiry = [(v["expires"], t) for t, v in self._entries.items()]
+            heapq.heapify(self._expiry)
+
+    def _remove(self, token):
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            tokens = self._by_folder.get(entry["folder"])
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._by_folder[entry["folder"]]
+
+    def add(self, folder_name, fek_b64, max_age_sec):
+        token = secrets.token_urlsafe(32)
+        expires = time.time() + max_age_sec
+        with self._lock:
+            self._cleanup()
+            self._entries[token] = {"folder": folder_name, "fek": fek_b64, "expires": expires}
+            self._by_folder.setdefault(folder_name, set()).add(token)
+            heapq.heappush(self._expiry, (expires, token))
+        return token
+
+    def get(self, token):
+        with self._lock:
+            self._cleanup()
+            entry = self._entries.get(token)
+            if not entry or entry["expires"] <= time.time():
+                return None, None
+            return entry["folder"], entry["fek"]
+
+    def revoke_folder(self, folder_name):
+        with self._lock:
+            for token in list(self._by_folder.get(folder_name, ())):
+                self._remove(token)
+
+
+class PinAttemptStore:
+    """Wrong-PIN counters per folder (shared across workers like UnlockStore)."""
+
+    def __init__(self):
+        self._attempts = {}  # folder -> {"count": int, "final_confirmed": bool}
+        self._lock = threading.Lock()
+
+    def register_failure(self, folder_name):
+        with self._lock:
+            state = self._attempts.get(folder_name) or {"count": 0, "final_confirmed": False}
+            state["count"] += 1
+            self._attempts[folder_name] = state
+            return state["count"]
+
+    def failures(self, folder_name):
+        with self._lock:
+            state = self._attempts.get(folder_name) or {"count": 0, "final_confirmed": False}
+            return int(state["count"])
+
+    def confirm_final(self, folder_name):
+        with self._lock:
+            state = self._attempts.get(folder_name) or {"count": 0, "final_confirmed": False}
+            state["final_confirmed"] = True
+            self._attempts[folder_name] = state
+
+    def is_final_confirmed(self, folder_name):
+        with self._lock:
+            state = self._attempts.get(folder_name) or {"count": 0, "final_confirmed": False}
+            return bool(state["final_confirmed"])
+
+    def clear(self, folder_name):
+        with self._lock:
+            self._attempts.pop(folder_name, None)
+
+
+class AccessContext:
+    """What access checks need during one request, resolved at most once.
+
+    A single download asks folder_has_pin, is_folder_unlocked,
+    folder_has_encryption and get_fek_for_folder; without this each of them
+    re-read the PIN file, re-verified the unlock cookie and built a new
+    Fernet. Lives in flask.g, so it never outlives the request.
+    """
+
+    def __init__(self):
+        self.pins = None  # parsed .folder_pins.json
+        self.unlock_cookie = None  # verified FT_UNLOCKS payload: folder -> token
+        self.folder_keys = {}  # folder -> (key base64, Fernet), or (None, None)
+
+
 class PinService:
     PBKDF2_ITERATIONS = 100_000
     SALT_LENGTH = 16
@@ -23,65 +133,68 @@ class PinService:
     FT_UNLOCKS_MAX_AGE_DAYS = 7
     FT_UNLOCKS_MAX_AGE_SEC = FT_UNLOCKS_MAX_AGE_DAYS * 24 * 3600
 
-    def __init__(self, upload_folder, secret_key):
+    def __init__(self, upload_folder, secret_key, storage, unlock_store=None, attempt_store=None):
         self.upload_folder = upload_folder
         self.secret_key = secret_key
-        self._unlock_store = {}  # token -> {"folder": str, "fek": str, "expires": float}
-        self._pin_attempts = {}  # folder -> {"count": int, "final_confirmed": bool}
+        self.storage = storage
+        self._unlock_store = unlock_store if unlock_store is not None else UnlockStore()
+        self._pin_attempts = attempt_store if attempt_store is not None else PinAttemptStore()
 
     def _unlock_serializer(self):
         return URLSafeTimedSerializer(self.secret_key, salt="ft-unlocks")
 
-    def _unlock_store_cleanup(self):
-        now = time.time()
-        expired = [t for t, v in self._unlock_store.items() if v["expires"] <= now]
-        for token in expired:
-            self._unlock_store.pop(token, None)
-
     def unlock_store_add(self, folder_name, fek_b64):
-        self._unlock_store_cleanup()
-        token = secrets.token_urlsafe(32)
-        self._unlock_store[token] = {
-            "folder": folder_name,
-            "fek": fek_b64,
-            "expires": time.time() + self.FT_UNLOCKS_MAX_AGE_SEC,
-        }
-        return token
+        return self._unlock_store.add(folder_name, fek_b64, self.FT_UNLOCKS_MAX_AGE_SEC)
 
     def _unlock_store_get(self, token):
-        self._unlock_store_cleanup()
-        entry = self._unlock_store.get(token)
-        if not entry or entry["expires"] <= time.time():
-            return None, None
-        return entry["folder"], entry["fek"]
+        return self._unlock_store.get(token)
 
     def _unlock_store_revoke_folder(self, folder_name):
-        to_remove = [t for t, v in self._unlock_store.items() if v["folder"] == folder_name]
-        for token in to_remove:
-            self._unlock_store.pop(token, None)
+        self._unlock_store.revoke_folder(folder_name)
+        self._forget_fernet(folder_name)
+
+    def access_context(self):
+        """The current request's AccessContext, or None outside a request."""
+        if not has_request_context():
+            return None
+        context = g.get("fts_access")
+        if context is None:
+            context = g.fts_access = AccessContext()
+        return context
+
+    def reset_access_context(self):
+        """Forget what the current request cached; long-lived requests (the WebSocket) re-check with it."""
+        if has_request_context():
+            g.pop("fts_access", None)
+
+    def _forget_fernet(self, folder_name):
+        context = self.access_context()
+        if context is not None:
+            context.folder_keys.pop(folder_name, None)
 
     def _get_unlock_cookie_data(self):
+        context = self.access_context()
+        if context is not None and context.unlock_cookie is not None:
+            return dict(context.unlock_cookie)
+        folders = {}
         raw = request.cookies.get(self.FT_UNLOCKS_COOKIE)
-        if not raw:
-            return {}
-        try:
-            payload = self._unlock_serializer().loads(raw, max_age=self.FT_UNLOCKS_MAX_AGE_SEC)
-            return payload.get("folders") or {}
-        except (BadSignature, Exception):
-            return {}
-
-    def _get_fek_from_unlock_cookie(self, folder_name):
+        if raw:
+            try:
+                payload = self._unlock_serializer().loads(raw, max_age=self.FT_UNLOCKS_MAX_AGE_SEC)
+                folders = payload.get("folders") or {}
+            except (BadSignature, Exception):
+                folders = {}
+        if context is not None:
+            context.unlock_cookie = dict(folders)
+        return folders
+
+    def _get_fek_b64_from_unlock_cookie(self, folder_name):
         cookies = self._get_unlock_cookie_data()
         token = cookies.get(folder_name)
         if not token:
             return None
         _, fek_b64 = self._unlock_store_get(token)
-        if not fek_b64:
-            return None
-        try:
-            return Fernet(fek_b64.encode("ascii"))
-        except Exception:
-            return None
+        return fek_b64 or None
 
     def set_unlock_cookie_on_response(self, response, folder_name, token):
         current = self._get_unlock_cookie_data()
@@ -113,13 +226,26 @@ class PinService:
         path = self._pins_path()
         try:
             path.write_text(json.dumps(pins), encoding="utf-8")
-            return True
         except OSError:
             return False
+        context = self.access_context()
+        if context is not None:
+            context.pins = dict(pins)
+        return True
+
+    def _pins(self):
+        context = self.access_context()
+        if context is None:
+            return self._load_pins()
+        if context.pins is None:
+            context.pins = self._load_pins()
+        return context.pins
 
     def _get_pin_record(self, folder_name):
-        pins = self._load_pins()
-        return pins.get(folder_name)
+        return self._pins().get(folder_name)
+
+    def pinned_folders(self):
+        return [name for name in self._pins() if self.folder_has_pin(name)]
 
     def folder_has_pin(self, folder_name):
         rec = self._get_pin_record(folder_name)
@@ -135,38 +261,56 @@ class PinService:
 
     def remove_folder_details(self, folder_name):
         """Remove PIN/encryption metadata and unlock state for a folder."""
+        if not self.forget_folder(folder_name):
+            return False
+        self._clear_session_fek(folder_name)
+        return True
+
+    def forget_folder(self, folder_name):
+        """Like remove_folder_details, but usable outside a request (no session)."""
         pins = self._load_pins()
         had_record = folder_name in pins
         if had_record:
             pins.pop(folder_name, None)
             if not self._save_pins(pins):
                 return False
-        self._clear_session_fek(folder_name)
         self._unlock_store_revoke_folder(folder_name)
         self.clear_pin_failures(folder_name)
         return True
 
+    def export_pins(self):
+        """The whole pins file as a dict (read fresh), e.g. to replicate it."""
+        return self._load_pins()
+
+    def replace_pins(self, pins):
+        """Install a pins file received from a replication primary.
+
+        Unlock tokens and attempt counters are reset for every folder whose
+        record changed, since they were granted under the old PIN.
+        """
+        current = self._load_pins()
+        if not self._save_pins(pins):
+            return False
+        for folder_name in set(current) | set(pins):
+            if current.get(folder_name) != pins.get(folder_name):
+                self._unlock_store_revoke_folder(folder_name)
+                self.clear_pin_failures(folder_name)
+        return True
+
     def register_failed_pin_attempt(self, folder_name):
-        state = self._pin_attempts.get(folder_name) or {"count": 0, "final_confirmed": False}
-        state["count"] += 1
-        self._pin_attempts[folder_name] = state
-        return state["count"]
+        return self._pin_attempts.register_failure(folder_name)
 
     def get_failed_pin_attempts(self, folder_name):
-        state = self._pin_attempts.get(folder_name) or {"count": 0, "final_confirmed": False}
-        return int(state["count"])
+        return self._pin_attempts.failures(folder_name)
 
     def confirm_final_attempt(self, folder_name):
-        state = self._pin_attempts.get(folder_name) or {"count": 0, "final_confirmed": False}
-        state["final_confirmed"] = True
-        self._pin_attempts[folder_name] = state
+        self._pin_attempts.confirm_final(folder_name)
 
     def is_final_attempt_confirmed(self, folder_name):
-        state = self._pin_attempts.get(folder_name) or {"count": 0, "final_confirmed": False}
-        return bool(state["final_confirmed"])
+        return self._pin_attempts.is_final_confirmed(folder_name)
 
     def clear_pin_failures(self, folder_name):
-        self._pin_attempts.pop(folder_name, None)
+        self._pin_attempts.clear(folder_name)
 
     def _derive_kek(self, pin_clean, salt_b64):
         salt = base64.b64decode(salt_b64)
@@ -186,32 +330,49 @@ class PinService:
         keys = dict(self._session_folder_keys())
         keys[folder_name] = fek_b64
         session["folder_keys"] = keys
+        self._forget_fernet(folder_name)
 
     def _clear_session_fek(self, folder_name):
         keys = dict(self._session_folder_keys())
         keys.pop(folder_name, None)
         session["folder_keys"] = keys
+        self._forget_fernet(folder_name)
 
     def get_session_fek_b64(self, folder_name):
         return self._session_folder_keys().get(folder_name)
 
-    def get_fek_for_folder(self, folder_name):
-        fek_b64 = self._session_folder_keys().get(folder_name)
-        if fek_b64:
+    def _folder_key(self, folder_name):
+        """(base64, Fernet) of the folder key this request has unlocked (session or unlock cookie)."""
+        context = self.access_context()
+        if context is not None and folder_name in context.folder_keys:
+            return context.folder_keys[folder_name]
+        key = (None, None)
+        for lookup in (self._session_folder_keys().get, self._get_fek_b64_from_unlock_cookie):
+            fek_b64 = lookup(folder_name)
+            if not fek_b64:
+                continue
             try:
-                return Fernet(fek_b64.encode("ascii"))
+                key = (fek_b64, Fernet(fek_b64.encode("ascii")))
+                break
             except Exception:
                 pass
-        return self._get_fek_from_unlock_cookie(folder_name)
+        if context is not None:
+            context.folder_keys[folder_name] = key
+        return key
 
-    def _folder_path(self, folder_name):
-        return pathlib.Path(self.upload_folder, folder_name)
+    def get_fek_b64_for_folder(self, folder_name):
+        """The folder key this request has unlocked (session or unlock cookie), base64."""
+        return self._folder_key(folder_name)[0]
 
-    def _get_fernet_from_current_pin(self, folder_name, current_pin):
+    def get_fek_for_folder(self, folder_name):
+        return self._folder_key(folder_name)[1]
+
+    def fek_b64_for_pin(self, folder_name, pin):
+        """The folder key (base64) if `pin` is right, else None. Needs no session (CLI tools)."""
         rec = self._get_pin_record(folder_name)
         if not isinstance(rec, dict) or not rec.get("encrypted_fek"):
             return None
-        pin_clean = (current_pin or "").strip()
+        pin_clean = (pin or "").strip()
         if not pin_clean:
             return None
         if not check_password_hash(rec["hash"], pin_clean):
@@ -220,11 +381,14 @@ class PinService:
         try:
             fek_bytes = decrypt_fek(rec["encrypted_fek"], kek_b64)
             # decrypt_fek returns the original Fernet key bytes (already urlsafe-base64 text bytes).
-            fek_b64 = fek_bytes.decode("ascii") if isinstance(fek_bytes, bytes) else str(fek_bytes)
-            return Fernet(fek_b64.encode("ascii"))
+            return fek_bytes.decode("ascii") if isinstance(fek_bytes, bytes) else str(fek_bytes)
         except Exception:
             return None
 
+    def _get_fernet_from_current_pin(self, folder_name, current_pin):
+        fek_b64 = self.fek_b64_for_pin(folder_name, current_pin)
+        return Fernet(fek_b64.encode("ascii")) if fek_b64 else None
+
     def set_folder_pin(self, folder_name, pin, current_pin=None):
         pins = self._load_pins()
         if not pin or not pin.strip():
@@ -241,7 +405,7 @@ class PinService:
                 if not fernet:
                     return (False, "Wrong PIN.")
                 # Decrypt all files before removing folder protection.
-                decrypt_existing_files(self._folder_path(folder_name), fernet)
+                decrypt_existing_files(self.storage, folder_name, fernet)
             pins.pop(folder_name, None)
             self._clear_session_fek(folder_name)
             self._unlock_store_revoke_folder(folder_name)
@@ -269,29 +433,31 @@ class PinService:
                     False,
                     "Wrong current PIN or open the folder and enter current PIN first, then you can change PIN.",
                 )
-            decrypt_existing_files(self._folder_path(folder_name), fernet_old)
+            decrypt_existing_files(self.storage, folder_name, fernet_old)
 
-        salt = os.urandom(self.SALT_LENGTH)
-        salt_b64 = base64.b64encode(salt).decode("ascii")
-        kek_b64 = self._derive_kek(pin_clean, salt_b64)
-        fek = Fernet.generate_key()
-        encrypted_fek_b64 = encrypt_fek(fek, kek_b64)
-        pin_hash = generate_password_hash(pin_clean, method="pbkdf2:sha256")
-        pins[folder_name] = {
-            "hash": pin_hash,
-            "salt": salt_b64,
-            "encrypted_fek": encrypted_fek_b64,
-        }
+        pins[folder_name], fek = self.new_pin_record(pin_clean)
         if not self._save_pins(pins):
             return (False, "Failed to save PIN")
 
         self._unlock_store_revoke_folder(folder_name)
         fernet = Fernet(fek)
-        encrypt_existing_files(self._folder_path(folder_name), fernet)
+        encrypt_existing_files(self.storage, folder_name, fernet)
         self._set_session_fek(folder_name, fek.decode("ascii"))
         self._unlock_folder(folder_name)
         return (True, None)
 
+    def new_pin_record(self, pin_clean):
+        """A fresh `.folder_pins.json` record for `pin_clean` and its new folder key: (record, fek)."""
+        salt_b64 = base64.b64encode(os.urandom(self.SALT_LENGTH)).decode("ascii")
+        kek_b64 = self._derive_kek(pin_clean, salt_b64)
+        fek = Fernet.generate_key()
+        record = {
+            "hash": generate_password_hash(pin_clean, method="pbkdf2:sha256"),
+            "salt": salt_b64,
+            "encrypted_fek": encrypt_fek(fek, kek_b64),
+        }
+        return record, fek
+
     def verify_folder_pin(self, folder_name, pin):
         rec = self._get_pin_record(folder_name)
         if not rec:
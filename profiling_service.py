@@ -0,0 +1,266 @@
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from flask import g, has_request_context, request
+
+
+DEFAULT_PROFILE_DIR = Path.home() / ".fts_profiles"
+PHASES = ("io", "crypto", "render")
+
+
+def annotate_request(**fields):
+    """Attach route details (folder, file, size, encrypted...) to the current request."""
+    if not has_request_context():
+        return
+    info = g.get("fts_request_info")
+    if info is None:
+        info = {}
+        g.fts_request_info = info
+    info.update(fields)
+
+
+@contextmanager
+def timed_phase(name):
+    """Accumulate wall time spent in `name` (io/crypto/render) for the current request."""
+    if not has_request_context():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = g.get("fts_phase_timings")
+        if timings is None:
+            timings = {}
+            g.fts_phase_timings = timings
+        timings[name] = timings.get(name, 0.0) + (time.perf_counter() - start)
+
+
+def on_response_close(response, func):
+    """Run `func` once the response body has been sent (or the client went away).
+
+    Like response.call_on_close, but also for send_file responses: Werkzeug
+    hands their file wrapper straight to the server, so Response.close()
+    never runs. Hooking the wrapper's own close keeps the server's
+    file-serving fast path.
+    """
+    body = response.response
+    original = getattr(body, "close", None) if response.direct_passthrough else None
+    if original is None:
+        response.call_on_close(func)
+        return
+    done = []
+
+    def close():
+        try:
+            original()
+        finally:
+            if not done:
+                done.append(True)
+                func()
+
+    try:
+        body.close = close
+    except AttributeError:
+        response.call_on_close(func)
+
+
+def request_info():
+    if not has_request_context():
+        return {}
+    return g.get("fts_request_info") or {}
+
+
+def request_phase_timings():
+    if not has_request_context():
+        return {}
+    return g.get("fts_phase_timings") or {}
+
+
+class RequestProfiler:
+    """Samples requests under cProfile and logs slow ones.
+
+    Settings live in `<profile_dir>/settings.json` and are re-read when the
+    file changes, so `fts profile ...` can switch profiling on or off for a
+    running server (and every worker process) without a restart. Values
+    passed in (FTS_PROFILE_SAMPLE / FTS_PROFILE_SLOW_MS) override the saved
+    file at startup; a later `fts profile` change still takes over.
+    """
+
+    SETTINGS_FILE = "settings.json"
+    SLOW_LOG_FILE = "slow_requests.jsonl"
+    SETTINGS_CHECK_INTERVAL_SEC = 1.0
+
+    def __init__(self, profile_dir=None, sample_rate=None, slow_ms=None):
+        self.profile_dir = Path(profile_dir or DEFAULT_PROFILE_DIR)
+        self.sample_rate = 0.0
+        self.slow_ms = 0
+        self._settings_mtime = None
+        self._settings_checked_at = 0.0
+        self._write_lock = threading.Lock()
+        # Only one cProfile collector can be active at a time.
+        self._profile_lock = threading.Lock()
+        self._reload_settings(force=True)
+        if sample_rate is not None:
+            self.sample_rate = max(0.0, min(1.0, float(sample_rate)))
+        if slow_ms is not None:
+            self.slow_ms = max(0, int(slow_ms))
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            profile_dir=os.environ.get("FTS_PROFILE_DIR") or None,
+            # None when unset, so only variables actually given override settings.json.
+            sample_rate=_env_float("FTS_PROFILE_SAMPLE", None),
+            slow_ms=_env_int("FTS_PROFILE_SLOW_MS", None),
+        )
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or self.slow_ms > 0
+
+    def settings_path(self):
+        return self.profile_dir / self.SETTINGS_FILE
+
+    def save_settings(self, sample_rate, slow_ms):
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        payload = {"sample_rate": float(sample_rate), "slow_ms": int(slow_ms)}
+        tmp = self.settings_path().with_suffix(".tmp")
+        tmp.write_text(json.dumps(payload), encoding="utf-8")
+        os.replace(tmp, self.settings_path())
+        self.sample_rate = payload["sample_rate"]
+        self.slow_ms = payload["slow_ms"]
+
+    def _reload_settings(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._settings_checked_at < self.SETTINGS_CHECK_INTERVAL_SEC:
+            return
+        self._settings_checked_at = now
+        path = self.settings_path()
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._settings_mtime:
+            return
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return
+        self._settings_mtime = mtime
+        self.sample_rate = max(0.0, min(1.0, float(data.get("sample_rate") or 0.0)))
+        self.slow_ms = max(0, int(data.get("slow_ms") or 0))
+
+    def begin_request(self):
+        self._reload_settings()
+        if not self.enabled:
+            return
+        g.fts_profile_start = time.perf_counter()
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            if self._profile_lock.acquire(blocking=False):
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:
+                    self._profile_lock.release()
+                    return
+                g.fts_profile = profile
+
+    def end_request(self, response):
+        start = g.get("fts_profile_start")
+        if start is None:
+            return
+        profile = g.pop("fts_profile", None)
+        # Capture everything we need now: the rest runs after the body is streamed.
+        rule = request.url_rule.rule if request.url_rule is not None else None
+        record = {
+            "method": request.method,
+            "route": rule,
+            "path": request.path,
+            "status": response.status_code,
+        }
+        # Keep references, not copies: streamed bodies keep annotating while they are sent.
+        info = g.setdefault("fts_request_info", {})
+        timings = g.setdefault("fts_phase_timings", {})
+
+        def _finish():
+            if profile is not None:
+                profile.disable()
+                self._profile_lock.release()
+            total = time.perf_counter() - start
+            total_ms = round(total * 1000, 2)
+            is_slow = self.slow_ms > 0 and total_ms >= self.slow_ms
+            if profile is None and not is_slow:
+                return
+            split = {f"{name}_ms": round(timings.get(name, 0.0) * 1000, 2) for name in PHASES}
+            accounted = sum(timings.get(name, 0.0) for name in PHASES)
+            split["other_ms"] = round(max(0.0, total - accounted) * 1000, 2)
+            entry = dict(record, **info)
+            entry.update(ts=time.time(), total_ms=total_ms, slow=is_slow, **split)
+            if profile is not None:
+                entry["profile"] = self._dump_profile(profile)
+            self._append_slow_log(entry)
+
+        on_response_close(response, _finish)
+
+    def abort_request(self):
+        # after_request is skipped when a view raises; don't leave the collector running.
+        profile = g.pop("fts_profile", None)
+        if profile is not None:
+            profile.disable()
+            self._profile_lock.release()
+
+    def _dump_profile(self, profile):
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        name = f"req-{int(time.time() * 1000)}-{os.getpid()}-{threading.get_ident()}.prof"
+        path = self.profile_dir / name
+        try:
+            profile.dump_stats(str(path))
+        except OSError:
+            return None
+        return name
+
+    def _append_slow_log(self, entry):
+        try:
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+            line = json.dumps(entry, default=str) + "\n"
+            with self._write_lock:
+                with open(self.profile_dir / self.SLOW_LOG_FILE, "a", encoding="utf-8") as fh:
+                    fh.write(line)
+        except OSError:
+            pass
+
+
+def register_profiling_hooks(app, profiler):
+    @app.before_request
+    def _profiling_begin():
+        profiler.begin_request()
+
+    @app.after_request
+    def _profiling_end(response):
+        profiler.end_request(response)
+        return response
+
+    @app.teardown_request
+    def _profiling_teardown(exc):
+        profiler.abort_request()
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
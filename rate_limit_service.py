@@ -0,0 +1,125 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class _ClientState:
+    __slots__ = ("attempts", "failures", "last_failure")
+
+    def __init__(self):
+        self.attempts = deque()  # monotonic times of recent attempts, oldest first
+        self.failures = 0  # consecutive wrong PINs
+        self.last_failure = 0.0
+
+
+class PinRateLimiter:
+    """Admission control for PIN checks, applied before any key derivation runs.
+
+    Every PIN check costs a full PBKDF2 (hundreds of thousands of iterations),
+    so attempts are limited three ways:
+
+    - per client: at most `per_client` attempts in any `window` seconds
+      (a sliding log, so there is no burst at window edges);
+    - per client: after `free_failures` wrong PINs in a row, each further
+      attempt must wait `base_delay * 2**n` seconds (capped at `max_delay`)
+      after the last failure; a correct PIN resets this;
+    - globally: at most `global_limit` attempts per `window` over all
+      clients, which bounds the CPU PIN checks can use however many
+      addresses an attacker sprays from.
+
+    Client state is an LRU capped at `max_clients` entries, so memory stays
+    bounded. Like UnlockStore, a pool shares one instance through the
+    supervisor.
+    """
+
+    def __init__(
+        self,
+        per_client=10,
+        global_limit=120,
+        window=60.0,
+        free_failures=3,
+        base_delay=1.0,
+        max_delay=900.0,
+        max_clients=10000,
+        clock=time.monotonic,
+    ):
+        self.per_client = max(1, int(per_client))
+        self.global_limit = max(1, int(global_limit))
+        self.window = float(window)
+        self.free_failures = max(0, int(free_failures))
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+        self.max_clients = max(1, int(max_clients))
+        self._clock = clock
+        self._clients = OrderedDict()  # client -> _ClientState, least recently used first
+        self._global = deque()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            per_client=_env_int("FTS_PIN_ATTEMPTS_PER_MINUTE", 10),
+            global_limit=_env_int("FTS_PIN_GLOBAL_ATTEMPTS_PER_MINUTE", 120),
+            max_clients=_env_int("FTS_PIN_LIMITER_MAX_CLIENTS", 10000),
+        )
+
+    def _prune(self, log, now):
+        cutoff = now - self.window
+        while log and log[0] <= cutoff:
+            log.popleft()
+
+    def _backoff_until(self, state):
+        excess = state.failures - self.free_failures
+        if excess < 0:
+            return 0.0
+        return state.last_failure + min(self.max_delay, self.base_delay * (2 ** min(excess, 32)))
+
+    def acquire(self, client):
+        """Reserve one PIN attempt for `client`. Returns 0 if allowed, else seconds to wait."""
+        now = self._clock()
+        with self._lock:
+            wait = 0.0
+            state = self._clients.get(client)
+            if state is not None:
+                self._clients.move_to_end(client)
+                self._prune(state.attempts, now)
+                if len(state.attempts) >= self.per_client:
+                    wait = state.attempts[0] + self.window - now
+                wait = max(wait, self._backoff_until(state) - now)
+            self._prune(self._global, now)
+            if len(self._global) >= self.global_limit:
+                wait = max(wait, self._global[0] + self.window - now)
+            if wait > 0:
+                return max(1, math.ceil(wait))
+            if state is None:
+                state = self._clients[client] = _ClientState()
+                while len(self._clients) > self.max_clients:
+                    self._clients.popitem(last=False)
+            state.attempts.append(now)
+            self._global.append(now)
+            return 0
+
+    def record_failure(self, client):
+        with self._lock:
+            state = self._clients.get(client)
+            if state is None:
+                state = self._clients[client] = _ClientState()
+                while len(self._clients) > self.max_clients:
+                    self._clients.popitem(last=False)
+            state.failures += 1
+            state.last_failure = self._clock()
+
+    def record_success(self, client):
+        with self._lock:
+            state = self._clients.get(client)
+            if state is not None:
+                state.failures = 0
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name) or default)
+    except ValueError:
+        return default
@@ -0,0 +1,94 @@
+import hashlib
+import json
+
+from flask import request
+
+from profiling_service import annotate_request, timed_phase
+from replication_service import CONTENT_SHA_HEADER, SIGNATURE_HEADER, ReplicationError, verify_signature
+
+
+# Endpoints a read-only replica still accepts writes on: unlocking a folder
+# with its PIN, and the replication API itself.
+READ_ONLY_ALLOWED = {"pin_entry", "replication_batch", "replication_object", "replication_pins"}
+
+
+def register_replication_routes(app, replication_receiver, read_only=False):
+    if read_only:
+
+        @app.before_request
+        def _refuse_writes_on_replica():
+            if request.method in ("GET", "HEAD", "OPTIONS") or request.endpoint in READ_ONLY_ALLOWED:
+                return None
+            return {"ok": False, "error": "This server is a read-only replica."}, 403
+
+    if replication_receiver is None:
+        return
+
+    def _authorized(body_sha256):
+        path_qs = f"{request.path}?{request.query_string.decode('latin-1')}"
+        return verify_signature(
+            replication_receiver.secret,
+            request.headers.get(SIGNATURE_HEADER),
+            request.method,
+            path_qs,
+            body_sha256,
+        )
+
+    def _json_body():
+        body = request.get_data(cache=False)
+        if not _authorized(hashlib.sha256(body).hexdigest()):
+            return None, ({"ok": False, "error": "Bad or expired signature."}, 403)
+        try:
+            return json.loads(body.decode("utf-8")), None
+        except ValueError:
+            return None, ({"ok": False, "error": "Body must be JSON."}, 400)
+
+    @app.route("/api/replication/batch", methods=["POST"])
+    def replication_batch():
+        data, error = _json_body()
+        if error:
+            return error
+        ops = data.get("ops") if isinstance(data, dict) else None
+        if not isinstance(ops, list):
+            return {"ok": False, "error": "ops must be a list."}, 400
+        try:
+            with timed_phase("io"):
+                need = replication_receiver.apply_batch(ops)
+        except (KeyError, TypeError, ValueError) as exc:
+            return {"ok": False, "error": f"Bad op: {exc}"}, 400
+        annotate_request(file_count=len(ops))
+        return {"ok": True, "need": need}
+
+    @app.route("/api/replication/object", methods=["PUT"])
+    def replication_object():
+        # The signature covers the declared checksum; the body is checked against it while staged.
+        sha256 = (request.headers.get(CONTENT_SHA_HEADER) or "").lower()
+        if not _authorized(sha256):
+            return {"ok": False, "error": "Bad or expired signature."}, 403
+        try:
+            folder = request.args["folder"]
+            name = request.args["name"]
+            size = int(request.args["size"])
+            mtime = float(request.args["mtime"])
+        except (KeyError, ValueError):
+            return {"ok": False, "error": "folder, name, size and mtime are required."}, 400
+        annotate_request(folder=folder, file=name, size=size)
+        try:
+            with timed_phase("io"):
+                replication_receiver.put_object(folder, name, size, mtime, sha256, request.stream)
+        except (ReplicationError, ValueError) as exc:
+            return {"ok": False, "error": str(exc)}, 400
+        return {"ok": True}
+
+    @app.route("/api/replication/pins", methods=["PUT"])
+    def replication_pins():
+        data, error = _json_body()
+        if error:
+            return error
+        try:
+            replication_receiver.put_pins(data)
+        except ValueError as exc:
+            return {"ok": False, "error": str(exc)}, 400
+        except OSError as exc:
+            return {"ok": False, "error": str(exc)}, 500
+        return {"ok": True}
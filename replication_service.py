@@ -0,0 +1,512 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from storage_service import CHUNK_SIZE
+
+
+logger = logging.getLogger("fts.replication")
+
+SIGNATURE_HEADER = "X-FTS-Replication-Signature"
+CONTENT_SHA_HEADER = "X-FTS-Content-SHA256"
+# Signed requests older (or newer) than this are refused.
+SIGNATURE_MAX_SKEW_SEC = 300
+
+
+class ReplicationError(Exception):
+    pass
+
+
+def sign_request(secret, method, path_qs, body_sha256, timestamp=None):
+    """Value for SIGNATURE_HEADER: "<unix time>:<hex HMAC-SHA256>"."""
+    timestamp = int(time.time() if timestamp is None else timestamp)
+    message = f"{timestamp}\n{method.upper()}\n{path_qs}\n{body_sha256}".encode("utf-8")
+    digest = hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+    return f"{timestamp}:{digest}"
+
+
+def verify_signature(secret, header, method, path_qs, body_sha256, now=None):
+    timestamp, _, _ = (header or "").partition(":")
+    try:
+        timestamp = int(timestamp)
+    except ValueError:
+        return False
+    now = time.time() if now is None else now
+    if abs(now - timestamp) > SIGNATURE_MAX_SKEW_SEC:
+        return False
+    expected = sign_request(secret, method, path_qs, body_sha256, timestamp)
+    return hmac.compare_digest(expected, header)
+
+
+def _coalesce(rows):
+    """Journal rows -> ops, keeping only the last change per file.
+
+    A folder delete drops the earlier changes to files in that folder, so the
+    peer never receives an upload it would delete again in the same batch.
+    """
+    ops = {}
+    for _seq, event, folder, name in rows:
+        if event == "delete_folder":
+            for key in [key for key in ops if key[0] == folder]:
+                del ops[key]
+            ops[(folder, None)] = {"op": "delete_folder", "folder": folder}
+        else:
+            ops.pop((folder, name), None)
+            ops[(folder, name)] = {"op": event, "folder": folder, "name": name}
+    return list(ops.values())
+
+
+class ReplicationService:
+    """Ships storage changes to peer servers, asynchronously.
+
+    Every upload and delete appends a row to a change journal in the
+    metadata store (all workers write to the same journal). One background
+    thread per server, holding a lease like the retention sweeper, reads the
+    journal in order and sends it to each peer in batches: deletes are
+    applied by the batch request itself, and the peer answers which uploads
+    it still needs; those are then streamed one by one with their SHA-256,
+    which the peer checks before the file replaces its copy. A peer's cursor
+    only advances once a whole batch is through; failures are retried with
+    exponential backoff, so nothing is lost while a peer is down.
+
+    Stored bytes are shipped as they are, so encrypted folders stay
+    ciphertext on the peer; `.folder_pins.json` is sent ahead of each batch
+    whenever it changed. A reconcile pass at startup and every
+    `reconcile_sec` lists every folder and brings the peer back in line
+    with changes the journal never saw (a CLI retention sweep, a server
+    started without replication...).
+
+    Requests are signed with HMAC-SHA256 under the shared `secret`.
+    """
+
+    POLL_SEC = 1.0
+    BATCH = 500
+    TIMEOUT_SEC = 60
+    MAX_BACKOFF_SEC = 300
+    LEASE_SEC = 30
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS replication_journal (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            event TEXT NOT NULL,
+            folder TEXT NOT NULL,
+            name TEXT,
+            recorded REAL NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS replication_peers (
+            peer TEXT PRIMARY KEY,
+            acked INTEGER NOT NULL DEFAULT 0,
+            pins_sha256 TEXT,
+            reconciled REAL,
+            last_ok REAL,
+            last_error TEXT,
+            failures INTEGER NOT NULL DEFAULT 0
+        )""",
+    ]
+
+    def __init__(self, metadata, storage, pin_service, peers, secret, reconcile_sec=24 * 3600):
+        self.metadata = metadata
+        self.storage = storage
+        self.pin_service = pin_service
+        self.peers = [peer.rstrip("/") for peer in peers]
+        self.secret = secret
+        self.reconcile_sec = float(reconcile_sec or 0)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lease_owner = f"{os.getpid()}-{id(self)}"
+        self._next_attempt = {}  # peer -> monotonic time of the next try after a failure
+        self._reconciled_here = set()  # peers reconciled since this process started
+        self.metadata.ensure_schema("replication", self.SCHEMA)
+
+    @classmethod
+    def from_env(cls, metadata, storage, pin_service):
+        """None unless FTS_REPLICATION_PEERS lists at least one peer."""
+        peers = [p.strip() for p in (os.environ.get("FTS_REPLICATION_PEERS") or "").split(",") if p.strip()]
+        if not peers:
+            return None
+        secret = os.environ.get("FTS_REPLICATION_SECRET") or ""
+        if not secret:
+            raise RuntimeError("FTS_REPLICATION_PEERS is set but FTS_REPLICATION_SECRET is not.")
+        peers = [p if "://" in p else "http://" + p for p in peers]
+        try:
+            reconcile_hours = float(os.environ.get("FTS_REPLICATION_RECONCILE_HOURS") or 24)
+        except ValueError:
+            reconcile_hours = 24
+        return cls(metadata, storage, pin_service, peers, secret, reconcile_sec=reconcile_hours * 3600)
+
+    # --- journal ----------------------------------------------------------
+
+    def on_storage_change(self, event, folder, name, old, new):
+        if event not in ("put", "delete", "delete_folder"):
+            return
+        self.metadata.execute(
+            "INSERT INTO replication_journal (event, folder, name, recorded) VALUES (?, ?, ?, ?)",
+            (event, folder, name, time.time()),
+        )
+        self._wake.set()
+
+    def _last_seq(self):
+        row = self.metadata.execute("SELECT MAX(seq) FROM replication_journal").fetchone()
+        return row[0] or 0
+
+    def _peer_row(self, peer):
+        self.metadata.execute("INSERT OR IGNORE INTO replication_peers (peer) VALUES (?)", (peer,))
+        row = self.metadata.execute(
+            "SELECT acked, pins_sha256, reconciled FROM replication_peers WHERE peer = ?", (peer,)
+        ).fetchone()
+        return {"acked": row[0], "pins_sha256": row[1], "reconciled": row[2]}
+
+    def _update_peer(self, peer, **fields):
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        self.metadata.execute(f"UPDATE replication_peers SET {columns} WHERE peer = ?", (*fields.values(), peer))
+
+    def _prune_journal(self):
+        placeholders = ",".join("?" * len(self.peers))
+        row = self.metadata.execute(
+            f"SELECT MIN(acked), COUNT(*) FROM replication_peers WHERE peer IN ({placeholders})", self.peers
+        ).fetchone()
+        if row[1] == len(self.peers) and row[0]:
+            self.metadata.execute("DELETE FROM replication_journal WHERE seq <= ?", (row[0],))
+
+    def status(self):
+        """Per-peer cursor, lag and last error, for `fts replication`."""
+        last = self._last_seq()
+        result = []
+        for peer in self.peers:
+            row = self.metadata.execute(
+                "SELECT acked, last_ok, last_error, failures, reconciled FROM replication_peers WHERE peer = ?",
+                (peer,),
+            ).fetchone() or (0, None, None, 0, None)
+            # Acknowledged rows may have been pruned: the cursor is then the newest seq.
+            last = max(last, row[0])
+            pending = self.metadata.execute(
+                "SELECT COUNT(*) FROM replication_journal WHERE seq > ?", (row[0],)
+            ).fetchone()[0]
+            result.append(
+                {
+                    "peer": peer,
+                    "acked": row[0],
+                    "last_seq": last,
+                    "pending": pending,
+                    "last_ok": row[1],
+                    "last_error": row[2],
+                    "failures": row[3],
+                    "reconciled": row[4],
+                }
+            )
+        return result
+
+    # --- HTTP -------------------------------------------------------------
+
+    def _request(self, peer, method, path, params=None, body=b"", body_sha256=None, length=None, headers=None):
+        query = urllib.parse.urlencode(params or {})
+        path_qs = f"{path}?{query}"
+        if body_sha256 is None:
+            body_sha256 = hashlib.sha256(body).hexdigest()
+        all_headers = {
+            SIGNATURE_HEADER: sign_request(self.secret, method, path_qs, body_sha256),
+            CONTENT_SHA_HEADER: body_sha256,
+            "Content-Length": str(len(body) if length is None else length),
+        }
+        all_headers.update(headers or {})
+        req = urllib.request.Request(peer + path_qs, data=body, method=method, headers=all_headers)
+        try:
+            with urllib.request.urlopen(req, timeout=self.TIMEOUT_SEC) as resp:
+                return json.loads(resp.read().decode("utf-8") or "{}")
+        except urllib.error.HTTPError as exc:
+            try:
+                detail = json.loads(exc.read().decode("utf-8") or "{}").get("error")
+            except (ValueError, OSError):
+                detail = None
+            raise ReplicationError(f"{method} {path}: HTTP {exc.code} {detail or ''}".strip()) from None
+        except (urllib.error.URLError, OSError, ValueError) as exc:
+            raise ReplicationError(f"{method} {path}: {exc}") from None
+
+    def _ship_pins(self, peer, state):
+        pins = self.pin_service.export_pins()
+        body = json.dumps(pins, sort_keys=True).encode("utf-8")
+        sha256 = hashlib.sha256(body).hexdigest()
+        if sha256 == state["pins_sha256"]:
+            return
+        self._request(peer, "PUT", "/api/replication/pins", body=body, headers={"Content-Type": "application/json"})
+        self._update_peer(peer, pins_sha256=sha256)
+        state["pins_sha256"] = sha256
+
+    def _ship_ops(self, peer, ops):
+        """Send one batch; then stream the files the peer asked for."""
+        for op in ops:
+            if op["op"] == "put":
+                stored = self.storage.stat(op["folder"], op["name"])
+                if stored is None:
+                    # Gone since it was journaled; the delete is further down the journal.
+                    op["op"] = "skip"
+                else:
+                    op["size"], op["mtime"] = stored.size, stored.mtime
+        ops = [op for op in ops if op["op"] != "skip"]
+        if not ops:
+            return
+        body = json.dumps({"ops": ops}).encode("utf-8")
+        reply = self._request(peer, "POST", "/api/replication/batch", body=body, headers={"Content-Type": "application/json"})
+        for index in reply.get("need") or []:
+            op = ops[index]
+            self._ship_file(peer, op["folder"], op["name"])
+
+    def _ship_file(self, peer, folder, name):
+        # Hash first, then stream: the signature covers the checksum, and the
+        # second read comes from the page cache.
+        stored = self.storage.stat(folder, name)
+        if stored is None:
+            return
+        sha = hashlib.sha256()
+        size = 0
+        for data in self.storage.iter_range(folder, name, 0, stored.size):
+            sha.update(data)
+            size += len(data)
+        self._request(
+            peer,
+            "PUT",
+            "/api/replication/object",
+            params={"folder": folder, "name": name, "size": size, "mtime": stored.mtime},
+            body=self.storage.iter_range(folder, name, 0, size),
+            body_sha256=sha.hexdigest(),
+            length=size,
+            headers={"Content-Type": "application/octet-stream"},
+        )
+
+    # --- shipping ---------------------------------------------------------
+
+    def _reconcile(self, peer):
+        folders = sorted(self.storage.list_folders())
+        for folder in folders:
+            names = []
+            ops = []
+            for item in self.storage.iter_files(folder):
+                names.append(item.name)
+                ops.append({"op": "put", "folder": folder, "name": item.name})
+                if len(ops) >= self.BATCH:
+                    self._ship_ops(peer, ops)
+                    ops = []
+            ops.append({"op": "retain", "folder": folder, "names": names})
+            self._ship_ops(peer, ops)
+        # An empty listing looks more like a missing disk than an empty
+        # server: never let it wipe the peer.
+        if folders:
+            self._ship_ops(peer, [{"op": "retain_folders", "folders": folders}])
+
+    def sync_peer(self, peer):
+        """Bring one peer up to date. Raises ReplicationError on failure."""
+        state = self._peer_row(peer)
+        self._ship_pins(peer, state)
+        due = peer not in self._reconciled_here or (
+            self.reconcile_sec and time.time() - (state["reconciled"] or 0) >= self.reconcile_sec
+        )
+        if due:
+            # Changes journaled meanwhile are replayed below; replaying is harmless.
+            self._reconcile(peer)
+            self._reconciled_here.add(peer)
+            self._update_peer(peer, reconciled=time.time())
+        shipped = 0
+        while not self._stop.is_set():
+            rows = self.metadata.execute(
+                "SELECT seq, event, folder, name FROM replication_journal WHERE seq > ? ORDER BY seq LIMIT ?",
+                (state["acked"], self.BATCH),
+            ).fetchall()
+            if not rows:
+                break
+            self._ship_pins(peer, state)
+            self._ship_ops(peer, _coalesce(rows))
+            state["acked"] = rows[-1][0]
+            self._update_peer(peer, acked=state["acked"])
+            shipped += len(rows)
+        return shipped
+
+    def _acquire_lease(self):
+        """Only one process ships when several workers share the journal."""
+        now = time.time()
+        with self.metadata.transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS flags (key TEXT PRIMARY KEY, value TEXT)")
+            row = conn.execute("SELECT value FROM flags WHERE key = 'replication_lease'").fetchone()
+            if row:
+                owner, _, until = row[0].partition("|")
+                if owner != self._lease_owner and float(until or 0) > now:
+                    return False
+            conn.execute(
+                "INSERT OR REPLACE INTO flags (key, value) VALUES ('replication_lease', ?)",
+                (f"{self._lease_owner}|{now + self.LEASE_SEC}",),
+            )
+        return True
+
+    def run_once(self):
+        shipped = 0
+        for peer in self.peers:
+            if time.monotonic() < self._next_attempt.get(peer, 0):
+                continue
+            try:
+                shipped += self.sync_peer(peer)
+            except ReplicationError as exc:
+                row = self.metadata.execute(
+                    "SELECT failures FROM replication_peers WHERE peer = ?", (peer,)
+                ).fetchone()
+                failures = (row[0] if row else 0) + 1
+                delay = min(self.MAX_BACKOFF_SEC, 2 ** min(failures, 16))
+                self._next_attempt[peer] = time.monotonic() + delay
+                self._update_peer(peer, failures=failures, last_error=str(exc))
+                logger.warning("Replication to %s failed (retry in %ds): %s", peer, delay, exc)
+                continue
+            self._next_attempt.pop(peer, None)
+            self._update_peer(peer, failures=0, last_error=None, last_ok=time.time())
+        self._prune_journal()
+        return shipped
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._acquire_lease():
+                    self.run_once()
+            except Exception:
+                logger.exception("Replication pass failed")
+            self._wake.wait(self.POLL_SEC)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="fts-replication", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+
+class ReplicationReceiver:
+    """Peer side: applies batches, files and the pins file sent by a primary.
+
+    Files are staged under `staging_dir`, checked against the SHA-256 the
+    primary signed, and only then moved into place through the storage
+    backend, so usage, digests and search on the peer follow as usual.
+    `replica_objects` remembers the primary's size and mtime for each file
+    to tell which uploads in a batch the peer already has.
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS replica_objects (
+            folder TEXT NOT NULL,
+            name TEXT NOT NULL,
+            source_size INTEGER NOT NULL,
+            source_mtime REAL NOT NULL,
+            stored_size INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            PRIMARY KEY (folder, name)
+        )""",
+    ]
+
+    def __init__(self, metadata, storage, pin_service, staging_dir, secret):
+        self.metadata = metadata
+        self.storage = storage
+        self.pin_service = pin_service
+        self.staging_dir = staging_dir
+        self.secret = secret
+        self.metadata.ensure_schema("replica", self.SCHEMA)
+
+    @classmethod
+    def from_env(cls, metadata, storage, pin_service, staging_dir, read_only=False):
+        """None unless this server is a read-only replica and FTS_REPLICATION_SECRET is set.
+
+        The receive endpoints replace and delete files; a primary holds the
+        same secret only to sign what it sends, and must not accept them.
+        """
+        secret = os.environ.get("FTS_REPLICATION_SECRET") or ""
+        if not secret or not read_only:
+            return None
+        return cls(metadata, storage, pin_service, staging_dir, secret)
+
+    def on_storage_change(self, event, folder, name, old, new):
+        if event == "delete_folder":
+            self.metadata.execute("DELETE FROM replica_objects WHERE folder = ?", (folder,))
+        elif event == "delete":
+            self.metadata.execute("DELETE FROM replica_objects WHERE folder = ? AND name = ?", (folder, name))
+
+    def _needs(self, op):
+        stored = self.storage.stat(op["folder"], op["name"])
+        if stored is None:
+            return True
+        row = self.metadata.execute(
+            "SELECT source_size, source_mtime, stored_size FROM replica_objects WHERE folder = ? AND name = ?",
+            (op["folder"], op["name"]),
+        ).fetchone()
+        return row is None or (row[0], row[1], row[2]) != (int(op["size"]), float(op["mtime"]), stored.size)
+
+    def apply_batch(self, ops):
+        """Apply deletes in order; return the indexes of uploads still needed."""
+        need = []
+        for index, op in enumerate(ops):
+            kind = op.get("op")
+            if kind == "put":
+                if self._needs(op):
+                    need.append(index)
+            elif kind == "delete":
+                self.storage.delete(op["folder"], op["name"])
+            elif kind == "delete_folder":
+                self.storage.delete_folder(op["folder"])
+            elif kind == "retain":
+                keep = set(op.get("names") or ())
+                for item in list(self.storage.iter_files(op["folder"])):
+                    if item.name not in keep:
+                        self.storage.delete(op["folder"], item.name)
+            elif kind == "retain_folders":
+                keep = set(op.get("folders") or ())
+                for folder in list(self.storage.list_folders()):
+                    if folder not in keep:
+                        self.storage.delete_folder(folder)
+            else:
+                raise ValueError(f"Unknown replication op: {kind!r}")
+        return need
+
+    def put_object(self, folder, name, size, mtime, sha256, stream):
+        """Stage a file from the primary, verify it, then move it into place."""
+        os.makedirs(self.staging_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".replica-", dir=self.staging_dir)
+        digest = hashlib.sha256()
+        received = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    data = stream.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    digest.update(data)
+                    out.write(data)
+                    received += len(data)
+            if received != size or not hmac.compare_digest(digest.hexdigest(), sha256.lower()):
+                raise ReplicationError("Checksum mismatch")
+            # Keep the primary's modification time (LocalStorage moves the file as is).
+            os.utime(tmp_path, (mtime, mtime))
+            self.storage.put_file(folder, name, tmp_path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        stored = self.storage.stat(folder, name)
+        self.metadata.execute(
+            "INSERT OR REPLACE INTO replica_objects "
+            "(folder, name, source_size, source_mtime, stored_size, sha256) VALUES (?, ?, ?, ?, ?, ?)",
+            (folder, name, size, mtime, stored.size if stored else size, sha256.lower()),
+        )
+
+    def put_pins(self, pins):
+        if not isinstance(pins, dict):
+            raise ValueError("Pins must be a JSON object")
+        if not self.pin_service.replace_pins(pins):
+            raise OSError("Could not write the pins file")
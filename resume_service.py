@@ -0,0 +1,186 @@
+import hashlib
+import os
+import shutil
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process, striped thread locks instead
+    fcntl = None
+
+from storage_service import CHUNK_SIZE, _valid_name
+
+
+class ResumeConflict(Exception):
+    """The client's offset doesn't match what the server holds."""
+
+    def __init__(self, offset):
+        super().__init__(f"Upload is at offset {offset}.")
+        self.offset = offset
+
+
+class ResumeError(ValueError):
+    pass
+
+
+class ResumableUploads:
+    """Chunked uploads that survive dropped connections (used by `fts push`).
+
+    Partial files are staged under <staging_root>/<folder>/<name>.part, out of
+    every listing. In an encrypted folder each chunk is stored as its own
+    Fernet token, so plaintext never touches the disk; on commit the chunks
+    are decrypted, joined and encrypted again as one file.
+
+    Appends to one partial file are serialised by an flock on a sidecar
+    `<name>.part.lock`, which also holds across pool workers; uploads of
+    different files never wait for each other.
+    """
+
+    STALE_AFTER_SEC = 2 * 24 * 3600
+    MAX_ENCRYPTED_CHUNK = 64 * 1024 * 1024
+    RECORD = struct.Struct(">QI")  # plaintext length, token length
+    LOCK_STRIPES = 64
+
+    def __init__(self, staging_root, storage, digest_service):
+        self.staging_root = staging_root
+        self.storage = storage
+        self.digest_service = digest_service
+        self._stripes = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+
+    def _path(self, folder, name):
+        if not _valid_name(folder) or not _valid_name(name):
+            raise ResumeError("Invalid file name.")
+        return os.path.join(self.staging_root, folder, name + ".part")
+
+    @contextmanager
+    def _part_lock(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if fcntl is None:
+            with self._stripes[hash(path) % self.LOCK_STRIPES]:
+                yield
+            return
+        lock_path = path + ".lock"
+        with open(lock_path, "a") as lock_fh:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX)
+            # Kept fresh while the upload is active, so prune() leaves it alone.
+            os.utime(lock_path)
+            yield
+
+    def offset(self, folder, name, encrypted=False):
+        path = self._path(folder, name)
+        try:
+            if not encrypted:
+                return os.path.getsize(path)
+            total = 0
+            with open(path, "rb") as fh:
+                while True:
+                    header = fh.read(self.RECORD.size)
+                    if len(header) < self.RECORD.size:
+                        return total
+                    plain_len, token_len = self.RECORD.unpack(header)
+                    fh.seek(token_len, os.SEEK_CUR)
+                    total += plain_len
+        except FileNotFoundError:
+            return 0
+
+    def append(self, folder, name, offset, stream, total, fernet=None, sha256=None):
+        """Add the chunk in `stream` at `offset`. Returns (new offset, committed)."""
+        path = self._path(folder, name)
+        if offset == 0:
+            self.prune()
+        with self._part_lock(path):
+            current = self.offset(folder, name, encrypted=fernet is not None)
+            if offset != current:
+                raise ResumeConflict(current)
+            remaining = total - offset
+            if fernet is None:
+                with open(path, "ab") as out:
+                    written = _copy_limited(stream, out, remaining)
+            else:
+                data = stream.read(min(remaining, self.MAX_ENCRYPTED_CHUNK) + 1)
+                if len(data) > remaining:
+                    raise ResumeError("Chunk goes past the declared total size.")
+                token = fernet.encrypt(data)
+                with open(path, "ab") as out:
+                    out.write(self.RECORD.pack(len(data), len(token)))
+                    out.write(token)
+                written = len(data)
+            new_offset = offset + written
+            if new_offset < total:
+                return new_offset, False
+            self._commit(folder, name, path, total, fernet, sha256)
+            return new_offset, True
+
+    def _commit(self, folder, name, path, total, fernet, sha256):
+        try:
+            if fernet is None:
+                digest = hashlib.sha256()
+                with open(path, "rb") as fh:
+                    for data in iter(lambda: fh.read(CHUNK_SIZE), b""):
+                        digest.update(data)
+                self._check(digest.hexdigest(), sha256)
+                self.storage.put_file(folder, name, path)
+            else:
+                parts = []
+                with open(path, "rb") as fh:
+                    while True:
+                        header = fh.read(self.RECORD.size)
+                        if len(header) < self.RECORD.size:
+                            break
+                        _, token_len = self.RECORD.unpack(header)
+                        parts.append(fernet.decrypt(fh.read(token_len)))
+                plaintext = b"".join(parts)
+                digest = hashlib.sha256(plaintext)
+                self._check(digest.hexdigest(), sha256)
+                self.storage.write_bytes(folder, name, fernet.encrypt(plaintext))
+                os.unlink(path)
+        except BaseException:
+            # A bad partial can't be resumed into a good file: start over.
+            self.discard(folder, name)
+            raise
+        self.digest_service.record(folder, name, digest.hexdigest(), total)
+
+    def _check(self, actual, expected):
+        if expected and actual != expected.lower():
+            raise ResumeError("Uploaded data does not match its SHA-256; upload it again.")
+
+    def discard(self, folder, name):
+        try:
+            os.unlink(self._path(folder, name))
+        except OSError:
+            pass
+
+    def discard_folder(self, folder):
+        if _valid_name(folder):
+            shutil.rmtree(os.path.join(self.staging_root, folder), ignore_errors=True)
+
+    def prune(self, now=None):
+        """Drop partial uploads nobody resumed for STALE_AFTER_SEC."""
+        cutoff = (time.time() if now is None else now) - self.STALE_AFTER_SEC
+        for root, _, files in os.walk(self.staging_root):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.unlink(path)
+                except OSError:
+                    pass
+
+    def on_storage_change(self, event, folder, name, old, new):
+        if event == "delete_folder":
+            self.discard_folder(folder)
+
+
+def _copy_limited(stream, out, limit):
+    written = 0
+    while True:
+        data = stream.read(CHUNK_SIZE)
+        if not data:
+            return written
+        if written + len(data) > limit:
+            raise ResumeError("Chunk goes past the declared total size.")
+        out.write(data)
+        written += len(data)
@@ -0,0 +1,297 @@
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger("fts.retention")
+
+
+class RetentionService:
+    """Expiry index plus a background sweeper enforcing retention policies.
+
+    Every stored file has a row in `file_expiry` with the time it becomes due
+    (from max age / max idle) and the bucket that time falls in. The sweeper
+    only reads buckets that are already due, so it never rescans the uploads
+    tree. Max-size eviction reads the same table ordered by mtime.
+    """
+
+    BUCKET_SEC = 300
+    SWEEP_INTERVAL_SEC = 60
+    SWEEP_BATCH = 500
+    # Download touches are written at most this often per file.
+    ACCESS_RESOLUTION_SEC = 3600
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS file_expiry (
+            folder TEXT NOT NULL,
+            name TEXT NOT NULL,
+            size INTEGER NOT NULL DEFAULT 0,
+            mtime REAL NOT NULL,
+            atime REAL NOT NULL,
+            expires_at REAL,
+            bucket INTEGER,
+            PRIMARY KEY (folder, name)
+        )""",
+        "CREATE INDEX IF NOT EXISTS file_expiry_bucket ON file_expiry (bucket)",
+        "CREATE INDEX IF NOT EXISTS file_expiry_folder_mtime ON file_expiry (folder, mtime)",
+        """CREATE TABLE IF NOT EXISTS folder_retention (
+            folder TEXT PRIMARY KEY,
+            max_age REAL,
+            max_idle REAL,
+            max_bytes INTEGER
+        )""",
+    ]
+
+    def __init__(self, metadata, storage, usage_service, max_age=0, max_idle=0, max_bytes=0):
+        self.metadata = metadata
+        self.storage = storage
+        self.usage_service = usage_service
+        self.default_policy = {
+            "max_age": float(max_age or 0),
+            "max_idle": float(max_idle or 0),
+            "max_bytes": int(max_bytes or 0),
+        }
+        self._stop = threading.Event()
+        self._thread = None
+        self._lease_owner = f"{os.getpid()}-{id(self)}"
+        self.metadata.ensure_schema("retention", self.SCHEMA)
+
+    @classmethod
+    def from_env(cls, metadata, storage, usage_service):
+        return cls(
+            metadata,
+            storage,
+            usage_service,
+            max_age=_env_float("FTS_RETENTION_MAX_AGE_HOURS") * 3600,
+            max_idle=_env_float("FTS_RETENTION_MAX_IDLE_HOURS") * 3600,
+            max_bytes=int(_env_float("FTS_RETENTION_MAX_BYTES")),
+        )
+
+    # -- policies ---------------------------------------------------------
+
+    def get_policy(self, folder):
+        row = self.metadata.execute(
+            "SELECT max_age, max_idle, max_bytes FROM folder_retention WHERE folder = ?",
+            (folder,),
+        ).fetchone()
+        policy = dict(self.default_policy)
+        if row:
+            for key, value in zip(("max_age", "max_idle", "max_bytes"), row):
+                if value is not None:
+                    policy[key] = value
+        return policy
+
+    def set_policy(self, folder, max_age=None, max_idle=None, max_bytes=None):
+        """Per-folder override (seconds / bytes); 0 disables a limit, None leaves it as is."""
+        with self.metadata.transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO folder_retention (folder) VALUES (?)", (folder,))
+            for column, value in (("max_age", max_age), ("max_idle", max_idle), ("max_bytes", max_bytes)):
+                if value is not None:
+                    conn.execute(f"UPDATE folder_retention SET {column} = ? WHERE folder = ?", (value, folder))
+        self._recompute(folder)
+
+    def _expires_at(self, policy, mtime, atime):
+        candidates = []
+        if policy["max_age"]:
+            candidates.append(mtime + policy["max_age"])
+        if policy["max_idle"]:
+            candidates.append(max(mtime, atime) + policy["max_idle"])
+        return min(candidates) if candidates else None
+
+    def _bucket(self, expires_at):
+        return None if expires_at is None else int(expires_at // self.BUCKET_SEC)
+
+    def _recompute(self, folder=None):
+        """Re-derive due times from stored mtime/atime after a policy change (no disk access)."""
+        folders = [folder] if folder else [
+            row[0] for row in self.metadata.execute("SELECT DISTINCT folder FROM file_expiry").fetchall()
+        ]
+        for name in folders:
+            policy = self.get_policy(name)
+            rows = self.metadata.execute(
+                "SELECT name, mtime, atime FROM file_expiry WHERE folder = ?",
+                (name,),
+            ).fetchall()
+            with self.metadata.transaction() as conn:
+                for file_name, mtime, atime in rows:
+                    expires_at = self._expires_at(policy, mtime, atime)
+                    conn.execute(
+                        "UPDATE file_expiry SET expires_at = ?, bucket = ? WHERE folder = ? AND name = ?",
+                        (expires_at, self._bucket(expires_at), name, file_name),
+                    )
+
+    # -- index maintenance -------------------------------------------------
+
+    def ensure_initialized(self):
+        if not self.metadata.get_flag("retention_initialized"):
+            now = time.time()
+            for folder in self.storage.list_folders():
+                policy = self.get_policy(folder)
+                with self.metadata.transaction() as conn:
+                    for item in self.storage.iter_files(folder):
+                        self._upsert(conn, policy, folder, item.name, item.size, item.mtime, item.mtime)
+            self.metadata.set_flag("retention_initialized", now)
+        # A changed server-wide policy only needs the index rewritten, not a rescan.
+        signature = repr(sorted(self.default_policy.items()))
+        if self.metadata.get_flag("retention_default_policy") != signature:
+            self._recompute()
+            self.metadata.set_flag("retention_default_policy", signature)
+
+    def _upsert(self, conn, policy, folder, name, size, mtime, atime):
+        expires_at = self._expires_at(policy, mtime, atime)
+        conn.execute(
+            "INSERT OR REPLACE INTO file_expiry (folder, name, size, mtime, atime, expires_at, bucket) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (folder, name, size, mtime, atime, expires_at, self._bucket(expires_at)),
+        )
+
+    def on_storage_change(self, event, folder, name, old, new):
+        if event == "delete_folder":
+            self.metadata.execute("DELETE FROM file_expiry WHERE folder = ?", (folder,))
+            return
+        if event == "delete":
+            self.metadata.execute("DELETE FROM file_expiry WHERE folder = ? AND name = ?", (folder, name))
+            return
+        if new is None:
+            return
+        # Re-encryption passes keep the file mtime, so they don't reset its age.
+        row = self.metadata.execute(
+            "SELECT atime FROM file_expiry WHERE folder = ? AND name = ?",
+            (folder, name),
+        ).fetchone()
+        atime = max(row[0], new.mtime) if row else new.mtime
+        policy = self.get_policy(folder)
+        with self.metadata.transaction() as conn:
+            self._upsert(conn, policy, folder, name, new.size, new.mtime, atime)
+
+    def record_access(self, folder, name):
+        policy = self.get_policy(folder)
+        if not policy["max_idle"]:
+            return
+        now = time.time()
+        row = self.metadata.execute(
+            "SELECT mtime, atime FROM file_expiry WHERE folder = ? AND name = ?",
+            (folder, name),
+        ).fetchone()
+        if row is None or now - row[1] < self.ACCESS_RESOLUTION_SEC:
+            return
+        expires_at = self._expires_at(policy, row[0], now)
+        self.metadata.execute(
+            "UPDATE file_expiry SET atime = ?, expires_at = ?, bucket = ? WHERE folder = ? AND name = ?",
+            (now, expires_at, self._bucket(expires_at), folder, name),
+        )
+
+    # -- sweeping -----------------------------------------------------------
+
+    def sweep_once(self, now=None):
+        """Delete due files and evict over-size folders. Returns files removed."""
+        now = time.time() if now is None else now
+        removed = 0
+        due_bucket = self._bucket(now)
+        # Files that could not be deleted keep their row; the rowid cursor moves
+        # past them so they are retried on the next sweep instead of in a loop.
+        after = 0
+        while True:
+            rows = self.metadata.execute(
+                "SELECT rowid, folder, name FROM file_expiry "
+                "WHERE bucket <= ? AND expires_at <= ? AND rowid > ? ORDER BY rowid LIMIT ?",
+                (due_bucket, now, after, self.SWEEP_BATCH),
+            ).fetchall()
+            if not rows:
+                break
+            for after, folder, name in rows:
+                removed += self._remove(folder, name)
+            if len(rows) < self.SWEEP_BATCH:
+                break
+        for folder in self._folders_over_size():
+            removed += self._evict_oldest(folder)
+        return removed
+
+    def _remove(self, folder, name):
+        try:
+            deleted = self.storage.delete(folder, name)
+        except OSError:
+            logger.warning("Retention could not delete %s/%s", folder, name)
+            return 0
+        if not deleted:
+            # Gone already (deleted outside the server): drop the stale row.
+            self.metadata.execute("DELETE FROM file_expiry WHERE folder = ? AND name = ?", (folder, name))
+        return 1 if deleted else 0
+
+    def _folders_over_size(self):
+        usage = self.usage_service.all_usage()
+        over = []
+        for folder, counts in usage.items():
+            limit = self.get_policy(folder)["max_bytes"]
+            if limit and counts["bytes"] > limit:
+                over.append(folder)
+        return over
+
+    def _evict_oldest(self, folder):
+        limit = self.get_policy(folder)["max_bytes"]
+        removed = 0
+        # Oldest first; the (mtime, rowid) cursor skips files that could not be deleted.
+        after = (float("-inf"), 0)
+        while self.usage_service.get_usage(folder)["bytes"] > limit:
+            rows = self.metadata.execute(
+                "SELECT mtime, rowid, name FROM file_expiry WHERE folder = ? AND (mtime, rowid) > (?, ?) "
+                "ORDER BY mtime, rowid LIMIT ?",
+                (folder, *after, 50),
+            ).fetchall()
+            if not rows:
+                break
+            for mtime, rowid, name in rows:
+                after = (mtime, rowid)
+                removed += self._remove(folder, name)
+                if self.usage_service.get_usage(folder)["bytes"] <= limit:
+                    break
+        return removed
+
+    def _acquire_lease(self):
+        """Only one process sweeps at a time when several workers share the store."""
+        now = time.time()
+        lease_until = now + self.SWEEP_INTERVAL_SEC * 2
+        with self.metadata.transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS flags (key TEXT PRIMARY KEY, value TEXT)")
+            row = conn.execute("SELECT value FROM flags WHERE key = 'retention_lease'").fetchone()
+            if row:
+                owner, _, until = row[0].partition("|")
+                if owner != self._lease_owner and float(until or 0) > now:
+                    return False
+            conn.execute(
+                "INSERT OR REPLACE INTO flags (key, value) VALUES ('retention_lease', ?)",
+                (f"{self._lease_owner}|{lease_until}",),
+            )
+        return True
+
+    def has_policies(self):
+        if any(self.default_policy.values()):
+            return True
+        return self.metadata.execute("SELECT 1 FROM folder_retention LIMIT 1").fetchone() is not None
+
+    def _run(self):
+        while not self._stop.wait(self.SWEEP_INTERVAL_SEC):
+            try:
+                if self.has_policies() and self._acquire_lease():
+                    removed = self.sweep_once()
+                    if removed:
+                        logger.info("Retention sweep removed %d file(s).", removed)
+            except Exception:
+                logger.exception("Retention sweep failed")
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="fts-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def _env_float(name):
+    try:
+        return float(os.environ.get(name) or 0)
+    except ValueError:
+        return 0.0
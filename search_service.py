@@ -0,0 +1,132 @@
+import sqlite3
+
+
+class SearchService:
+    """Filename index over every folder, kept current from storage events.
+
+    `file_names` holds one row per stored file with its lowercased name;
+    short queries are prefix range scans on that column's index. Longer
+    queries also match anywhere in the name through an FTS5 trigram index
+    (kept in sync by triggers). On an SQLite built without the trigram
+    tokenizer, substring search falls back to a LIKE scan over the index.
+    """
+
+    MAX_LIMIT = 200
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS file_names (
+            id INTEGER PRIMARY KEY,
+            folder TEXT NOT NULL,
+            name TEXT NOT NULL,
+            lname TEXT NOT NULL,
+            size INTEGER NOT NULL DEFAULT 0,
+            mtime REAL NOT NULL DEFAULT 0,
+            UNIQUE (folder, name)
+        )""",
+        "CREATE INDEX IF NOT EXISTS file_names_lname ON file_names (lname)",
+    ]
+    TRIGRAM_SCHEMA = [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS file_names_trigram USING fts5(
+            lname, content='file_names', content_rowid='id', tokenize='trigram'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS file_names_ai AFTER INSERT ON file_names BEGIN
+            INSERT INTO file_names_trigram (rowid, lname) VALUES (new.id, new.lname);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS file_names_ad AFTER DELETE ON file_names BEGIN
+            INSERT INTO file_names_trigram (file_names_trigram, rowid, lname) VALUES ('delete', old.id, old.lname);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS file_names_au AFTER UPDATE OF lname ON file_names BEGIN
+            INSERT INTO file_names_trigram (file_names_trigram, rowid, lname) VALUES ('delete', old.id, old.lname);
+            INSERT INTO file_names_trigram (rowid, lname) VALUES (new.id, new.lname);
+        END""",
+    ]
+
+    def __init__(self, metadata, storage):
+        self.metadata = metadata
+        self.storage = storage
+        self.metadata.ensure_schema("search", self.SCHEMA)
+        try:
+            self.metadata.ensure_schema("search_trigram", self.TRIGRAM_SCHEMA)
+            self.trigram = True
+        except sqlite3.OperationalError:
+            self.trigram = False
+
+    def ensure_initialized(self):
+        """Index what is already stored (once); later changes come from storage events."""
+        flag = "search_initialized_trigram" if self.trigram else "search_initialized"
+        if self.metadata.get_flag(flag):
+            return
+        with self.metadata.transaction() as conn:
+            conn.execute("DELETE FROM file_names")
+            for folder in self.storage.list_folders():
+                conn.executemany(
+                    "INSERT OR REPLACE INTO file_names (folder, name, lname, size, mtime) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        (folder, item.name, item.name.lower(), item.size, item.mtime or 0)
+                        for item in self.storage.iter_files(folder)
+                    ),
+                )
+        self.metadata.set_flag(flag, "1")
+
+    def on_storage_change(self, event, folder, name, old, new):
+        if event == "delete_folder":
+            self.metadata.execute("DELETE FROM file_names WHERE folder = ?", (folder,))
+        elif event == "delete":
+            self.metadata.execute("DELETE FROM file_names WHERE folder = ? AND name = ?", (folder, name))
+        elif new is not None:
+            self.metadata.execute(
+                "INSERT INTO file_names (folder, name, lname, size, mtime) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (folder, name) DO UPDATE SET size = excluded.size, mtime = excluded.mtime",
+                (folder, name, name.lower(), new.size, new.mtime or 0),
+            )
+
+    def search(self, query, hidden_folders=(), limit=50):
+        """Files whose name starts with `query`, then those containing it.
+
+        Returns [{"folder", "name", "size", "mtime"}]; folders in
+        `hidden_folders` are left out in SQL, not filtered afterwards.
+        """
+        needle = (query or "").strip().lower()
+        limit = max(1, min(int(limit), self.MAX_LIMIT))
+        if not needle:
+            return []
+        exclude = " AND f.folder NOT IN (SELECT folder FROM temp.search_hidden)" if self._hide(hidden_folders) else ""
+        columns = "SELECT f.folder, f.name, f.size, f.mtime FROM file_names f"
+        # Prefix matches first: a range scan on the lname index.
+        rows = self.metadata.execute(
+            f"{columns} WHERE f.lname >= ? AND f.lname < ?{exclude} ORDER BY f.lname LIMIT ?",
+            (needle, needle + "\U0010ffff", limit),
+        ).fetchall()
+        if len(rows) < limit and len(needle) >= 3:
+            seen = {(row[0], row[1]) for row in rows}
+            if self.trigram:
+                phrase = '"' + needle.replace('"', '""') + '"'
+                more = self.metadata.execute(
+                    f"{columns} JOIN file_names_trigram t ON t.rowid = f.id "
+                    f"WHERE file_names_trigram MATCH ?{exclude} LIMIT ?",
+                    (phrase, limit + len(rows)),
+                ).fetchall()
+            else:
+                pattern = "%" + needle.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                more = self.metadata.execute(
+                    f"{columns} WHERE f.lname LIKE ? ESCAPE '\\'{exclude} LIMIT ?",
+                    (pattern, limit + len(rows)),
+                ).fetchall()
+            for row in more:
+                if (row[0], row[1]) not in seen and len(rows) < limit:
+                    rows.append(row)
+        return [{"folder": r[0], "name": r[1], "size": r[2], "mtime": r[3]} for r in rows]
+
+    def _hide(self, hidden_folders):
+        """Put `hidden_folders` in this connection's temp table. Returns whether any are hidden.
+
+        One bound parameter per folder would hit SQLite's variable limit once
+        there are enough locked folders. Connections are per thread, so
+        concurrent searches each have their own table.
+        """
+        conn = self.metadata.connection()
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS search_hidden (folder TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.search_hidden")
+        hidden = set(hidden_folders)
+        conn.executemany("INSERT INTO temp.search_hidden (folder) VALUES (?)", ((folder,) for folder in hidden))
+        return bool(hidden)
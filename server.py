@@ -4,15 +4,38 @@ import sys
 from flask import Flask, request
 from flask_sock import Sock
 
+from access_log_service import AccessLog, register_access_log_hooks
+from batch_routes import register_batch_routes
+from decrypt_cache_service import DecryptCache
+from delta_service import DeltaService
+from digest_service import DigestService
+from live_routes import register_live_routes
+from live_service import LiveUpdates
+from metadata_store import MetadataStore
 from pin_routes import register_pin_routes
 from pin_service import PinService
+from profiling_service import RequestProfiler, register_profiling_hooks
+from rate_limit_service import PinRateLimiter
+from replication_routes import register_replication_routes
+from replication_service import ReplicationReceiver, ReplicationService
+from resume_service import ResumableUploads
+from retention_service import RetentionService
+from search_service import SearchService
+from share_routes import register_share_routes
+from share_service import ShareLinks
+from static_assets import StaticAssets, register_static_assets
+from storage_service import create_storage
+from trash_service import TrashReaper
 from ui_pages import (
     render_folder_not_found_page,
     render_home_page,
     render_pin_entry_page,
     render_uploads_page,
+    stream_uploads_page,
 )
 from upload_routes import register_upload_routes
+from usage_service import UsageService
+from worker_pool import connect_shared_state
 
 
 # Windows: prevent Werkzeug from using socket.fromfd (not supported on Windows).
@@ -23,8 +46,8 @@ if sys.platform == "win32":
 
 
 def get_or_create_folder(folder_path):
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
+    # exist_ok: pool workers import this module concurrently on a fresh tree.
+    os.makedirs(folder_path, exist_ok=True)
     return folder_path
 
 
@@ -51,46 +74,142 @@ if not os.path.isdir(_STATIC_DIR):
 app = Flask(__name__, template_folder=_TEMPLATE_DIR, static_folder=_STATIC_DIR)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev-secret-change-in-production")
+# A read-only replica serves downloads of what a primary replicates to it.
+READ_ONLY = os.environ.get("FTS_READ_ONLY", "").lower() in ("1", "true", "yes", "on")
 sock = Sock(app)
 
-pin_service = PinService(app.config["UPLOAD_FOLDER"], app.secret_key)
-
-
-def _safe_upload_path(*parts):
-    base = os.path.abspath(app.config["UPLOAD_FOLDER"])
-    path = os.path.abspath(os.path.join(base, *parts))
-    return path if path.startswith(base) and os.path.exists(path) else None
+assets = StaticAssets(_STATIC_DIR)
+assets.build()
+register_static_assets(app, assets)
+
+storage = create_storage(app.config["UPLOAD_FOLDER"])
+metadata = MetadataStore(os.path.join(app.config["UPLOAD_FOLDER"], ".fts_meta.sqlite3"))
+usage_service = UsageService.from_env(metadata, storage)
+usage_service.ensure_initialized()
+storage.subscribe(usage_service.on_storage_change)
+# Under `fts start --workers N`, unlock tokens, PIN attempt counters and the
+# PIN rate limiter are shared by all worker processes through the supervisor.
+unlock_store, attempt_store, pin_limiter = connect_shared_state()
+if pin_limiter is None:
+    pin_limiter = PinRateLimiter.from_env()
+pin_service = PinService(
+    app.config["UPLOAD_FOLDER"],
+    app.secret_key,
+    storage,
+    unlock_store=unlock_store,
+    attempt_store=attempt_store,
+)
+retention_service = RetentionService.from_env(metadata, storage, usage_service)
+retention_service.ensure_initialized()
+storage.subscribe(retention_service.on_storage_change)
+digest_service = DigestService(metadata, storage)
+storage.subscribe(digest_service.on_storage_change)
+delta_service = DeltaService(storage, digest_service)
+share_links = ShareLinks(app.secret_key, metadata)
+storage.subscribe(share_links.on_storage_change)
+search_service = SearchService(metadata, storage)
+search_service.ensure_initialized()
+storage.subscribe(search_service.on_storage_change)
+decrypt_cache = DecryptCache.from_env(storage)
+if decrypt_cache is not None:
+    storage.subscribe(decrypt_cache.on_storage_change)
+live_updates = LiveUpdates(metadata)
+storage.subscribe(live_updates.on_storage_change)
+resumable_uploads = ResumableUploads(
+    os.path.join(app.config["UPLOAD_FOLDER"], ".fts_partials"), storage, digest_service
+)
+storage.subscribe(resumable_uploads.on_storage_change)
+replication_service = ReplicationService.from_env(metadata, storage, pin_service)
+if replication_service is not None:
+    storage.subscribe(replication_service.on_storage_change)
+    replication_service.start()
+replication_receiver = ReplicationReceiver.from_env(
+    metadata, storage, pin_service, os.path.join(app.config["UPLOAD_FOLDER"], ".fts_replication"), READ_ONLY
+)
+if replication_receiver is not None:
+    storage.subscribe(replication_receiver.on_storage_change)
+if not READ_ONLY:
+    # On a replica, expiry comes from the primary's deletes.
+    retention_service.start()
+for trash_dir in storage.trash_dirs:
+    trash_reaper = TrashReaper.from_env(trash_dir)
+    storage.subscribe(trash_reaper.on_storage_change)
+    trash_reaper.start()
+profiler = RequestProfiler.from_env()
+register_profiling_hooks(app, profiler)
+access_log = AccessLog.from_env()
+if access_log is not None:
+    access_log.start()
+    register_access_log_hooks(app, access_log, lambda: get_client_ip().strip())
 
 
 register_pin_routes(
     app=app,
     pin_service=pin_service,
-    safe_upload_path=_safe_upload_path,
+    pin_limiter=pin_limiter,
+    storage=storage,
     get_client_ip=get_client_ip,
     render_pin_entry_page=render_pin_entry_page,
+    read_only=READ_ONLY,
+    live_updates=live_updates,
+    decrypt_cache=decrypt_cache,
+    share_links=share_links,
 )
 
+register_share_routes(
+    app=app,
+    share_links=share_links,
+    pin_service=pin_service,
+    storage=storage,
+    retention_service=retention_service,
+    get_client_ip=get_client_ip,
+    stream_uploads_page=stream_uploads_page,
+    decrypt_cache=decrypt_cache,
+)
+
+register_replication_routes(app=app, replication_receiver=replication_receiver, read_only=READ_ONLY)
+
 register_upload_routes(
     app=app,
     pin_service=pin_service,
-    safe_upload_path=_safe_upload_path,
+    storage=storage,
+    usage_service=usage_service,
+    retention_service=retention_service,
+    digest_service=digest_service,
+    delta_service=delta_service,
+    search_service=search_service,
+    resumable_uploads=resumable_uploads,
     get_client_ip=get_client_ip,
     render_uploads_page=render_uploads_page,
+    stream_uploads_page=stream_uploads_page,
     render_folder_not_found_page=render_folder_not_found_page,
     render_home_page=render_home_page,
+    decrypt_cache=decrypt_cache,
 )
 
+register_batch_routes(
+    app=app,
+    pin_service=pin_service,
+    storage=storage,
+    usage_service=usage_service,
+    digest_service=digest_service,
+    get_client_ip=get_client_ip,
+)
 
-@sock.route("/websocket")
-def websocket(ws):
-    while True:
-        try:
-            data = ws.receive()
-            if data is None:
-                break
-            ws.send(data)
-        except Exception:
-            break
+register_live_routes(
+    app=app,
+    sock=sock,
+    live_updates=live_updates,
+    pin_service=pin_service,
+    storage=storage,
+    usage_service=usage_service,
+    get_client_ip=get_client_ip,
+)
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return {"ok": True, "pid": os.getpid()}
 
 
 DEFAULT_PORT = 8069
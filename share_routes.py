@@ -0,0 +1,129 @@
+import math
+import mimetypes
+import time
+from io import BytesIO
+from urllib.parse import quote
+
+from flask import request, send_file
+
+from profiling_service import annotate_request, timed_phase
+from share_service import ShareError
+from upload_routes import send_stored_file
+
+
+def register_share_routes(
+    app,
+    share_links,
+    pin_service,
+    storage,
+    retention_service,
+    get_client_ip,
+    stream_uploads_page,
+    decrypt_cache=None,
+):
+    @app.route("/api/shares", methods=["POST"])
+    def create_share():
+        """Create a share link for one of your folders, or one file in it."""
+        data = request.get_json(force=True, silent=True) or {}
+        folder = data.get("folder") if isinstance(data.get("folder"), str) else ""
+        name = data.get("name") if isinstance(data.get("name"), str) else None
+        client_ip = get_client_ip().strip()
+        if client_ip != folder and client_ip not in ("127.0.0.1", "::1"):
+            return {"ok": False, "error": "You can only share your own folder."}, 403
+        if not storage.folder_exists(folder):
+            return {"ok": False, "error": "Folder not found."}, 404
+        if name and storage.stat(folder, name) is None:
+            return {"ok": False, "error": "File not found."}, 404
+        try:
+            hours = float(data.get("hours") or 24)
+            max_downloads = max(0, int(data.get("max_downloads") or 0))
+        except (TypeError, ValueError, OverflowError):
+            return {"ok": False, "error": "hours and max_downloads must be numbers."}, 400
+        if not math.isfinite(hours) or hours <= 0:
+            return {"ok": False, "error": "hours must be a positive number."}, 400
+        if pin_service.folder_has_pin(folder) and not pin_service.is_folder_unlocked(folder):
+            return {"ok": False, "locked": True, "error": "Unlock your folder with its PIN first."}, 403
+        fek_b64 = None
+        if pin_service.folder_has_encryption(folder):
+            fek_b64 = pin_service.get_fek_b64_for_folder(folder)
+            if not fek_b64:
+                return {"ok": False, "locked": True, "error": "Unlock your folder with its PIN first."}, 403
+        token, expires = share_links.create(folder, name, hours * 3600, max_downloads, fek_b64)
+        return {"ok": True, "url": f"{request.host_url}s/{token}", "expires": expires}
+
+    def _error(exc):
+        return str(exc), exc.status
+
+    @app.route("/s/<token>", methods=["GET"])
+    @app.route("/s/<token>/<path:name>", methods=["GET"])
+    def shared(token, name=None):
+        # Everything comes from the token: no session, PIN file or unlock store.
+        try:
+            grant = share_links.verify(token)
+        except ShareError as exc:
+            return _error(exc)
+        if grant.name:
+            if name not in (None, grant.name):
+                return "Not found", 404
+            name = grant.name
+        annotate_request(folder=grant.folder, file=name)
+        if name is None:
+            return _shared_listing(token, grant)
+
+        stored = storage.stat(grant.folder, name)
+        if stored is None:
+            return "Not found", 404
+        if not share_links.consume(grant):
+            return "This share link has been used up.", 410
+        preview_mode = request.args.get("preview") == "1"
+        mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        annotate_request(size=stored.size, encrypted=grant.fernet is not None)
+        retention_service.record_access(grant.folder, name)
+        if grant.fernet is None:
+            return send_stored_file(storage, grant.folder, name, not preview_mode, mimetype)
+        try:
+            if decrypt_cache is not None:
+                plaintext, hit = decrypt_cache.read(grant.folder, name, stored, grant.fernet, grant.key_id)
+                annotate_request(cache="hit" if hit else "miss")
+            else:
+                with timed_phase("io"):
+                    ciphertext = storage.read_bytes(grant.folder, name)
+                with timed_phase("crypto"):
+                    plaintext = grant.fernet.decrypt(ciphertext)
+        except Exception:
+            return "Decryption failed", 500
+        return send_file(BytesIO(plaintext), as_attachment=not preview_mode, download_name=name, mimetype=mimetype)
+
+    def _shared_listing(token, grant):
+        sort = request.args.get("sort", "-mtime")
+        if sort not in {"name", "-name", "size", "-size", "mtime", "-mtime"}:
+            sort = "-mtime"
+
+        def _items():
+            with timed_phase("io"):
+                files = storage.list_files(grant.folder)
+            reverse = sort.startswith("-")
+            key = sort[1:] if reverse else sort
+            if key == "name":
+                files.sort(key=lambda f: f.name.lower(), reverse=reverse)
+            else:
+                files.sort(key=lambda f: getattr(f, key) or 0, reverse=reverse)
+            annotate_request(file_count=len(files))
+            for stored in files:
+                yield {
+                    "url": f"/s/{token}/{quote(stored.name)}",
+                    "label": stored.name,
+                    "size": stored.size,
+                    "mtime": stored.mtime,
+                }
+
+        left = max(0, int(grant.expires - time.time()))
+        breadcrumb = f"Shared folder &middot; link valid for {left // 3600} h {left % 3600 // 60} min"
+        return stream_uploads_page(
+            f"Shared: {grant.folder}",
+            breadcrumb,
+            _items(),
+            list_class="files-table",
+            nav_html="",
+            current_sort=sort,
+        )
@@ -0,0 +1,143 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from collections import namedtuple
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from decrypt_cache_service import key_fingerprint
+
+
+ShareGrant = namedtuple("ShareGrant", ["id", "folder", "name", "expires", "max_downloads", "fernet", "key_id"])
+
+
+class ShareError(Exception):
+    def __init__(self, message, status=403):
+        super().__init__(message)
+        self.status = status
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class ShareLinks:
+    """Time-limited share links that carry everything needed to serve them.
+
+    A token is `<payload>.<signature>`: the payload (folder, optional file
+    name, expiry, download cap, a random id) is signed with HMAC-SHA256
+    under a key derived from the app secret, and checked with a
+    constant-time compare. For an encrypted folder the payload also holds
+    the folder key, wrapped (Fernet) under a second derived key, so a
+    download never reads `.folder_pins.json`, the session or the unlock
+    store. Capped links count uses in `share_uses`.
+
+    Every link also carries its folder's generation from `share_generations`.
+    Changing the folder PIN or deleting the folder bumps it, which revokes
+    every link issued before, including the folder key those links carry.
+    """
+
+    DEFAULT_TTL_SEC = 24 * 3600
+    MAX_TTL_SEC = 30 * 24 * 3600
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS share_uses (
+            id TEXT PRIMARY KEY,
+            uses INTEGER NOT NULL DEFAULT 0,
+            expires REAL NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS share_generations (
+            folder TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 0
+        )""",
+    ]
+
+    def __init__(self, secret_key, metadata):
+        secret = secret_key.encode("utf-8") if isinstance(secret_key, str) else secret_key
+        self._sign_key = hmac.new(secret, b"fts-share-links", hashlib.sha256).digest()
+        wrap_key = hmac.new(secret, b"fts-share-key-wrap", hashlib.sha256).digest()
+        self._wrapper = Fernet(base64.urlsafe_b64encode(wrap_key))
+        self.metadata = metadata
+        self.metadata.ensure_schema("shares", self.SCHEMA)
+
+    def _sign(self, payload_b64):
+        return hmac.new(self._sign_key, payload_b64.encode("ascii"), hashlib.sha256).digest()
+
+    def _generation(self, folder):
+        row = self.metadata.execute("SELECT generation FROM share_generations WHERE folder = ?", (folder,)).fetchone()
+        return row[0] if row else 0
+
+    def revoke(self, folder):
+        """Invalidate every link issued so far for `folder`."""
+        self.metadata.execute(
+            "INSERT INTO share_generations (folder, generation) VALUES (?, 1) "
+            "ON CONFLICT (folder) DO UPDATE SET generation = generation + 1",
+            (folder,),
+        )
+
+    def on_storage_change(self, event, folder, name, old, new):
+        if event == "delete_folder":
+            self.revoke(folder)
+
+    def create(self, folder, name=None, ttl_sec=None, max_downloads=0, fek_b64=None):
+        """Return (token, expires_at)."""
+        ttl = self.DEFAULT_TTL_SEC if ttl_sec is None else int(ttl_sec)
+        ttl = max(60, min(ttl, self.MAX_TTL_SEC))
+        expires = int(time.time()) + ttl
+        payload = {"i": os.urandom(9).hex(), "f": folder, "e": expires, "g": self._generation(folder)}
+        if name:
+            payload["n"] = name
+        if max_downloads:
+            payload["u"] = max(1, int(max_downloads))
+        if fek_b64:
+            payload["k"] = self._wrapper.encrypt(fek_b64.encode("ascii")).decode("ascii")
+        payload_b64 = _b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+        self.metadata.execute("DELETE FROM share_uses WHERE expires < ?", (time.time(),))
+        return f"{payload_b64}.{_b64encode(self._sign(payload_b64))}", expires
+
+    def verify(self, token):
+        """The ShareGrant for a token; raises ShareError if forged or expired."""
+        payload_b64, _, signature = (token or "").partition(".")
+        try:
+            given = _b64decode(signature)
+        except ValueError:
+            given = b""
+        if not hmac.compare_digest(self._sign(payload_b64), given):
+            raise ShareError("This share link is not valid.", 403)
+        payload = json.loads(_b64decode(payload_b64))
+        if payload["e"] < time.time():
+            raise ShareError("This share link has expired.", 410)
+        if payload.get("g", 0) != self._generation(payload["f"]):
+            raise ShareError("This share link has been revoked.", 410)
+        fernet = None
+        key_id = None
+        if payload.get("k"):
+            try:
+                fek_b64 = self._wrapper.decrypt(payload["k"].encode("ascii"))
+                fernet = Fernet(fek_b64)
+            except (InvalidToken, ValueError):
+                raise ShareError("This share link is not valid.", 403) from None
+            key_id = key_fingerprint(fek_b64)
+        return ShareGrant(
+            payload["i"], payload["f"], payload.get("n"), payload["e"], payload.get("u", 0), fernet, key_id
+        )
+
+    def consume(self, grant):
+        """Count one download against a capped link. False once it is used up."""
+        if not grant.max_downloads:
+            return True
+        with self.metadata.transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO share_uses (id, uses, expires) VALUES (?, 0, ?)", (grant.id, grant.expires)
+            )
+            cursor = conn.execute(
+                "UPDATE share_uses SET uses = uses + 1 WHERE id = ? AND uses < ?", (grant.id, grant.max_downloads)
+            )
+            return cursor.rowcount == 1
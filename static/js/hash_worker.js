@@ -0,0 +1,136 @@
+/*
+ * Upload preflight hashing, run as a Web Worker so large files don't freeze the page.
+ * Message in:  { id: <any>, file: <File> }
+ * Messages out: { id, type: "progress", bytes } ... then { id, type: "done", sha256 }
+ *               or { id, type: "error", message }.
+ * SHA-256 is computed incrementally (crypto.subtle.digest needs the whole file in memory).
+ */
+var CHUNK_SIZE = 4 * 1024 * 1024;
+
+var K = new Uint32Array([
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+]);
+
+function Sha256() {
+    this.h = new Uint32Array([
+        0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19
+    ]);
+    this.w = new Uint32Array(64);
+    this.block = new Uint8Array(64);
+    this.blockLen = 0;
+    this.bytes = 0;
+}
+
+Sha256.prototype.compress = function (buf, off) {
+    var w = this.w;
+    var h = this.h;
+    var i;
+    for (i = 0; i < 16; i++) {
+        var j = off + i * 4;
+        w[i] = (buf[j] << 24) | (buf[j + 1] << 16) | (buf[j + 2] << 8) | buf[j + 3];
+    }
+    for (i = 16; i < 64; i++) {
+        var x = w[i - 15];
+        var y = w[i - 2];
+        var s0 = ((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3);
+        var s1 = ((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10);
+        w[i] = (w[i - 16] + s0 + w[i - 7] + s1) | 0;
+    }
+    var a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], k = h[7];
+    for (i = 0; i < 64; i++) {
+        var bigS1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+        var ch = (e & f) ^ (~e & g);
+        var t1 = (k + bigS1 + ch + K[i] + w[i]) | 0;
+        var bigS0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+        var maj = (a & b) ^ (a & c) ^ (b & c);
+        var t2 = (bigS0 + maj) | 0;
+        k = g;
+        g = f;
+        f = e;
+        e = (d + t1) | 0;
+        d = c;
+        c = b;
+        b = a;
+        a = (t1 + t2) | 0;
+    }
+    h[0] += a;
+    h[1] += b;
+    h[2] += c;
+    h[3] += d;
+    h[4] += e;
+    h[5] += f;
+    h[6] += g;
+    h[7] += k;
+};
+
+Sha256.prototype.update = function (data) {
+    var i = 0;
+    var n = data.length;
+    this.bytes += n;
+    if (this.blockLen) {
+        while (i < n && this.blockLen < 64) {
+            this.block[this.blockLen++] = data[i++];
+        }
+        if (this.blockLen < 64) {
+            return;
+        }
+        this.compress(this.block, 0);
+        this.blockLen = 0;
+    }
+    while (i + 64 <= n) {
+        this.compress(data, i);
+        i += 64;
+    }
+    while (i < n) {
+        this.block[this.blockLen++] = data[i++];
+    }
+};
+
+Sha256.prototype.hexdigest = function () {
+    var bits = this.bytes * 8;
+    var tail = new Uint8Array(this.blockLen < 56 ? 64 - this.blockLen : 128 - this.blockLen);
+    tail[0] = 0x80;
+    var hi = Math.floor(bits / 0x100000000);
+    var lo = bits >>> 0;
+    var end = tail.length;
+    tail[end - 8] = hi >>> 24;
+    tail[end - 7] = (hi >>> 16) & 0xff;
+    tail[end - 6] = (hi >>> 8) & 0xff;
+    tail[end - 5] = hi & 0xff;
+    tail[end - 4] = lo >>> 24;
+    tail[end - 3] = (lo >>> 16) & 0xff;
+    tail[end - 2] = (lo >>> 8) & 0xff;
+    tail[end - 1] = lo & 0xff;
+    var bytes = this.bytes;
+    this.update(tail);
+    this.bytes = bytes;
+    var out = "";
+    for (var i = 0; i < 8; i++) {
+        out += ("00000000" + this.h[i].toString(16)).slice(-8);
+    }
+    return out;
+};
+
+self.onmessage = function (ev) {
+    var id = ev.data && ev.data.id;
+    var file = ev.data && ev.data.file;
+    try {
+        var reader = new FileReaderSync();
+        var hash = new Sha256();
+        for (var offset = 0; offset < file.size; offset += CHUNK_SIZE) {
+            var chunk = reader.readAsArrayBuffer(file.slice(offset, offset + CHUNK_SIZE));
+            hash.update(new Uint8Array(chunk));
+            self.postMessage({ id: id, type: "progress", bytes: Math.min(file.size, offset + CHUNK_SIZE) });
+        }
+        self.postMessage({ id: id, type: "done", sha256: hash.hexdigest() });
+    } catch (e) {
+        self.postMessage({ id: id, type: "error", message: String((e && e.message) || e) });
+    }
+};
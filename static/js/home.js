@@ -184,19 +184,147 @@ function transit() {
     var pinConfirm = document.getElementById("home-pin-confirm");
     var pinError = document.getElementById("home-pin-error");
 
+    var hashWorkerUrl = bodyEl && bodyEl.dataset ? bodyEl.dataset.hashWorkerUrl : null;
+
+    function setProgress(percent) {
+        var bar = document.getElementById("progress-bar");
+        var pct = document.getElementById("progress-pct");
+        if (bar) {
+            bar.style.width = percent + "%";
+        }
+        if (pct) {
+            pct.textContent = percent + "%";
+        }
+    }
+
+    function hashFiles(files, done) {
+        // SHA-256 every file in a Web Worker. On any failure report no digests,
+        // and the caller simply uploads everything.
+        if (!hashWorkerUrl || typeof Worker === "undefined" || !files.length) {
+            done(null);
+            return;
+        }
+        var worker;
+        try {
+            worker = new Worker(hashWorkerUrl);
+        } catch (e) {
+            done(null);
+            return;
+        }
+        var total = files.reduce(function (sum, f) { return sum + (f.size || 0); }, 0) || 1;
+        var hashedBefore = 0;
+        var index = 0;
+        var digests = [];
+        worker.onmessage = function (ev) {
+            var msg = ev.data || {};
+            if (msg.type === "progress") {
+                setProgress(Math.round(((hashedBefore + msg.bytes) / total) * 100));
+                return;
+            }
+            if (msg.type !== "done") {
+                worker.terminate();
+                done(null);
+                return;
+            }
+            digests.push(msg.sha256);
+            hashedBefore += files[index].size || 0;
+            index += 1;
+            if (index < files.length) {
+                worker.postMessage({ id: index, file: files[index] });
+            } else {
+                worker.terminate();
+                done(digests);
+            }
+        };
+        worker.onerror = function () {
+            worker.terminate();
+            done(null);
+        };
+        worker.postMessage({ id: 0, file: files[0] });
+    }
+
+    function preflight(files, done) {
+        var label = document.getElementById("progress-label");
+        if (label) {
+            label.textContent = "Checking files...";
+        }
+        hashFiles(files, function (digests) {
+            if (!digests) {
+                done(files);
+                return;
+            }
+            var xhr = new XMLHttpRequest();
+            xhr.open("POST", "/api/upload-preflight");
+            xhr.setRequestHeader("Content-Type", "application/json");
+            xhr.onload = function () {
+                var have = [];
+                if (xhr.status >= 200 && xhr.status < 300) {
+                    try { have = JSON.parse(xhr.responseText).have || []; } catch (z) {}
+                }
+                done(files.filter(function (file) { return have.indexOf(file.name) === -1; }));
+            };
+            xhr.onerror = function () { done(files); };
+            xhr.send(JSON.stringify({
+                files: files.map(function (file, i) {
+                    return { name: file.name, size: file.size, sha256: digests[i] };
+                })
+            }));
+        });
+    }
+
+    function uploadDone(message) {
+        var label = document.getElementById("progress-label");
+        if (label) {
+            label.textContent = message;
+        }
+        setProgress(100);
+        // Stay on the page: clear the selection and link to the folder instead of reloading.
+        setTimeout(function () {
+            var b = document.getElementById("body");
+            if (b) {
+                b.style.visibility = "hidden";
+            }
+            setSelectedFiles([]);
+            if (selectedCount) {
+                selectedCount.textContent = message + " ";
+                if (window.UPLOADER_FOLDER) {
+                    var link = document.createElement("a");
+                    link.href = "/uploads/" + encodeURIComponent(window.UPLOADER_FOLDER);
+                    link.textContent = "Open your folder";
+                    selectedCount.appendChild(link);
+                }
+            }
+        }, 600);
+    }
+
     function doUpload() {
         if (!selectedFiles.length) {
             return;
         }
         transit();
+        preflight(selectedFiles, function (toSend) {
+            var skipped = selectedFiles.length - toSend.length;
+            if (!toSend.length) {
+                uploadDone("Already uploaded, nothing changed.");
+                return;
+            }
+            sendFiles(toSend, skipped);
+        });
+    }
+
+    function sendFiles(files, skipped) {
         var fd = new FormData();
-        selectedFiles.forEach(function (file) {
+        files.forEach(function (file) {
             fd.append("file", file);
         });
         var xhr = new XMLHttpRequest();
         var bar = document.getElementById("progress-bar");
         var pct = document.getElementById("progress-pct");
         var label = document.getElementById("progress-label");
+        if (label) {
+            label.textContent = skipped ? "Uploading (" + skipped + " unchanged skipped)..." : "Uploading...";
+        }
+        setProgress(0);
         xhr.upload.addEventListener("progress", function (e) {
             if (e.lengthComputable && pct) {
                 var percent = Math.round((e.loaded / e.total) * 100);
@@ -210,19 +338,10 @@ function transit() {
         });
         xhr.addEventListener("load", function () {
             if (xhr.status >= 200 && xhr.status < 300) {
-                if (label) {
-                    label.textContent = "Done!";
-                }
-                if (bar) {
-                    bar.style.width = "100%";
-                }
-                if (pct) {
-                    pct.textContent = "100%";
-                }
-                setTimeout(function () { window.location.href = "/"; }, 600);
+                uploadDone("Done!");
             } else {
                 if (label) {
-                    label.textContent = "Upload failed";
+                    label.textContent = xhr.status === 413 && xhr.responseText ? xhr.responseText : "Upload failed";
                 }
                 setTimeout(function () {
                     var b = document.getElementById("body");
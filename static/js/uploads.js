@@ -2,21 +2,56 @@
     var modal = document.getElementById("delete-modal");
     var cancelBtn = document.querySelector(".js-modal-cancel");
     var deleteBtn = document.querySelector(".js-modal-delete");
-    var pendingForm = null;
-
-    document.querySelectorAll(".js-delete-trigger").forEach(function (btn) {
-        btn.addEventListener("click", function () {
-            pendingForm = this.closest("form");
-            if (pendingForm && modal) {
-                var titleEl = modal.querySelector(".js-modal-title");
-                if (titleEl) {
-                    titleEl.textContent = pendingForm.getAttribute("data-confirm-message") || "Delete?";
+    var pendingAction = null;
+
+    // Delegated, so rows added by live updates work too.
+    document.addEventListener("click", function (e) {
+        var btn = e.target.closest(".js-delete-trigger");
+        if (!btn) {
+            return;
+        }
+        var form = btn.closest("form");
+        if (form) {
+            confirmDelete(form.getAttribute("data-confirm-message") || "Delete?", function () {
+                submitDelete(form);
+            });
+        }
+    });
+
+    function confirmDelete(message, action) {
+        if (!modal) {
+            return;
+        }
+        pendingAction = action;
+        var titleEl = modal.querySelector(".js-modal-title");
+        if (titleEl) {
+            titleEl.textContent = message;
+        }
+        modal.classList.add("is-open");
+        modal.setAttribute("aria-hidden", "false");
+    }
+
+    function submitDelete(form) {
+        var row = form.closest("tr, li");
+        var xhr = new XMLHttpRequest();
+        xhr.open("POST", form.action);
+        xhr.setRequestHeader("Accept", "application/json");
+        xhr.onload = function () {
+            if (xhr.status >= 200 && xhr.status < 300) {
+                if (window.ftsLiveListing) {
+                    window.ftsLiveListing.removeRow(row);
+                } else {
+                    window.location.reload();
                 }
-                modal.classList.add("is-open");
-                modal.setAttribute("aria-hidden", "false");
+            } else {
+                window.alert(xhr.responseText || "Delete failed");
             }
-        });
-    });
+        };
+        xhr.onerror = function () {
+            window.alert("Network error");
+        };
+        xhr.send();
+    }
 
     function closeModal() {
         if (!modal) {
@@ -24,7 +59,7 @@
         }
         modal.classList.remove("is-open");
         modal.setAttribute("aria-hidden", "true");
-        pendingForm = null;
+        pendingAction = null;
     }
 
     if (cancelBtn) {
@@ -32,10 +67,11 @@
     }
     if (deleteBtn) {
         deleteBtn.addEventListener("click", function () {
-            if (pendingForm) {
-                pendingForm.submit();
-            }
+            var action = pendingAction;
             closeModal();
+            if (action) {
+                action();
+            }
         });
     }
     if (modal) {
@@ -45,19 +81,20 @@
             }
         });
     }
+
+    window.ftsConfirmDelete = confirmDelete;
 })();
 
 (function () {
-    document.querySelectorAll(".file-table-row").forEach(function (row) {
-        row.addEventListener("click", function (ev) {
-            if (ev.target.closest(".row-actions-table, .delete-form, .download-btn, .delete-btn")) {
-                return;
-            }
-            var trigger = row.querySelector(".js-file-preview-trigger");
-            if (trigger) {
-                trigger.click();
-            }
-        });
+    document.addEventListener("click", function (ev) {
+        var row = ev.target.closest(".file-table-row");
+        if (!row || ev.target.closest(".js-file-preview-trigger, .js-file-select, .row-actions-table, .delete-form, .download-btn, .delete-btn")) {
+            return;
+        }
+        var trigger = row.querySelector(".js-file-preview-trigger");
+        if (trigger) {
+            trigger.click();
+        }
     });
 })();
 
@@ -131,16 +168,43 @@
         }
     }
 
-    document.querySelectorAll(".js-pin-menu").forEach(function (btn) {
-        btn.addEventListener("click", function (e) {
-            e.preventDefault();
-            var folder = this.getAttribute("data-folder");
-            var hasPin = this.getAttribute("data-has-pin") || "false";
-            if (folder) {
-                showPinModal(folder, hasPin);
+    document.addEventListener("click", function (e) {
+        var btn = e.target.closest(".js-pin-menu");
+        if (!btn) {
+            return;
+        }
+        e.preventDefault();
+        var folder = btn.getAttribute("data-folder");
+        var hasPin = btn.getAttribute("data-has-pin") || "false";
+        if (folder) {
+            showPinModal(folder, hasPin);
+        }
+    });
+
+    function markPinned(folder, hasPin) {
+        document.querySelectorAll(".js-pin-menu").forEach(function (btn) {
+            if (btn.getAttribute("data-folder") !== folder) {
+                return;
+            }
+            btn.setAttribute("data-has-pin", hasPin ? "true" : "false");
+            var link = btn.closest("li") && btn.closest("li").querySelector("a");
+            var icon = link && link.querySelector(".lock-icon");
+            if (hasPin && link && !icon) {
+                icon = document.createElement("span");
+                icon.className = "lock-icon";
+                icon.title = "Protected";
+                icon.setAttribute("aria-hidden", "true");
+                icon.textContent = "\uD83D\uDD12";
+                link.insertBefore(document.createTextNode(" "), link.firstChild);
+                link.insertBefore(icon, link.firstChild);
+            } else if (!hasPin && icon) {
+                if (icon.nextSibling && icon.nextSibling.nodeType === 3) {
+                    link.removeChild(icon.nextSibling);
+                }
+                link.removeChild(icon);
             }
         });
-    });
+    }
 
     if (pinCancelBtn) {
         pinCancelBtn.addEventListener("click", closePinModal);
@@ -194,8 +258,8 @@
             xhr.setRequestHeader("Content-Type", "application/json");
             xhr.onload = function () {
                 if (xhr.status >= 200 && xhr.status < 300) {
+                    markPinned(currentPinFolder, true);
                     closePinModal();
-                    window.location.reload();
                 } else {
                     var r = null;
                     try { r = JSON.parse(xhr.responseText); } catch (z) {}
@@ -284,9 +348,9 @@
             xhr.setRequestHeader("Content-Type", "application/json");
             xhr.onload = function () {
                 if (xhr.status >= 200 && xhr.status < 300) {
+                    markPinned(currentPinFolder, false);
                     closeRemovePinModal();
                     closePinModal();
-                    window.location.reload();
                 } else {
                     var r = null;
                     try { r = JSON.parse(xhr.responseText); } catch (z) {}
@@ -300,3 +364,438 @@
         });
     }
 })();
+
+(function () {
+    var input = document.getElementById("file-search-input");
+    var list = document.getElementById("file-search-results");
+    if (!input || !list) {
+        return;
+    }
+    var timer = null;
+    var pending = null;
+    var lastQuery = "";
+
+    function formatSize(bytes) {
+        var units = ["B", "KB", "MB", "GB", "TB"];
+        var i = 0;
+        while (bytes >= 1024 && i < units.length - 1) {
+            bytes /= 1024;
+            i++;
+        }
+        return (i === 0 ? bytes : bytes.toFixed(1)) + " " + units[i];
+    }
+
+    function render(results, query) {
+        list.innerHTML = "";
+        if (!results.length) {
+            var empty = document.createElement("li");
+            empty.className = "file-search-empty";
+            empty.textContent = "No files match \u201c" + query + "\u201d";
+            list.appendChild(empty);
+        }
+        results.forEach(function (item) {
+            var li = document.createElement("li");
+            var link = document.createElement("a");
+            link.href = item.url;
+            link.className = "file-search-name";
+            link.textContent = item.name;
+            var meta = document.createElement("span");
+            meta.className = "file-search-meta";
+            var folderLink = document.createElement("a");
+            folderLink.href = item.folder_url;
+            folderLink.textContent = item.folder;
+            meta.appendChild(folderLink);
+            meta.appendChild(document.createTextNode(" \u00b7 " + formatSize(item.size)));
+            li.appendChild(link);
+            li.appendChild(meta);
+            list.appendChild(li);
+        });
+        list.hidden = false;
+    }
+
+    function runSearch() {
+        var query = input.value.trim();
+        if (query === lastQuery) {
+            return;
+        }
+        lastQuery = query;
+        if (pending) {
+            pending.abort();
+            pending = null;
+        }
+        if (!query) {
+            list.hidden = true;
+            list.innerHTML = "";
+            return;
+        }
+        var xhr = new XMLHttpRequest();
+        pending = xhr;
+        xhr.open("GET", "/api/search?q=" + encodeURIComponent(query));
+        xhr.onload = function () {
+            pending = null;
+            if (xhr.status < 200 || xhr.status >= 300) {
+                return;
+            }
+            try {
+                render(JSON.parse(xhr.responseText).results || [], query);
+            } catch (e) {}
+        };
+        xhr.send();
+    }
+
+    input.addEventListener("input", function () {
+        clearTimeout(timer);
+        timer = setTimeout(runSearch, 150);
+    });
+    input.addEventListener("keydown", function (e) {
+        if (e.key === "Escape") {
+            input.value = "";
+            runSearch();
+        }
+    });
+})();
+
+(function () {
+    function showLink(url) {
+        if (navigator.clipboard && window.isSecureContext) {
+            navigator.clipboard.writeText(url).then(function () {
+                window.alert("Share link copied. It is valid for 24 hours.");
+            }, function () {
+                window.prompt("Share link (valid for 24 hours):", url);
+            });
+        } else {
+            window.prompt("Share link (valid for 24 hours):", url);
+        }
+    }
+
+    document.addEventListener("click", function (e) {
+        var btn = e.target.closest(".js-share-trigger");
+        if (!btn) {
+            return;
+        }
+        e.preventDefault();
+        var xhr = new XMLHttpRequest();
+        xhr.open("POST", "/api/shares");
+        xhr.setRequestHeader("Content-Type", "application/json");
+        xhr.onload = function () {
+            var r = null;
+            try {
+                r = JSON.parse(xhr.responseText);
+            } catch (err) {}
+            if (xhr.status >= 200 && xhr.status < 300 && r && r.url) {
+                showLink(r.url);
+            } else {
+                window.alert((r && r.error) || "Could not create a share link.");
+            }
+        };
+        xhr.send(JSON.stringify({
+            folder: btn.getAttribute("data-folder"),
+            name: btn.getAttribute("data-name"),
+            hours: 24
+        }));
+    });
+})();
+
+(function () {
+    // Live listing: the server pushes row patches over /websocket (or, where the
+    // server cannot hold one open, they are polled from /api/changes) so the
+    // page never has to be reloaded to show uploads, deletes or PIN changes.
+    var cursor = document.body.getAttribute("data-live-cursor");
+    var match = window.location.pathname.match(/^\/uploads(?:\/([^\/]+))?\/?$/);
+    if (!cursor || !match) {
+        return;
+    }
+    var folder = match[1] ? decodeURIComponent(match[1]) : null;
+    var sort = new URLSearchParams(window.location.search).get("sort") || "-mtime";
+    var POLL_MS = 3000;
+
+    function container() {
+        return folder ? document.querySelector(".uploads-table tbody") : document.querySelector("ul.card-list");
+    }
+
+    function rows() {
+        var list = container();
+        if (!list) {
+            return [];
+        }
+        return Array.prototype.filter.call(list.children, function (el) {
+            return el.hasAttribute("data-name");
+        });
+    }
+
+    function findRow(name) {
+        var found = null;
+        rows().forEach(function (el) {
+            if (el.getAttribute("data-name") === name) {
+                found = el;
+            }
+        });
+        return found;
+    }
+
+    function removeRow(row) {
+        if (!row || !row.parentNode) {
+            return;
+        }
+        var next = row.nextElementSibling;
+        if (next && next.classList.contains("file-preview-row")) {
+            next.parentNode.removeChild(next);
+        }
+        row.parentNode.removeChild(row);
+    }
+
+    // True if row `a` belongs above row `b` in the current sort order.
+    function before(a, b) {
+        var nameA = a.getAttribute("data-name");
+        var nameB = b.getAttribute("data-name");
+        if (!folder) {
+            return nameA > nameB;
+        }
+        var reverse = sort.charAt(0) === "-";
+        var key = reverse ? sort.slice(1) : sort;
+        var x;
+        var y;
+        if (key === "name") {
+            x = nameA.toLowerCase();
+            y = nameB.toLowerCase();
+        } else {
+            x = Number(a.getAttribute("data-" + key)) || 0;
+            y = Number(b.getAttribute("data-" + key)) || 0;
+        }
+        return reverse ? x > y : x < y;
+    }
+
+    function upsert(name, html) {
+        var list = container();
+        if (!list) {
+            // First row of an empty page: there is no table to patch yet.
+            window.location.reload();
+            return;
+        }
+        var holder = document.createElement(folder ? "tbody" : "ul");
+        holder.innerHTML = html;
+        var row = holder.firstElementChild;
+        removeRow(findRow(name));
+        var next = null;
+        rows().some(function (el) {
+            if (before(row, el)) {
+                next = el;
+                return true;
+            }
+            return false;
+        });
+        list.insertBefore(row, next);
+    }
+
+    function apply(messages) {
+        messages.forEach(function (m) {
+            if (m.cursor) {
+                cursor = String(m.cursor);
+            }
+            if (m.type === "upsert") {
+                upsert(m.name, m.html);
+            } else if (m.type === "remove") {
+                removeRow(findRow(m.name));
+            } else if (m.type === "folder_removed") {
+                window.location.href = "/uploads";
+            } else if (m.type === "locked" || m.type === "reload") {
+                window.location.reload();
+            }
+        });
+    }
+
+    function poll() {
+        var xhr = new XMLHttpRequest();
+        var url = "/api/changes?since=" + encodeURIComponent(cursor);
+        if (folder) {
+            url += "&folder=" + encodeURIComponent(folder);
+        }
+        xhr.open("GET", url);
+        xhr.onload = function () {
+            if (xhr.status >= 200 && xhr.status < 300) {
+                try {
+                    var r = JSON.parse(xhr.responseText);
+                    cursor = String(r.cursor);
+                    apply(r.messages || []);
+                } catch (e) {}
+            }
+            setTimeout(poll, POLL_MS);
+        };
+        xhr.onerror = function () {
+            setTimeout(poll, POLL_MS * 4);
+        };
+        xhr.send();
+    }
+
+    function connect() {
+        var opened = false;
+        var ws;
+        try {
+            ws = new WebSocket((window.location.protocol === "https:" ? "wss://" : "ws://") + window.location.host + "/websocket");
+        } catch (e) {
+            poll();
+            return;
+        }
+        ws.onopen = function () {
+            opened = true;
+            ws.send(JSON.stringify({ type: "subscribe", folder: folder, since: Number(cursor) }));
+        };
+        ws.onmessage = function (ev) {
+            try {
+                apply([JSON.parse(ev.data)]);
+            } catch (e) {}
+        };
+        ws.onclose = function () {
+            // Reconnect after a drop; fall back to polling if the upgrade is refused.
+            if (opened) {
+                setTimeout(connect, 2000);
+            } else {
+                poll();
+            }
+        };
+    }
+
+    window.ftsLiveListing = { removeRow: removeRow };
+    connect();
+})();
+
+(function () {
+    // Multi-select on a folder's file table: delete, move or rename the ticked
+    // files with one request to /api/folders/<folder>/batch.
+    var bar = document.getElementById("batch-bar");
+    var match = window.location.pathname.match(/^\/uploads\/([^\/]+)\/?$/);
+    if (!bar || !match) {
+        return;
+    }
+    var folder = decodeURIComponent(match[1]);
+    var allBox = bar.querySelector(".js-batch-all");
+    var countEl = bar.querySelector(".js-batch-count");
+    var renameBtn = bar.querySelector(".js-batch-rename");
+    var moveBtn = bar.querySelector(".js-batch-move");
+    var deleteBtn = bar.querySelector(".js-batch-delete");
+    var clearBtn = bar.querySelector(".js-batch-clear");
+
+    function boxes() {
+        return Array.prototype.slice.call(document.querySelectorAll(".js-file-select"));
+    }
+
+    function selectedRows() {
+        return boxes().filter(function (box) {
+            return box.checked;
+        }).map(function (box) {
+            return box.closest("tr");
+        });
+    }
+
+    function refresh() {
+        var all = boxes();
+        var count = selectedRows().length;
+        bar.hidden = !all.length;
+        countEl.textContent = count + " selected";
+        allBox.checked = count > 0 && count === all.length;
+        allBox.indeterminate = count > 0 && count < all.length;
+        renameBtn.disabled = count !== 1;
+        moveBtn.disabled = deleteBtn.disabled = clearBtn.disabled = count === 0;
+    }
+
+    function setAll(checked) {
+        boxes().forEach(function (box) {
+            box.checked = checked;
+        });
+        refresh();
+    }
+
+    function send(ops, rows) {
+        var xhr = new XMLHttpRequest();
+        xhr.open("POST", "/api/folders/" + encodeURIComponent(folder) + "/batch");
+        xhr.setRequestHeader("Content-Type", "application/json");
+        xhr.onload = function () {
+            var r = null;
+            try {
+                r = JSON.parse(xhr.responseText);
+            } catch (err) {}
+            if (!r || !r.results) {
+                if (r && r.locked) {
+                    window.location.reload();
+                    return;
+                }
+                window.alert((r && r.error) || "Batch request failed.");
+                return;
+            }
+            if (!window.ftsLiveListing) {
+                window.location.reload();
+                return;
+            }
+            var failed = [];
+            r.results.forEach(function (result, i) {
+                if (!result.ok) {
+                    failed.push(result.name + ": " + (result.error || "failed"));
+                } else if (result.op === "delete" || result.folder !== folder || result.to !== result.name) {
+                    // Gone under this name; a renamed file comes back through the live listing.
+                    window.ftsLiveListing.removeRow(rows[i]);
+                }
+            });
+            refresh();
+            if (failed.length) {
+                window.alert("Some files were not changed:\n" + failed.join("\n"));
+            }
+        };
+        xhr.onerror = function () {
+            window.alert("Network error");
+        };
+        xhr.send(JSON.stringify({ ops: ops }));
+    }
+
+    document.addEventListener("change", function (e) {
+        if (e.target.closest(".js-file-select")) {
+            refresh();
+        }
+    });
+    allBox.addEventListener("change", function () {
+        setAll(allBox.checked);
+    });
+    clearBtn.addEventListener("click", function () {
+        setAll(false);
+    });
+    deleteBtn.addEventListener("click", function () {
+        var rows = selectedRows();
+        if (!rows.length) {
+            return;
+        }
+        var ops = rows.map(function (row) {
+            return { op: "delete", name: row.getAttribute("data-name") };
+        });
+        var message = rows.length === 1 ? "Delete this file?" : "Delete " + rows.length + " files?";
+        if (window.ftsConfirmDelete) {
+            window.ftsConfirmDelete(message, function () {
+                send(ops, rows);
+            });
+        }
+    });
+    moveBtn.addEventListener("click", function () {
+        var rows = selectedRows();
+        var target = rows.length ? window.prompt("Move " + rows.length + " file(s) to folder:", "") : null;
+        if (!target || !target.trim() || target.trim() === folder) {
+            return;
+        }
+        send(rows.map(function (row) {
+            return { op: "move", name: row.getAttribute("data-name"), folder: target.trim() };
+        }), rows);
+    });
+    renameBtn.addEventListener("click", function () {
+        var rows = selectedRows();
+        if (rows.length !== 1) {
+            return;
+        }
+        var name = rows[0].getAttribute("data-name");
+        var to = window.prompt("New name for " + name + ":", name);
+        if (!to || !to.trim() || to.trim() === name) {
+            return;
+        }
+        send([{ op: "rename", name: name, to: to.trim() }], rows);
+    });
+
+    // Rows patched in by the live listing arrive unticked; keep the bar in step.
+    new MutationObserver(refresh).observe(document.querySelector(".uploads-wrap"), { childList: true, subtree: true });
+    refresh();
+})();
@@ -1,5 +1,4 @@
 (function () {
-    var triggers = document.querySelectorAll(".js-file-preview-trigger");
     var activeToken = 0;
     var activeTrigger = null;
     var previewRow = null;
@@ -9,7 +8,7 @@
     var previewDownload = null;
     var previewContent = null;
 
-    if (!triggers.length) {
+    if (!document.querySelector(".uploads-table, .files")) {
         return;
     }
 
@@ -179,17 +178,17 @@
         });
     }
 
-    triggers.forEach(function (triggerEl) {
-        triggerEl.addEventListener("click", function (ev) {
-            if (ev.button !== 0 || ev.metaKey || ev.ctrlKey || ev.shiftKey || ev.altKey) {
-                return;
-            }
-            ev.preventDefault();
-            if (activeTrigger === triggerEl) {
-                closePreview();
-                return;
-            }
-            renderPreview(triggerEl);
-        });
+    // Delegated, so rows added by live updates can be previewed too.
+    document.addEventListener("click", function (ev) {
+        var triggerEl = ev.target.closest(".js-file-preview-trigger");
+        if (!triggerEl || ev.button !== 0 || ev.metaKey || ev.ctrlKey || ev.shiftKey || ev.altKey) {
+            return;
+        }
+        ev.preventDefault();
+        if (activeTrigger === triggerEl) {
+            closePreview();
+            return;
+        }
+        renderPreview(triggerEl);
     });
 })();
@@ -0,0 +1,135 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from flask import Response, current_app, request, url_for
+
+try:
+    import brotli
+except ImportError:  # optional: pip install Brotli
+    brotli = None
+
+
+HASHED_NAME = re.compile(r"^(?P<stem>.+)\.(?P<digest>[0-9a-f]{12})(?P<ext>\.[^./]+)$")
+
+
+class StaticAssets:
+    """Content-hashed, precompressed copies of everything under static/.
+
+    Built once at startup and kept in memory (the static tree is small and
+    may be read-only when pip-installed). Hashed URLs never change content,
+    so they are served with an immutable Cache-Control and browsers stop
+    asking for them on repeat visits.
+    """
+
+    URL_PREFIX = "/assets"
+    CACHE_CONTROL = "public, max-age=31536000, immutable"
+    COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".html", ".map"}
+    MIN_COMPRESS_SIZE = 256
+
+    def __init__(self, static_dir):
+        self.static_dir = static_dir
+        self._by_logical = {}  # "css/home.css" -> entry
+        self._by_hashed = {}  # "css/home.0123456789ab.css" -> entry
+
+    def build(self):
+        by_logical = {}
+        by_hashed = {}
+        for root, dirs, files in os.walk(self.static_dir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in files:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(root, name)
+                logical = os.path.relpath(path, self.static_dir).replace(os.sep, "/")
+                with open(path, "rb") as fh:
+                    data = fh.read()
+                entry = self._build_entry(logical, data)
+                by_logical[logical] = entry
+                by_hashed[entry["hashed"]] = entry
+        self._by_logical = by_logical
+        self._by_hashed = by_hashed
+        return len(by_logical)
+
+    def _build_entry(self, logical, data):
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        stem, ext = os.path.splitext(logical)
+        variants = {"identity": data}
+        if ext.lower() in self.COMPRESSIBLE and len(data) >= self.MIN_COMPRESS_SIZE:
+            gz = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(gz) < len(data):
+                variants["gzip"] = gz
+            if brotli is not None:
+                br = brotli.compress(data, quality=11)
+                if len(br) < len(data):
+                    variants["br"] = br
+        return {
+            "logical": logical,
+            "hashed": f"{stem}.{digest}{ext}",
+            "etag": digest,
+            "mimetype": mimetypes.guess_type(logical)[0] or "application/octet-stream",
+            "variants": variants,
+        }
+
+    def url(self, logical):
+        entry = self._by_logical.get(logical)
+        if entry is None:
+            return url_for("static", filename=logical)
+        return f"{self.URL_PREFIX}/{entry['hashed']}"
+
+    def _choose_encoding(self, entry):
+        accepted = request.accept_encodings
+        best, best_quality = "identity", 0
+        # Prefer brotli over gzip at equal quality; both beat identity.
+        for encoding in ("br", "gzip"):
+            if encoding not in entry["variants"]:
+                continue
+            quality = accepted.quality(encoding)
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def response(self, hashed):
+        entry = self._by_hashed.get(hashed)
+        immutable = entry is not None
+        if entry is None:
+            # A page rendered before a reload may ask for an older hash:
+            # serve the current file, but don't let it be cached as that hash.
+            match = HASHED_NAME.match(hashed)
+            logical = f"{match['stem']}{match['ext']}" if match else None
+            entry = self._by_logical.get(logical)
+            if entry is None:
+                return Response("Not found", status=404)
+        encoding = self._choose_encoding(entry)
+        headers = {
+            "Cache-Control": self.CACHE_CONTROL if immutable else "no-cache",
+            "Vary": "Accept-Encoding",
+            "ETag": f'"{entry["etag"]}"',
+        }
+        if request.if_none_match.contains(entry["etag"]):
+            return Response(status=304, headers=headers)
+        body = entry["variants"][encoding]
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        resp = Response(body, mimetype=entry["mimetype"], headers=headers)
+        resp.content_length = len(body)
+        return resp
+
+
+def asset_url(logical):
+    """URL for a file under static/: fingerprinted when the pipeline is active."""
+    assets = current_app.extensions.get("fts_assets")
+    if assets is None:
+        return url_for("static", filename=logical)
+    return assets.url(logical)
+
+
+def register_static_assets(app, assets):
+    app.extensions["fts_assets"] = assets
+    app.jinja_env.globals["asset_url"] = asset_url
+
+    @app.route(f"{StaticAssets.URL_PREFIX}/<path:hashed>", methods=["GET"])
+    def static_asset(hashed):
+        return assets.response(hashed)
@@ -0,0 +1,833 @@
+import bisect
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from metadata_store import MetadataStore
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process, folder moves need no lock
+    fcntl = None
+
+
+StoredFile = namedtuple("StoredFile", ["name", "size", "mtime"])
+
+CHUNK_SIZE = 1024 * 1024
+
+logger = logging.getLogger("fts.storage")
+
+
+def _valid_name(name):
+    return bool(name) and name not in (".", "..") and "/" not in name and "\\" not in name and "\x00" not in name
+
+
+class ChangeNotifier:
+    """Lets services follow writes and deletes without touching every route.
+
+    Callbacks get (event, folder, name, old, new) where event is "put",
+    "delete" or "delete_folder" and old/new are StoredFile or None.
+    """
+
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def _notify(self, event, folder, name=None, old=None, new=None):
+        for callback in list(self._listeners):
+            try:
+                callback(event, folder, name, old, new)
+            except Exception:
+                logger.exception("Storage listener failed for %s %s/%s", event, folder, name)
+
+
+class LocalStorage(ChangeNotifier):
+    """Uploads tree on the local filesystem: <root>/<folder>/<file>."""
+
+    TRASH_DIR = ".trash"
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.trash_dir = os.path.join(self.root, self.TRASH_DIR)
+        self.trash_dirs = [self.trash_dir]
+        self._listeners = []
+        os.makedirs(self.root, exist_ok=True)
+
+    def _folder_dir(self, folder):
+        # Dot-folders (.trash etc.) are server-internal, never an uploads folder.
+        if not _valid_name(folder) or folder.startswith("."):
+            return None
+        path = os.path.abspath(os.path.join(self.root, folder))
+        return path if os.path.dirname(path) == self.root else None
+
+    def _file_path(self, folder, name):
+        base = self._folder_dir(folder)
+        if base is None or not _valid_name(name):
+            return None
+        path = os.path.abspath(os.path.join(base, name))
+        return path if os.path.dirname(path) == base else None
+
+    def local_path(self, folder, name=None):
+        """Filesystem path for a folder/file, or None when the name is unsafe.
+
+        Callers use this to hand files to `send_file` (sendfile/ranges for free).
+        """
+        if name is None:
+            return self._folder_dir(folder)
+        return self._file_path(folder, name)
+
+    def list_folders(self):
+        try:
+            with os.scandir(self.root) as entries:
+                return [e.name for e in entries if not e.name.startswith(".") and e.is_dir()]
+        except OSError:
+            return []
+
+    def folder_exists(self, folder):
+        path = self._folder_dir(folder)
+        return path is not None and os.path.isdir(path)
+
+    def create_folder(self, folder):
+        path = self._folder_dir(folder)
+        if path is None:
+            raise ValueError(f"Invalid folder name: {folder!r}")
+        os.makedirs(path, exist_ok=True)
+
+    def iter_files(self, folder):
+        path = self._folder_dir(folder)
+        if path is None:
+            return
+        try:
+            entries = os.scandir(path)
+        except OSError:
+            return
+        with entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                yield StoredFile(entry.name, int(st.st_size), int(st.st_mtime))
+
+    def list_files(self, folder):
+        return list(self.iter_files(folder))
+
+    def stat(self, folder, name):
+        path = self._file_path(folder, name)
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        return StoredFile(name, int(st.st_size), int(st.st_mtime))
+
+    def read_bytes(self, folder, name):
+        path = self._file_path(folder, name)
+        if path is None:
+            raise FileNotFoundError(name)
+        with open(path, "rb") as fh:
+            return fh.read()
+
+    def iter_range(self, folder, name, start=0, end=None, chunk_size=CHUNK_SIZE):
+        """Yield bytes [start, end) of a stored file."""
+        path = self._file_path(folder, name)
+        if path is None:
+            raise FileNotFoundError(name)
+        with open(path, "rb") as fh:
+            fh.seek(start)
+            remaining = None if end is None else max(0, end - start)
+            while remaining is None or remaining > 0:
+                want = chunk_size if remaining is None else min(chunk_size, remaining)
+                data = fh.read(want)
+                if not data:
+                    break
+                if remaining is not None:
+                    remaining -= len(data)
+                yield data
+
+    def put_stream(self, folder, name, stream):
+        """Write a file from a binary stream; the new content appears atomically."""
+        path = self._file_path(folder, name)
+        if path is None:
+            raise ValueError(f"Invalid file name: {name!r}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".upload-", dir=os.path.dirname(path))
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    data = stream.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    out.write(data)
+                    size += len(data)
+            old = self.stat(folder, name)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._notify("put", folder, name, old, self.stat(folder, name))
+        return size
+
+    def put_file(self, folder, name, src_path):
+        """Move a finished local file into place (a rename when on the same disk)."""
+        path = self._file_path(folder, name)
+        if path is None:
+            raise ValueError(f"Invalid file name: {name!r}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        old = self.stat(folder, name)
+        try:
+            os.replace(src_path, path)
+        except OSError:
+            # Different filesystem: copy next to the target first, then rename.
+            with open(src_path, "rb") as src:
+                self.put_stream(folder, name, src)
+            os.unlink(src_path)
+            return os.path.getsize(path)
+        self._notify("put", folder, name, old, self.stat(folder, name))
+        return os.path.getsize(path)
+
+    def write_bytes(self, folder, name, data, preserve_mtime=False):
+        path = self._file_path(folder, name)
+        if path is None:
+            raise ValueError(f"Invalid file name: {name!r}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".upload-", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(data)
+            old = self.stat(folder, name)
+            if preserve_mtime and old is not None:
+                os.utime(tmp_path, (old.mtime, old.mtime))
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._notify("put", folder, name, old, self.stat(folder, name))
+        return len(data)
+
+    def delete(self, folder, name):
+        old = self.stat(folder, name)
+        if old is None:
+            return False
+        os.remove(self._file_path(folder, name))
+        self._notify("delete", folder, name, old, None)
+        return True
+
+    def move(self, folder, name, dest_folder, dest_name):
+        """Rename a file, possibly into another folder: one rename, bytes untouched."""
+        src = self._file_path(folder, name)
+        dst = self._file_path(dest_folder, dest_name)
+        if src is None or dst is None:
+            raise ValueError(f"Invalid file name: {dest_name!r}")
+        old = self.stat(folder, name)
+        if old is None:
+            raise FileNotFoundError(name)
+        replaced = self.stat(dest_folder, dest_name)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.replace(src, dst)
+        self._notify("delete", folder, name, old, None)
+        self._notify("put", dest_folder, dest_name, replaced, self.stat(dest_folder, dest_name))
+
+    def delete_folder(self, folder):
+        """Move the folder into the trash (one rename); TrashReaper frees the space later."""
+        path = self._folder_dir(folder)
+        if path is None or not os.path.isdir(path):
+            return False
+        os.makedirs(self.trash_dir, exist_ok=True)
+        target = os.path.join(self.trash_dir, f"{folder}.{time.time_ns()}.{uuid.uuid4().hex[:8]}")
+        try:
+            os.rename(path, target)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            # Trash not usable (e.g. permissions): fall back to deleting in place.
+            shutil.rmtree(path)
+        self._notify("delete_folder", folder)
+        return True
+
+
+class S3Storage(ChangeNotifier):
+    """Uploads tree in an S3-compatible bucket: <prefix><folder>/<file>.
+
+    Works against AWS S3 or a local MinIO-style server (set FTS_S3_ENDPOINT).
+    Large uploads use multipart with parts sent in parallel.
+    """
+
+    PART_SIZE = 8 * 1024 * 1024
+    MAX_PARALLEL_PARTS = 4
+    FOLDER_MARKER = ".fts-folder"
+    # Folder deletes are batched DeleteObjects calls; there is no local trash to reap.
+    trash_dir = None
+    trash_dirs = []
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, region=None, part_size=None, max_parallel_parts=None):
+        try:
+            import boto3
+        except ImportError as exc:
+            raise RuntimeError("S3 storage needs boto3: pip install boto3") from exc
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self._listeners = []
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.part_size = max(5 * 1024 * 1024, int(part_size or self.PART_SIZE))
+        self.max_parallel_parts = max(1, int(max_parallel_parts or self.MAX_PARALLEL_PARTS))
+        self._client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            config=Config(
+                s3={"addressing_style": "path"} if endpoint_url else {},
+                max_pool_connections=max(10, self.max_parallel_parts * 2),
+            ),
+        )
+
+    def _key(self, folder, name=None):
+        if not _valid_name(folder) or folder.startswith("."):
+            return None
+        if name is not None and not _valid_name(name):
+            return None
+        if name is None:
+            return f"{self.prefix}{folder}/"
+        return f"{self.prefix}{folder}/{name}"
+
+    def local_path(self, folder, name=None):
+        return None
+
+    def _is_missing(self, exc):
+        code = getattr(exc, "response", {}).get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    def list_folders(self):
+        folders = []
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix, Delimiter="/"):
+            for cp in page.get("CommonPrefixes", []):
+                name = cp["Prefix"][len(self.prefix):].rstrip("/")
+                if name and not name.startswith("."):
+                    folders.append(name)
+        return folders
+
+    def folder_exists(self, folder):
+        key = self._key(folder)
+        if key is None:
+            return False
+        resp = self._client.list_objects_v2(Bucket=self.bucket, Prefix=key, MaxKeys=1)
+        return resp.get("KeyCount", 0) > 0
+
+    def create_folder(self, folder):
+        key = self._key(folder, self.FOLDER_MARKER)
+        if key is None:
+            raise ValueError(f"Invalid folder name: {folder!r}")
+        self._client.put_object(Bucket=self.bucket, Key=key, Body=b"")
+
+    def iter_files(self, folder):
+        key = self._key(folder)
+        if key is None:
+            return
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=key, Delimiter="/"):
+            for obj in page.get("Contents", []):
+                name = obj["Key"][len(key):]
+                if not name or name.startswith("."):
+                    continue
+                yield StoredFile(name, int(obj["Size"]), int(obj["LastModified"].timestamp()))
+
+    def list_files(self, folder):
+        return list(self.iter_files(folder))
+
+    def stat(self, folder, name):
+        key = self._key(folder, name)
+        if key is None:
+            return None
+        from botocore.exceptions import ClientError
+
+        try:
+            head = self._client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as exc:
+            if self._is_missing(exc):
+                return None
+            raise
+        return StoredFile(name, int(head["ContentLength"]), int(head["LastModified"].timestamp()))
+
+    def _get_range(self, key, start, end):
+        resp = self._client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+        return resp["Body"].read()
+
+    def read_bytes(self, folder, name):
+        key = self._key(folder, name)
+        info = self.stat(folder, name)
+        if key is None or info is None:
+            raise FileNotFoundError(name)
+        if info.size <= self.part_size:
+            return self._client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+        ranges = [(s, min(s + self.part_size, info.size)) for s in range(0, info.size, self.part_size)]
+        with ThreadPoolExecutor(max_workers=self.max_parallel_parts) as pool:
+            parts = pool.map(lambda r: self._get_range(key, r[0], r[1]), ranges)
+            return b"".join(parts)
+
+    def iter_range(self, folder, name, start=0, end=None, chunk_size=CHUNK_SIZE):
+        key = self._key(folder, name)
+        if key is None:
+            raise FileNotFoundError(name)
+        kwargs = {"Bucket": self.bucket, "Key": key}
+        if start or end is not None:
+            kwargs["Range"] = f"bytes={start}-" + ("" if end is None else str(end - 1))
+        body = self._client.get_object(**kwargs)["Body"]
+        try:
+            while True:
+                data = body.read(chunk_size)
+                if not data:
+                    break
+                yield data
+        finally:
+            body.close()
+
+    def put_stream(self, folder, name, stream):
+        key = self._key(folder, name)
+        if key is None:
+            raise ValueError(f"Invalid file name: {name!r}")
+        old = self.stat(folder, name)
+        first = _read_full(stream, self.part_size)
+        if len(first) < self.part_size:
+            self._client.put_object(Bucket=self.bucket, Key=key, Body=first)
+            self._notify("put", folder, name, old, self.stat(folder, name))
+            return len(first)
+
+        upload_id = self._client.create_multipart_upload(Bucket=self.bucket, Key=key)["UploadId"]
+        size = 0
+        try:
+            parts = []
+            pending = []
+            with ThreadPoolExecutor(max_workers=self.max_parallel_parts) as pool:
+                part_number = 1
+                data = first
+                while data:
+                    size += len(data)
+                    pending.append(pool.submit(self._upload_part, key, upload_id, part_number, data))
+                    # Bound memory: at most max_parallel_parts parts in flight.
+                    if len(pending) >= self.max_parallel_parts:
+                        parts.append(pending.pop(0).result())
+                    part_number += 1
+                    data = _read_full(stream, self.part_size)
+                parts.extend(f.result() for f in pending)
+            self._client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            try:
+                self._client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            except Exception:
+                pass
+            raise
+        self._notify("put", folder, name, old, self.stat(folder, name))
+        return size
+
+    def _upload_part(self, key, upload_id, part_number, data):
+        resp = self._client.upload_part(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        return {"ETag": resp["ETag"], "PartNumber": part_number}
+
+    def put_file(self, folder, name, src_path):
+        """Upload a finished local file, then remove it."""
+        with open(src_path, "rb") as src:
+            size = self.put_stream(folder, name, src)
+        os.unlink(src_path)
+        return size
+
+    def write_bytes(self, folder, name, data, preserve_mtime=False):
+        # Object stores set LastModified themselves; preserve_mtime is best effort.
+        from io import BytesIO
+
+        return self.put_stream(folder, name, BytesIO(data))
+
+    def delete(self, folder, name):
+        key = self._key(folder, name)
+        old = None if key is None else self.stat(folder, name)
+        if old is None:
+            return False
+        self._client.delete_object(Bucket=self.bucket, Key=key)
+        self._notify("delete", folder, name, old, None)
+        return True
+
+    def move(self, folder, name, dest_folder, dest_name):
+        """Server-side copy to the new key, then delete the old one (no bytes pass through us)."""
+        key = self._key(folder, name)
+        dest_key = self._key(dest_folder, dest_name)
+        if key is None or dest_key is None:
+            raise ValueError(f"Invalid file name: {dest_name!r}")
+        old = self.stat(folder, name)
+        if old is None:
+            raise FileNotFoundError(name)
+        replaced = self.stat(dest_folder, dest_name)
+        self._client.copy({"Bucket": self.bucket, "Key": key}, self.bucket, dest_key)
+        self._client.delete_object(Bucket=self.bucket, Key=key)
+        self._notify("delete", folder, name, old, None)
+        self._notify("put", dest_folder, dest_name, replaced, self.stat(dest_folder, dest_name))
+
+    def delete_folder(self, folder):
+        key = self._key(folder)
+        if key is None:
+            return False
+        deleted = False
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=key):
+            objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+            if objects:
+                self._client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True})
+                deleted = True
+        if deleted:
+            self._notify("delete_folder", folder)
+        return deleted
+
+
+class _HashRing:
+    """Consistent hashing of folder names onto volumes (VNODES points per volume).
+
+    Adding a volume only takes over the folders that now hash to its points,
+    about 1/N of them; everything else stays where it is.
+    """
+
+    VNODES = 128
+
+    def __init__(self, keys):
+        points = []
+        for key in keys:
+            for index in range(self.VNODES):
+                points.append((self._hash(f"{key}#{index}"), key))
+        points.sort()
+        self._hashes = [point[0] for point in points]
+        self._keys = [point[1] for point in points]
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.sha1(value.encode("utf-8")).digest()[:8], "big")
+
+    def lookup(self, name):
+        index = bisect.bisect(self._hashes, self._hash(name)) % len(self._hashes)
+        return self._keys[index]
+
+
+class MultiVolumeStorage(ChangeNotifier):
+    """Several local roots (one per disk); each folder lives whole on one of them.
+
+    The first root is the home volume: it also keeps the metadata database,
+    PIN file and staging areas. Where a folder lives is recorded in the
+    `folder_placement` table; a new folder is placed by consistent hashing of
+    its name (placement "hash") or on the volume with the most free space
+    ("free"). Folders that already exist on some volume are found there and
+    recorded on first use, so adding volumes to a running tree needs no
+    migration up front; `fts rebalance` moves folders afterwards.
+
+    Writes to a folder hold a shared flock on its lock file; moving a folder
+    to another volume copies it while the server keeps running, then takes
+    the lock exclusively for a final catch-up copy and the switch.
+    """
+
+    PLACEMENTS = ("hash", "free")
+    MOVING_DIR = ".fts_moving"
+    LOCK_DIR = ".fts_locks"
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS folder_placement (
+            folder TEXT PRIMARY KEY,
+            volume TEXT NOT NULL
+        )""",
+    ]
+
+    def __init__(self, roots, placement="hash"):
+        if placement not in self.PLACEMENTS:
+            raise RuntimeError(f"Unknown FTS_VOLUME_PLACEMENT: {placement}")
+        self._listeners = []
+        self.volumes = []
+        for root in roots:
+            volume = LocalStorage(root)
+            if volume.root not in (v.root for v in self.volumes):
+                volume.subscribe(self._notify)
+                self.volumes.append(volume)
+        self._by_root = {volume.root: volume for volume in self.volumes}
+        self.root = self.volumes[0].root
+        self.trash_dir = self.volumes[0].trash_dir
+        self.trash_dirs = [volume.trash_dir for volume in self.volumes]
+        self.placement = placement
+        self._ring = _HashRing([volume.root for volume in self.volumes])
+        self._metadata = MetadataStore(os.path.join(self.root, ".fts_meta.sqlite3"))
+        self._metadata.ensure_schema("placement", self.SCHEMA)
+
+    # --- placement --------------------------------------------------------
+
+    def _choose(self, folder):
+        if self.placement == "free":
+            return max(self.volumes, key=lambda volume: shutil.disk_usage(volume.root).free)
+        return self._by_root[self._ring.lookup(folder)]
+
+    def _record(self, folder, volume):
+        self._metadata.execute(
+            "INSERT OR IGNORE INTO folder_placement (folder, volume) VALUES (?, ?)", (folder, volume.root)
+        )
+        row = self._metadata.execute("SELECT volume FROM folder_placement WHERE folder = ?", (folder,)).fetchone()
+        # Another worker may have placed it first; its choice wins.
+        return self._by_root.get(row[0], volume) if row else volume
+
+    def volume_for(self, folder, create=False):
+        if not _valid_name(folder) or folder.startswith("."):
+            return self.volumes[0]  # its methods reject the name
+        row = self._metadata.execute("SELECT volume FROM folder_placement WHERE folder = ?", (folder,)).fetchone()
+        if row and row[0] in self._by_root:
+            return self._by_root[row[0]]
+        for volume in self.volumes:
+            if volume.folder_exists(folder):
+                return self._record(folder, volume)
+        if not create:
+            return self._choose(folder)
+        return self._record(folder, self._choose(folder))
+
+    def target_volumes(self):
+        """{folder: volume} as a rebalance would place every folder now."""
+        folders = sorted(self.list_folders())
+        current = {folder: self.volume_for(folder) for folder in folders}
+        if self.placement == "hash":
+            return {folder: self._by_root[self._ring.lookup(folder)] for folder in folders}
+        # "free": move the largest folders off the fullest volume while that
+        # narrows the gap in free space.
+        free = {volume.root: shutil.disk_usage(volume.root).free for volume in self.volumes}
+        sizes = {folder: sum(item.size for item in current[folder].iter_files(folder)) for folder in folders}
+        target = dict(current)
+        for folder in sorted(folders, key=lambda name: -sizes[name]):
+            fullest = min(free, key=free.get)
+            emptiest = max(free, key=free.get)
+            if target[folder].root != fullest or free[emptiest] - free[fullest] <= 2 * sizes[folder]:
+                continue
+            target[folder] = self._by_root[emptiest]
+            free[fullest] += sizes[folder]
+            free[emptiest] -= sizes[folder]
+        return target
+
+    @contextmanager
+    def _folder_lock(self, folder, exclusive=False, timeout=None):
+        if fcntl is None or not _valid_name(folder) or folder.startswith("."):
+            yield
+            return
+        lock_dir = os.path.join(self.root, self.LOCK_DIR)
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, folder + ".lock"), "a") as fh:
+            if not exclusive:
+                fcntl.flock(fh, fcntl.LOCK_SH)
+            else:
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while True:
+                    try:
+                        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if deadline is not None and time.monotonic() >= deadline:
+                            raise TimeoutError(f"Folder {folder} is busy") from None
+                        time.sleep(0.05)
+            yield
+
+    # --- moving folders ---------------------------------------------------
+
+    @staticmethod
+    def _sync_tree(src_dir, dst_dir):
+        """Make dst_dir a copy of src_dir (files only, mtimes kept). Returns bytes copied."""
+        copied = 0
+        wanted = set()
+        with os.scandir(src_dir) as entries:
+            for entry in entries:
+                # Dot-files are in-flight temp files of the folder's writers.
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                wanted.add(entry.name)
+                st = entry.stat()
+                target = os.path.join(dst_dir, entry.name)
+                try:
+                    dst = os.stat(target)
+                    if dst.st_size == st.st_size and int(dst.st_mtime) == int(st.st_mtime):
+                        continue
+                except FileNotFoundError:
+                    pass
+                shutil.copy2(entry.path, target)
+                copied += st.st_size
+        with os.scandir(dst_dir) as entries:
+            for entry in entries:
+                if entry.name not in wanted:
+                    os.unlink(entry.path)
+        return copied
+
+    def move_folder(self, folder, target, lock_timeout=30.0):
+        """Move a folder to another volume while the server keeps serving it.
+
+        Returns the number of bytes copied. No storage events are sent: the
+        files are the same, only their disk changes.
+        """
+        source = self.volume_for(folder)
+        if source is target or not source.folder_exists(folder):
+            return 0
+        src_dir = source.local_path(folder)
+        staging = os.path.join(target.root, self.MOVING_DIR, folder)
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        try:
+            # Bulk copy without the lock, then a short catch-up under it.
+            copied = self._sync_tree(src_dir, staging)
+            with self._folder_lock(folder, exclusive=True, timeout=lock_timeout):
+                copied += self._sync_tree(src_dir, staging)
+                os.rename(staging, target.local_path(folder))
+                self._metadata.execute(
+                    "INSERT OR REPLACE INTO folder_placement (folder, volume) VALUES (?, ?)", (folder, target.root)
+                )
+                os.makedirs(source.trash_dir, exist_ok=True)
+                os.rename(src_dir, os.path.join(source.trash_dir, f"{folder}.{time.time_ns()}.{uuid.uuid4().hex[:8]}"))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return copied
+
+    # --- storage interface ------------------------------------------------
+
+    def local_path(self, folder, name=None):
+        return self.volume_for(folder).local_path(folder, name)
+
+    def list_folders(self):
+        folders = set()
+        for volume in self.volumes:
+            folders.update(volume.list_folders())
+        return sorted(folders)
+
+    def folder_exists(self, folder):
+        return self.volume_for(folder).folder_exists(folder)
+
+    def create_folder(self, folder):
+        with self._folder_lock(folder):
+            self.volume_for(folder, create=True).create_folder(folder)
+
+    def iter_files(self, folder):
+        return self.volume_for(folder).iter_files(folder)
+
+    def list_files(self, folder):
+        return list(self.iter_files(folder))
+
+    def stat(self, folder, name):
+        return self.volume_for(folder).stat(folder, name)
+
+    def read_bytes(self, folder, name):
+        return self.volume_for(folder).read_bytes(folder, name)
+
+    def iter_range(self, folder, name, start=0, end=None, chunk_size=CHUNK_SIZE):
+        return self.volume_for(folder).iter_range(folder, name, start, end, chunk_size)
+
+    def put_stream(self, folder, name, stream):
+        with self._folder_lock(folder):
+            return self.volume_for(folder, create=True).put_stream(folder, name, stream)
+
+    def put_file(self, folder, name, src_path):
+        with self._folder_lock(folder):
+            return self.volume_for(folder, create=True).put_file(folder, name, src_path)
+
+    def write_bytes(self, folder, name, data, preserve_mtime=False):
+        with self._folder_lock(folder):
+            return self.volume_for(folder, create=True).write_bytes(folder, name, data, preserve_mtime)
+
+    def delete(self, folder, name):
+        with self._folder_lock(folder):
+            return self.volume_for(folder).delete(folder, name)
+
+    def move(self, folder, name, dest_folder, dest_name):
+        with self._folder_lock(folder), self._folder_lock(dest_folder):
+            source = self.volume_for(folder)
+            target = self.volume_for(dest_folder, create=True)
+            if source is target:
+                return source.move(folder, name, dest_folder, dest_name)
+            # The folders live on different disks: copy across, then drop the original.
+            target.put_stream(dest_folder, dest_name, _IterReader(source.iter_range(folder, name)))
+            source.delete(folder, name)
+
+    def delete_folder(self, folder):
+        with self._folder_lock(folder):
+            deleted = self.volume_for(folder).delete_folder(folder)
+            self._metadata.execute("DELETE FROM folder_placement WHERE folder = ?", (folder,))
+            return deleted
+
+
+class _IterReader:
+    """File-like read() over an iterator of byte chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _read_full(stream, size):
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        data = stream.read(remaining)
+        if not data:
+            break
+        chunks.append(data)
+        remaining -= len(data)
+    return b"".join(chunks)
+
+
+def create_storage(upload_folder):
+    """Build the storage backend selected by FTS_STORAGE (local or s3)."""
+    backend = (os.environ.get("FTS_STORAGE") or "local").strip().lower()
+    if backend == "s3":
+        bucket = os.environ.get("FTS_S3_BUCKET")
+        if not bucket:
+            raise RuntimeError("FTS_STORAGE=s3 needs FTS_S3_BUCKET")
+        return S3Storage(
+            bucket,
+            prefix=os.environ.get("FTS_S3_PREFIX", ""),
+            endpoint_url=os.environ.get("FTS_S3_ENDPOINT"),
+            region=os.environ.get("FTS_S3_REGION"),
+            part_size=os.environ.get("FTS_S3_PART_SIZE"),
+            max_parallel_parts=os.environ.get("FTS_S3_PARALLEL_PARTS"),
+        )
+    if backend != "local":
+        raise RuntimeError(f"Unknown FTS_STORAGE backend: {backend}")
+    volumes = [v.strip() for v in (os.environ.get("FTS_VOLUMES") or "").split(",") if v.strip()]
+    if volumes:
+        placement = (os.environ.get("FTS_VOLUME_PLACEMENT") or "hash").strip().lower()
+        return MultiVolumeStorage([upload_folder] + volumes, placement=placement)
+    return LocalStorage(upload_folder)
@@ -0,0 +1,422 @@
+import hashlib
+import http.cookiejar
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from werkzeug.utils import secure_filename
+
+from delta_service import generate_delta
+
+
+DEFAULT_SERVER = "http://127.0.0.1:8069"
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+# Below this, a plain upload costs about as much as fetching the signatures.
+DELTA_MIN_SIZE = 1024 * 1024
+RETRIES = 4
+PART_SUFFIX = ".fts-part"
+
+
+class TransferError(Exception):
+    pass
+
+
+class LockedFolder(TransferError):
+    pass
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # The PIN form answers 302 on success; we want to see that, not follow it.
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def _error_message(exc):
+    try:
+        body = json.loads(exc.read().decode("utf-8") or "{}")
+    except (ValueError, OSError):
+        body = {}
+    return body.get("error") or f"HTTP {exc.code}", body
+
+
+def _human(size):
+    size = float(size)
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for data in iter(lambda: fh.read(READ_SIZE), b""):
+            sha.update(data)
+    return sha.hexdigest()
+
+
+class _Progress:
+    """Aggregate byte counter shared by all transfer threads, with a live line on a TTY."""
+
+    def __init__(self, out):
+        self.out = out
+        self.bytes = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, count):
+        with self._lock:
+            self.bytes += count
+
+    def rate(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return self.bytes / elapsed
+
+    def start(self):
+        if hasattr(sys.stderr, "isatty") and sys.stderr.isatty():
+            self._thread = threading.Thread(target=self._run, name="fts-progress", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(1.0):
+            sys.stderr.write(f"\r  {_human(self.bytes)} at {_human(self.rate())}/s   ")
+            sys.stderr.flush()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            sys.stderr.write("\r" + " " * 40 + "\r")
+            sys.stderr.flush()
+
+    def line(self, text):
+        with self._lock:
+            print(text, file=self.out)
+
+
+class TransferClient:
+    """Client side of `fts push` / `fts pull`, talking to a running server over HTTP.
+
+    Files move over `jobs` parallel connections. One cookie jar is shared by
+    all of them, so a folder unlocked with its PIN once stays unlocked for the
+    whole run (and encrypted folders get their key cookie).
+    """
+
+    def __init__(self, server=None, jobs=4, pin=None, ask_pin=None, out=None):
+        self.server = (server or os.environ.get("FTS_SERVER") or DEFAULT_SERVER).rstrip("/")
+        if "://" not in self.server:
+            self.server = "http://" + self.server
+        self.jobs = max(1, int(jobs))
+        self.pin = pin
+        self.ask_pin = ask_pin
+        self.out = out or sys.stdout
+        self.cookies = http.cookiejar.CookieJar()
+        self._opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect())
+        self._unlock_lock = threading.Lock()
+
+    # --- HTTP -----------------------------------------------------------
+
+    def _url(self, path, params=None):
+        url = self.server + path
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        return url
+
+    def _open(self, method, path, params=None, data=None, headers=None, timeout=300):
+        req = urllib.request.Request(self._url(path, params), data=data, method=method, headers=headers or {})
+        return self._opener.open(req, timeout=timeout)
+
+    def _json(self, method, path, params=None, data=None, headers=None):
+        """JSON call; returns (status, body). HTTP errors come back as their status too."""
+        try:
+            with self._open(method, path, params, data, headers) as resp:
+                return resp.status, json.loads(resp.read().decode("utf-8") or "{}")
+        except urllib.error.HTTPError as exc:
+            message, body = _error_message(exc)
+            body.setdefault("error", message)
+            return exc.code, body
+
+    def _retry(self, func, *args):
+        """Call func, retrying dropped connections with backoff."""
+        for attempt in range(RETRIES):
+            try:
+                return func(*args)
+            except (urllib.error.URLError, ConnectionError, TimeoutError) as exc:
+                if isinstance(exc, urllib.error.HTTPError) or attempt == RETRIES - 1:
+                    raise
+                time.sleep(min(8, 0.5 * 2 ** attempt))
+
+    # --- PIN ------------------------------------------------------------
+
+    def unlock(self, folder):
+        """Unlock `folder` with the PIN (asked for once). Only ever tries one PIN per run:
+        ten wrong PINs delete a folder."""
+        with self._unlock_lock:
+            pin = self.pin
+            if pin is None and self.ask_pin is not None:
+                pin = self.ask_pin(folder)
+            if not pin:
+                raise LockedFolder(f"Folder {folder} is locked; pass --pin.")
+            self.pin = None  # never retry the same PIN automatically
+            data = urllib.parse.urlencode({"pin": pin}).encode("ascii")
+            path = f"/uploads/{urllib.parse.quote(folder)}/pin"
+            try:
+                with self._open("POST", path, data=data) as resp:
+                    status = resp.status
+            except urllib.error.HTTPError as exc:
+                status = exc.code
+            if status in (301, 302, 303):
+                return
+            if status == 401:
+                raise LockedFolder(f"Wrong PIN for {folder}.")
+            if status == 429:
+                raise LockedFolder("Too many PIN attempts; try again later.")
+            if status == 410:
+                raise LockedFolder(f"Folder {folder} was deleted after too many wrong PINs.")
+            raise TransferError(f"Unlocking {folder} failed (HTTP {status}).")
+
+    def _unlocked_call(self, folder, method, path, params=None, data=None, headers=None):
+        status, body = self._json(method, path, params, data, headers)
+        if status == 403 and body.get("locked"):
+            self.unlock(folder)
+            status, body = self._json(method, path, params, data, headers)
+        return status, body
+
+    def list_files(self, folder):
+        status, body = self._unlocked_call(folder, "GET", f"/api/folders/{urllib.parse.quote(folder)}/files")
+        if status == 404:
+            return None
+        if status != 200:
+            raise TransferError(body.get("error") or f"Listing {folder} failed (HTTP {status}).")
+        return body
+
+    # --- push -----------------------------------------------------------
+
+    def push(self, source):
+        """Upload a file or directory tree into the caller's own folder. Returns an exit code."""
+        entries = self._local_entries(source)
+        if not entries:
+            print("Nothing to upload.", file=self.out)
+            return 0
+        status, body = self._json("GET", "/api/uploader-folder")
+        if status != 200:
+            raise TransferError(f"Cannot reach {self.server} (HTTP {status}).")
+        folder = body["folder"]
+        listing = self.list_files(folder) or {"files": []}
+        remote = {item["name"]: item for item in listing["files"]}
+
+        progress = _Progress(self.out)
+        progress.line(f"Pushing {len(entries)} file(s) to {self.server}/uploads/{folder} with {self.jobs} connection(s)")
+        with ThreadPoolExecutor(self.jobs) as pool:
+            digests = dict(zip(entries, pool.map(file_sha256, entries.values())))
+        same = set()
+        if remote:
+            candidates = [
+                {"name": name, "size": os.path.getsize(path), "sha256": digests[name]}
+                for name, path in entries.items()
+                if name in remote
+            ]
+            status, body = self._unlocked_call(folder, "POST", "/api/upload-preflight",
+                                               data=json.dumps({"files": candidates}).encode("utf-8"),
+                                               headers={"Content-Type": "application/json"})
+            if status == 200:
+                same = set(body.get("have") or [])
+        for name in sorted(same):
+            progress.line(f"  same   {name}")
+
+        failures = 0
+        sent = {"full": 0, "delta": 0}
+        progress.start()
+        with ThreadPoolExecutor(self.jobs) as pool:
+            futures = {
+                pool.submit(self._push_one, name, path, digests[name], name in remote, progress): name
+                for name, path in entries.items()
+                if name not in same
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    how, size = future.result()
+                    sent[how] += 1
+                    progress.line(f"  {how:<6} {name} ({_human(size)})")
+                except Exception as exc:
+                    failures += 1
+                    progress.line(f"  FAILED {name}: {exc}")
+        progress.stop()
+        elapsed = time.monotonic() - progress.started
+        progress.line(
+            f"Done: {sent['full']} uploaded, {sent['delta']} patched, {len(same)} unchanged, {failures} failed; "
+            f"{_human(progress.bytes)} sent in {elapsed:.1f}s ({_human(progress.rate())}/s)"
+        )
+        return 1 if failures else 0
+
+    def _local_entries(self, source):
+        """{remote name: local path}. Directory trees are flattened the way the server
+        names uploads (a/b.txt -> a_b.txt)."""
+        source = os.path.abspath(source)
+        if os.path.isfile(source):
+            name = secure_filename(os.path.basename(source))
+            return {name: source} if name else {}
+        entries = {}
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for file_name in sorted(files):
+                path = os.path.join(root, file_name)
+                rel = os.path.relpath(path, source)
+                name = secure_filename(rel)
+                if not name or file_name.endswith(PART_SUFFIX):
+                    continue
+                if name in entries:
+                    print(f"  skip   {rel}: same remote name as {os.path.relpath(entries[name], source)}", file=self.out)
+                    continue
+                entries[name] = path
+        return entries
+
+    def _push_one(self, name, path, sha256, exists, progress):
+        size = os.path.getsize(path)
+        if exists and size >= DELTA_MIN_SIZE:
+            if self._retry(self._push_delta, name, path, sha256, size, progress):
+                return "delta", size
+        self._push_resumable(name, path, sha256, size, progress)
+        return "full", size
+
+    def _push_delta(self, name, path, sha256, size, progress):
+        status, signatures = self._json("GET", "/api/delta/signatures", {"name": name})
+        if status != 200:
+            return False
+
+        def body():
+            with open(path, "rb") as fh:
+                for record in generate_delta(fh, signatures, READ_SIZE):
+                    progress.add(len(record))
+                    yield record
+
+        params = {"name": name, "block_size": signatures["block_size"], "size": size, "sha256": sha256}
+        status, _ = self._json("POST", "/api/delta/upload", params, data=body(),
+                               headers={"Content-Type": "application/octet-stream"})
+        # 409: the stored file changed underneath; fall back to a full upload.
+        return status == 200
+
+    def _push_resumable(self, name, path, sha256, size, progress):
+        status, body = self._json("GET", "/api/resumable", {"name": name})
+        if status != 200:
+            raise TransferError(body.get("error") or f"HTTP {status}")
+        offset = int(body["offset"])
+        if offset > size:
+            offset = 0  # a stale partial of some other, larger file
+        failures = 0
+        with open(path, "rb") as fh:
+            while True:
+                fh.seek(offset)
+                chunk = fh.read(UPLOAD_CHUNK_SIZE)
+                params = {"name": name, "offset": offset, "total": size, "sha256": sha256}
+                try:
+                    status, body = self._json("PUT", "/api/resumable", params, data=chunk,
+                                              headers={"Content-Type": "application/octet-stream"})
+                except (urllib.error.URLError, ConnectionError, TimeoutError):
+                    failures += 1
+                    if failures >= RETRIES:
+                        raise
+                    time.sleep(min(8, 0.5 * 2 ** failures))
+                    status, body = self._json("GET", "/api/resumable", {"name": name})
+                    if status != 200:
+                        raise TransferError(body.get("error") or f"HTTP {status}")
+                    offset = int(body["offset"])
+                    continue
+                if status == 409:
+                    offset = int(body["offset"])  # resume where the server actually is
+                    continue
+                if status != 200:
+                    raise TransferError(body.get("error") or f"HTTP {status}")
+                progress.add(int(body["offset"]) - offset)
+                offset = int(body["offset"])
+                failures = 0
+                if body.get("done"):
+                    return
+
+    # --- pull -----------------------------------------------------------
+
+    def pull(self, folder, dest):
+        """Download every file of `folder` into `dest`. Returns an exit code."""
+        listing = self.list_files(folder)
+        if listing is None:
+            raise TransferError(f"Folder {folder} not found on {self.server}.")
+        os.makedirs(dest, exist_ok=True)
+        files = listing["files"]
+        progress = _Progress(self.out)
+        progress.line(f"Pulling {len(files)} file(s) from {self.server}/uploads/{folder} with {self.jobs} connection(s)")
+        failures = 0
+        counts = {"got": 0, "same": 0}
+        progress.start()
+        with ThreadPoolExecutor(self.jobs) as pool:
+            futures = {pool.submit(self._pull_one, folder, item, dest, progress): item["name"] for item in files}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    how, size = future.result()
+                    counts[how] += 1
+                    progress.line(f"  {how:<6} {name} ({_human(size)})")
+                except Exception as exc:
+                    failures += 1
+                    progress.line(f"  FAILED {name}: {exc}")
+        progress.stop()
+        elapsed = time.monotonic() - progress.started
+        progress.line(
+            f"Done: {counts['got']} downloaded, {counts['same']} unchanged, {failures} failed; "
+            f"{_human(progress.bytes)} received in {elapsed:.1f}s ({_human(progress.rate())}/s)"
+        )
+        return 1 if failures else 0
+
+    def _pull_one(self, folder, item, dest, progress):
+        name = secure_filename(item["name"])
+        if not name:
+            raise TransferError("unsafe file name")
+        target = os.path.join(dest, name)
+        sha256 = item.get("sha256")
+        if os.path.isfile(target) and sha256 and item.get("size") == os.path.getsize(target):
+            if file_sha256(target) == sha256:
+                return "same", item["size"]
+        part = os.path.join(dest, "." + name + PART_SUFFIX)
+        size = self._retry(self._download, folder, item["name"], part, progress)
+        if sha256 and file_sha256(part) != sha256:
+            os.unlink(part)
+            raise TransferError("downloaded data does not match the server's SHA-256")
+        os.replace(part, target)
+        if item.get("mtime"):
+            os.utime(target, (item["mtime"], item["mtime"]))
+        return "got", size
+
+    def _download(self, folder, name, part, progress):
+        """Fetch into `part`, continuing from whatever a previous attempt left there."""
+        have = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {"Range": f"bytes={have}-"} if have else {}
+        path = f"/uploads/{urllib.parse.quote(folder)}/{urllib.parse.quote(name)}"
+        try:
+            resp = self._open("GET", path, headers=headers)
+        except urllib.error.HTTPError as exc:
+            if exc.code == 416 and have:
+                total = exc.headers.get("Content-Range", "").rpartition("/")[2]
+                if total.isdigit() and int(total) == have:
+                    return have  # already complete
+                os.unlink(part)
+                return self._download(folder, name, part, progress)
+            if exc.code in (301, 302, 303):
+                raise LockedFolder(f"Folder {folder} is locked.")
+            raise TransferError(_error_message(exc)[0])
+        with resp:
+            mode = "ab" if resp.status == 206 else "wb"
+            with open(part, mode) as out:
+                for data in iter(lambda: resp.read(READ_SIZE), b""):
+                    out.write(data)
+                    progress.add(len(data))
+        return os.path.getsize(part)
@@ -0,0 +1,140 @@
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process, no lock needed
+    fcntl = None
+
+
+logger = logging.getLogger("fts.trash")
+
+
+class TrashReaper:
+    """Background reclaim of folders that LocalStorage.delete_folder moved to the trash.
+
+    Deleting a folder is a single rename in the request; this thread removes
+    the files afterwards, at most `unlinks_per_sec` per second and at the
+    lowest CPU priority, so reclaiming 200k files never competes with
+    transfers. With several workers, an flock on the trash directory lets
+    only one of them reap at a time. Whatever is left in the trash when the
+    server stops is picked up at the next start.
+    """
+
+    REAP_INTERVAL_SEC = 30
+    BATCH = 100
+
+    def __init__(self, trash_dir, unlinks_per_sec=1000):
+        self.trash_dir = trash_dir
+        self.unlinks_per_sec = max(1, int(unlinks_per_sec))
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, trash_dir):
+        try:
+            rate = int(os.environ.get("FTS_TRASH_UNLINKS_PER_SEC") or 1000)
+        except ValueError:
+            rate = 1000
+        return cls(trash_dir, unlinks_per_sec=rate)
+
+    def on_storage_change(self, event, folder, name, old, new):
+        if event == "delete_folder":
+            self._wake.set()
+
+    def _entries(self):
+        try:
+            with os.scandir(self.trash_dir) as entries:
+                return [e.path for e in entries if not e.name.startswith(".")]
+        except OSError:
+            return []
+
+    def reap_once(self):
+        """Remove everything currently in the trash. Returns the number of files removed."""
+        if not self._entries():
+            return 0
+        lock_fh = None
+        if fcntl is not None:
+            try:
+                lock_fh = open(os.path.join(self.trash_dir, ".lock"), "a")
+                fcntl.flock(lock_fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                if lock_fh is not None:
+                    lock_fh.close()
+                return 0  # another worker is reaping
+        try:
+            removed = 0
+            for path in self._entries():
+                removed += self._remove_tree(path)
+                if self._stop.is_set():
+                    break
+            return removed
+        finally:
+            if lock_fh is not None:
+                lock_fh.close()
+
+    def _remove_tree(self, path):
+        removed = 0
+        batch_started = time.monotonic()
+        for root, dirs, files in os.walk(path, topdown=False):
+            for name in files:
+                try:
+                    os.unlink(os.path.join(root, name))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    logger.warning("Could not remove %s", os.path.join(root, name))
+                if removed and removed % self.BATCH == 0:
+                    # Throttle: a batch may take no less than BATCH / rate seconds.
+                    remaining = self.BATCH / self.unlinks_per_sec - (time.monotonic() - batch_started)
+                    if remaining > 0 and self._stop.wait(remaining):
+                        return removed
+                    batch_started = time.monotonic()
+            for name in dirs:
+                try:
+                    os.rmdir(os.path.join(root, name))
+                except OSError:
+                    pass
+        try:
+            os.rmdir(path)
+        except FileNotFoundError:
+            pass
+        except NotADirectoryError:
+            os.unlink(path)
+        except OSError:
+            logger.warning("Could not remove %s", path)
+        return removed
+
+    def _lower_priority(self):
+        # On Linux, setpriority on a thread id renices just this thread.
+        if hasattr(os, "setpriority") and hasattr(threading, "get_native_id"):
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+            except OSError:
+                pass
+
+    def _run(self):
+        self._lower_priority()
+        while not self._stop.is_set():
+            try:
+                removed = self.reap_once()
+                if removed:
+                    logger.info("Trash reaper removed %d file(s).", removed)
+            except Exception:
+                logger.exception("Trash reaping failed")
+            self._wake.wait(self.REAP_INTERVAL_SEC)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="fts-trash", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
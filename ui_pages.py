@@ -1,7 +1,7 @@
 import datetime
 from urllib.parse import quote
 
-from flask import render_template, url_for
+from flask import Response, current_app, render_template, stream_with_context, url_for
 
 
 GIPHY_LOGO_URL = (
@@ -9,11 +9,6 @@ GIPHY_LOGO_URL = (
     "?cid=ecf05e47a0n3gi1bfqntqmob8g9aid1oyj2wr3ds3mg700bl&rid=giphy.gif"
 )
 
-NAV_LOGO = (
-    '<a href="/" class="nav-logo-link"><img src="'
-    + GIPHY_LOGO_URL
-    + '" alt="Logo" class="nav-logo"></a>'
-)
 HOME_ICON = (
     '<svg class="nav-icon" xmlns="http://www.w3.org/2000/svg" fill="none" '
     'viewBox="0 0 24 24" stroke="currentColor" stroke-width="2">'
@@ -30,33 +25,24 @@ UPLOADS_ICON = (
     '00-2 2z"/></svg>'
 )
 
-NAV_HTML = (
-    '<nav class="site-nav">'
-    + NAV_LOGO
-    + '<a href="/">'
-    + HOME_ICON
-    + 'Home</a><a href="/uploads">'
-    + UPLOADS_ICON
-    + "Uploads</a></nav>"
-)
-NAV_HTML_HOME_ACTIVE = (
-    '<nav class="site-nav">'
-    + NAV_LOGO
-    + '<a href="/" class="active">'
-    + HOME_ICON
-    + 'Home</a><a href="/uploads">'
-    + UPLOADS_ICON
-    + "Uploads</a></nav>"
-)
-NAV_HTML_UPLOADS_ACTIVE = (
-    '<nav class="site-nav">'
-    + NAV_LOGO
-    + '<a href="/">'
-    + HOME_ICON
-    + 'Home</a><a href="/uploads" class="active">'
-    + UPLOADS_ICON
-    + "Uploads</a></nav>"
-)
+
+def logo_url():
+    return GIPHY_LOGO_URL
+
+
+def nav_html(active=None):
+    """Site navigation; `active` is "home", "uploads" or None."""
+    home_class = ' class="active"' if active == "home" else ""
+    uploads_class = ' class="active"' if active == "uploads" else ""
+    return (
+        '<nav class="site-nav">'
+        f'<a href="/" class="nav-logo-link"><img src="{logo_url()}" alt="Logo" class="nav-logo"></a>'
+        f'<a href="/"{home_class}>'
+        + HOME_ICON
+        + f'Home</a><a href="/uploads"{uploads_class}>'
+        + UPLOADS_ICON
+        + "Uploads</a></nav>"
+    )
 
 
 def _esc(text):
@@ -88,134 +74,212 @@ def _toggle_sort_link(current_sort, key):
     return key if key == "name" else f"-{key}"
 
 
-def render_uploads_page(title, breadcrumb_html, items, list_class="card-list", nav_html=None, current_sort="-mtime"):
-    if nav_html is None:
-        nav_html = NAV_HTML_UPLOADS_ACTIVE
-    if items:
-        bin_svg = (
-            '<svg xmlns="http://www.w3.org/2000/svg" fill="none" viewBox="0 0 24 24" '
-            'stroke="currentColor" stroke-width="2"><path stroke-linecap="round" '
-            'stroke-linejoin="round" d="M19 7l-.867 12.142A2 2 0 0116.138 21H7.862a2 2 '
-            '0 01-1.995-1.858L5 7m5 4v6m4-6v6m1-10V4a1 1 0 00-1-1h-4a1 1 0 00-1 '
-            '1v3M4 7h16"/></svg>'
+BIN_SVG = (
+    '<svg xmlns="http://www.w3.org/2000/svg" fill="none" viewBox="0 0 24 24" '
+    'stroke="currentColor" stroke-width="2"><path stroke-linecap="round" '
+    'stroke-linejoin="round" d="M19 7l-.867 12.142A2 2 0 0116.138 21H7.862a2 2 '
+    '0 01-1.995-1.858L5 7m5 4v6m4-6v6m1-10V4a1 1 0 00-1-1h-4a1 1 0 00-1 '
+    '1v3M4 7h16"/></svg>'
+)
+DOWNLOAD_SVG = (
+    '<svg xmlns="http://www.w3.org/2000/svg" fill="none" viewBox="0 0 24 24" '
+    'stroke="currentColor" stroke-width="2"><path stroke-linecap="round" '
+    'stroke-linejoin="round" d="M12 3v12m0 0l-4-4m4 4l4-4m5 8H3"/></svg>'
+)
+SHARE_SVG = (
+    '<svg xmlns="http://www.w3.org/2000/svg" fill="none" viewBox="0 0 24 24" '
+    'stroke="currentColor" stroke-width="2"><path stroke-linecap="round" '
+    'stroke-linejoin="round" d="M13.8 10.2a4 4 0 010 5.6l-3 3a4 4 0 01-5.6-5.6l1.5-1.5'
+    'm4.5-1.5a4 4 0 010-5.6l3-3a4 4 0 015.6 5.6l-1.5 1.5"/></svg>'
+)
+
+# Rows per chunk when a listing is streamed.
+LISTING_BATCH_SIZE = 200
+
+
+def _render_item(item, list_class):
+    is_file_table = list_class == "files-table"
+    is_file_list = "files" in list_class.split() or is_file_table
+    li_class = ' class="file-row"' if (is_file_list or item.get("delete_url") or item.get("pin_menu")) else ""
+    label_html = (
+        '<span class="lock-icon" title="Protected" aria-hidden="true">&#128274;</span> '
+        if item.get("has_pin")
+        else ""
+    ) + _esc(item["label"])
+    if item.get("usage") is not None:
+        usage = item["usage"]
+        label_html += (
+            f'<span class="folder-usage">{_format_size(usage.get("bytes", 0))}'
+            f' &middot; {int(usage.get("files", 0))} file(s)</span>'
+        )
+    link_attrs = f'href="{item["url"]}"'
+    if is_file_list:
+        safe_label = _esc(item["label"])
+        link_attrs += (
+            ' class="js-file-preview-trigger"'
+            f' data-file-name="{safe_label}"'
+            f' data-download-url="{item["url"]}"'
+            f' data-preview-url="{item["url"]}?preview=1"'
+        )
+    link = f"<a {link_attrs}>{label_html}</a>"
+    if is_file_table:
+        mtime = int(item.get("mtime") or 0)
+        mtime_text = (
+            datetime.datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M")
+            if mtime
+            else "-"
+        )
+        actions = (
+            f'<a href="{item["url"]}" class="download-btn" aria-label="Download">{DOWNLOAD_SVG}</a>'
+        )
+        if item.get("share"):
+            actions += (
+                '<button type="button" class="download-btn share-btn js-share-trigger" '
+                f'data-folder="{_esc(item["share"]["folder"])}" data-name="{_esc(item["share"]["name"])}" '
+                f'aria-label="Copy share link">{SHARE_SVG}</button>'
+            )
+        if item.get("delete_url"):
+            msg = item.get("delete_message", "Delete?")
+            actions += (
+                f'<form method="post" action="{item["delete_url"]}" class="delete-form js-delete-form" '
+                f'data-confirm-message="{msg}"><button type="button" class="delete-btn '
+                f'js-delete-trigger" aria-label="Delete">{BIN_SVG}</button></form>'
+            )
+        select = ""
+        if item.get("delete_url"):
+            # Owners can tick rows for the batch actions (delete, move, rename).
+            select = (
+                '<input type="checkbox" class="file-select js-file-select" '
+                f'aria-label="Select {_esc(item["label"])}">'
+            )
+        return (
+            f'<tr class="file-table-row" data-preview-row="1" data-name="{_esc(item["label"])}" '
+            f'data-size="{int(item.get("size") or 0)}" data-mtime="{mtime}">'
+            f'<td class="file-name-cell">{select}{link}</td>'
+            f'<td class="file-size-cell">{_format_size(item.get("size", 0))}</td>'
+            f'<td class="file-mtime-cell">{mtime_text}</td>'
+            f'<td class="file-actions-cell"><span class="row-actions-table">{actions}</span></td>'
+            "</tr>"
         )
-        download_svg = (
-            '<svg xmlns="http://www.w3.org/2000/svg" fill="none" viewBox="0 0 24 24" '
-            'stroke="currentColor" stroke-width="2"><path stroke-linecap="round" '
-            'stroke-linejoin="round" d="M12 3v12m0 0l-4-4m4 4l4-4m5 8H3"/></svg>'
+    if is_file_list:
+        link += '<span class="row-actions">'
+        link += (
+            f'<a href="{item["url"]}" class="download-btn" aria-label="Download">{DOWNLOAD_SVG}</a>'
         )
-        list_items = []
-        is_file_table = list_class == "files-table"
-        is_file_list = "files" in list_class.split() or is_file_table
-        for item in items:
-            li_class = ' class="file-row"' if (is_file_list or item.get("delete_url") or item.get("pin_menu")) else ""
-            label_html = (
-                '<span class="lock-icon" title="Protected" aria-hidden="true">&#128274;</span> '
-                if item.get("has_pin")
-                else ""
-            ) + _esc(item["label"])
-            link_attrs = f'href="{item["url"]}"'
-            if is_file_list:
-                safe_label = _esc(item["label"])
-                link_attrs += (
-                    ' class="js-file-preview-trigger"'
-                    f' data-file-name="{safe_label}"'
-                    f' data-download-url="{item["url"]}"'
-                    f' data-preview-url="{item["url"]}?preview=1"'
-                )
-            link = f"<a {link_attrs}>{label_html}</a>"
-            if is_file_table:
-                mtime = int(item.get("mtime") or 0)
-                mtime_text = (
-                    datetime.datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M")
-                    if mtime
-                    else "-"
-                )
-                actions = (
-                    f'<a href="{item["url"]}" class="download-btn" aria-label="Download">{download_svg}</a>'
-                )
-                if item.get("delete_url"):
-                    msg = item.get("delete_message", "Delete?")
-                    actions += (
-                        f'<form method="post" action="{item["delete_url"]}" class="delete-form js-delete-form" '
-                        f'data-confirm-message="{msg}"><button type="button" class="delete-btn '
-                        f'js-delete-trigger" aria-label="Delete">{bin_svg}</button></form>'
-                    )
-                row_html = (
-                    '<tr class="file-table-row" data-preview-row="1">'
-                    f'<td class="file-name-cell">{link}</td>'
-                    f'<td class="file-size-cell">{_format_size(item.get("size", 0))}</td>'
-                    f'<td class="file-mtime-cell">{mtime_text}</td>'
-                    f'<td class="file-actions-cell"><span class="row-actions-table">{actions}</span></td>'
-                    "</tr>"
-                )
-                list_items.append(row_html)
-                continue
-            if is_file_list:
-                link += '<span class="row-actions">'
-                link += (
-                    f'<a href="{item["url"]}" class="download-btn" aria-label="Download">{download_svg}</a>'
-                )
-                if item.get("delete_url"):
-                    msg = item.get("delete_message", "Delete?")
-                    link += (
-                        f'<form method="post" action="{item["delete_url"]}" class="delete-form js-delete-form" '
-                        f'data-confirm-message="{msg}"><button type="button" class="delete-btn '
-                        f'js-delete-trigger" aria-label="Delete">{bin_svg}</button></form>'
-                    )
-                link += "</span>"
-            elif item.get("pin_menu"):
-                folder_esc = (item.get("folder_name") or "").replace("&", "&amp;").replace('"', "&quot;")
-                has_pin = "true" if item.get("has_pin") else "false"
-                link += (
-                    '<span class="row-actions"><button type="button" class="pin-menu-btn js-pin-menu" '
-                    f'data-folder="{folder_esc}" data-has-pin="{has_pin}" '
-                    'aria-label="Folder options">&#8230;</button>'
-                )
-            if item.get("delete_url") and not is_file_list:
-                msg = item.get("delete_message", "Delete?")
-                link += (
-                    f'<form method="post" action="{item["delete_url"]}" class="delete-form js-delete-form" '
-                    f'data-confirm-message="{msg}"><button type="button" class="delete-btn '
-                    f'js-delete-trigger" aria-label="Delete">{bin_svg}</button></form>'
-                )
-            if item.get("pin_menu"):
-                link += "</span>"
-            list_items.append(f"<li{li_class}>{link}</li>")
-        if is_file_table:
-            name_sort = _toggle_sort_link(current_sort, "name")
-            size_sort = _toggle_sort_link(current_sort, "size")
-            mtime_sort = _toggle_sort_link(current_sort, "mtime")
-            body_html = (
-                '<div class="table-container">'
-                '<table class="uploads-table">'
-                "<thead><tr>"
-                f'<th><a href="?sort={name_sort}">Name</a></th>'
-                f'<th><a href="?sort={size_sort}">Size</a></th>'
-                f'<th><a href="?sort={mtime_sort}">Last Modified</a></th>'
-                "<th>Actions</th>"
-                "</tr></thead>"
-                f'<tbody>{"".join(list_items)}</tbody>'
-                "</table>"
-                "</div>"
+        if item.get("delete_url"):
+            msg = item.get("delete_message", "Delete?")
+            link += (
+                f'<form method="post" action="{item["delete_url"]}" class="delete-form js-delete-form" '
+                f'data-confirm-message="{msg}"><button type="button" class="delete-btn '
+                f'js-delete-trigger" aria-label="Delete">{BIN_SVG}</button></form>'
             )
-        else:
-            body_html = f'<ul class="{list_class}">{"".join(list_items)}</ul>'
-    else:
-        body_html = '<p class="empty">No items here yet.</p>'
+        link += "</span>"
+    elif item.get("pin_menu"):
+        folder_esc = (item.get("folder_name") or "").replace("&", "&amp;").replace('"', "&quot;")
+        has_pin = "true" if item.get("has_pin") else "false"
+        link += (
+            '<span class="row-actions"><button type="button" class="pin-menu-btn js-pin-menu" '
+            f'data-folder="{folder_esc}" data-has-pin="{has_pin}" '
+            'aria-label="Folder options">&#8230;</button>'
+        )
+    if item.get("delete_url") and not is_file_list:
+        msg = item.get("delete_message", "Delete?")
+        link += (
+            f'<form method="post" action="{item["delete_url"]}" class="delete-form js-delete-form" '
+            f'data-confirm-message="{msg}"><button type="button" class="delete-btn '
+            f'js-delete-trigger" aria-label="Delete">{BIN_SVG}</button></form>'
+        )
+    if item.get("pin_menu"):
+        link += "</span>"
+    return f'<li{li_class} data-name="{_esc(item["label"])}">{link}</li>'
+
+
+def render_listing_row(item, list_class="card-list"):
+    """One listing row as HTML, for pages that patch themselves (see live_routes)."""
+    return _render_item(item, list_class)
+
+
+def _list_open(list_class, current_sort):
+    if list_class != "files-table":
+        return f'<ul class="{list_class}">', "</ul>"
+    name_sort = _toggle_sort_link(current_sort, "name")
+    size_sort = _toggle_sort_link(current_sort, "size")
+    mtime_sort = _toggle_sort_link(current_sort, "mtime")
+    opening = (
+        '<div class="table-container">'
+        '<table class="uploads-table">'
+        "<thead><tr>"
+        f'<th><a href="?sort={name_sort}">Name</a></th>'
+        f'<th><a href="?sort={size_sort}">Size</a></th>'
+        f'<th><a href="?sort={mtime_sort}">Last Modified</a></th>'
+        "<th>Actions</th>"
+        "</tr></thead>"
+        "<tbody>"
+    )
+    return opening, "</tbody></table></div>"
 
+
+def _listing_chunks(items, list_class, current_sort, batch_size=LISTING_BATCH_SIZE):
+    """Yield the listing body as HTML chunks of `batch_size` rows; `items` may be lazy."""
+    rows = []
+    closing = None
+    for item in items:
+        if closing is None:
+            opening, closing = _list_open(list_class, current_sort)
+            rows.append(opening)
+        rows.append(_render_item(item, list_class))
+        if len(rows) >= batch_size:
+            yield "".join(rows)
+            rows = []
+    if closing is None:
+        yield '<p class="empty">No items here yet.</p>'
+        return
+    rows.append(closing)
+    yield "".join(rows)
+
+
+def _uploads_page_context(title, breadcrumb_html, body_chunks, nav):
+    return {
+        "favicon_url": logo_url(),
+        "title": title,
+        "nav_html": nav_html("uploads") if nav is None else nav,
+        "breadcrumb_html": breadcrumb_html,
+        "body_chunks": body_chunks,
+    }
+
+
+def render_uploads_page(title, breadcrumb_html, items, list_class="card-list", nav_html=None, current_sort="-mtime"):
     return render_template(
         "uploads.html",
-        favicon_url=GIPHY_LOGO_URL,
-        title=title,
-        nav_html=nav_html,
-        breadcrumb_html=breadcrumb_html,
-        body_html=body_html,
+        **_uploads_page_context(
+            title,
+            breadcrumb_html,
+            _listing_chunks(items, list_class, current_sort),
+            nav_html,
+        ),
+    )
+
+
+def stream_uploads_page(title, breadcrumb_html, items, list_class="card-list", nav_html=None, current_sort="-mtime"):
+    """Like render_uploads_page, but as a streamed response.
+
+    The page header goes out before `items` is touched, so `items` can be a
+    generator that scans the folder; rows follow in batches, and only one
+    batch of HTML is held in memory at a time.
+    """
+    context = _uploads_page_context(
+        title,
+        breadcrumb_html,
+        _listing_chunks(items, list_class, current_sort),
+        nav_html,
     )
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template("uploads.html")
+    return Response(stream_with_context(template.generate(context)), mimetype="text/html")
 
 
 def render_folder_not_found_page():
-    return render_template("folder_not_found.html", favicon_url=GIPHY_LOGO_URL)
+    return render_template("folder_not_found.html", favicon_url=logo_url())
 
 
 def render_pin_entry_page(
@@ -229,7 +293,7 @@ def render_pin_entry_page(
         form_action = url_for("pin_entry", folder=folder_name)
     return render_template(
         "pin_entry.html",
-        favicon_url=GIPHY_LOGO_URL,
+        favicon_url=logo_url(),
         folder_name=quote(folder_name),
         next_value=quote(next_url or ("/uploads/" + quote(folder_name))),
         error=error,
@@ -241,7 +305,7 @@ def render_pin_entry_page(
 def render_home_page(uploader_ip):
     return render_template(
         "home.html",
-        favicon_url=GIPHY_LOGO_URL,
-        nav_html=NAV_HTML_HOME_ACTIVE,
+        favicon_url=logo_url(),
+        nav_html=nav_html("home"),
         uploader_folder=uploader_ip,
     )
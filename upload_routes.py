@@ -1,23 +1,109 @@
-import os
-import pathlib
-import shutil
+import hashlib
 import mimetypes
+import os
 from io import BytesIO
 from urllib.parse import quote
 
 from werkzeug.utils import secure_filename
 
-from flask import flash, redirect, request, send_file, url_for
+from flask import Response, flash, redirect, request, send_file, url_for
+
+from decrypt_cache_service import key_fingerprint
+from delta_service import MAX_BLOCK_SIZE, MIN_BLOCK_SIZE, DeltaError
+from digest_service import HashingReader
+from profiling_service import annotate_request, timed_phase
+from resume_service import ResumeConflict, ResumeError
+
+
+def send_stored_file(storage, folder, name, as_attachment, mimetype):
+    """Send a plaintext stored file, with HTTP range support on every backend."""
+    local = storage.local_path(folder, name)
+    if local is not None:
+        return send_file(local, as_attachment=as_attachment, download_name=name, mimetype=mimetype)
+    info = storage.stat(folder, name)
+    if info is None:
+        return "Not found", 404
+    start, end, status = 0, info.size, 200
+    byte_range = request.range
+    if byte_range is not None and byte_range.units == "bytes" and len(byte_range.ranges) == 1:
+        bounds = byte_range.range_for_length(info.size)
+        if bounds is None:
+            return Response(status=416, headers={"Content-Range": f"bytes */{info.size}"})
+        start, end = bounds
+        status = 206
+    resp = Response(
+        storage.iter_range(folder, name, start, end),
+        status=status,
+        mimetype=mimetype,
+        direct_passthrough=True,
+    )
+    resp.content_length = end - start
+    resp.headers["Accept-Ranges"] = "bytes"
+    if status == 206:
+        resp.headers["Content-Range"] = f"bytes {start}-{end - 1}/{info.size}"
+    disposition = "attachment" if as_attachment else "inline"
+    resp.headers["Content-Disposition"] = f"{disposition}; filename*=UTF-8''{quote(name)}"
+    return resp
+
+
+def folder_listing_item(pin_service, folder_name, usage, client_ip):
+    """Row of the folder index; owners also get delete and PIN actions."""
+    item = {
+        "url": f"/uploads/{quote(folder_name)}",
+        "label": folder_name,
+        "usage": usage,
+    }
+    if client_ip == folder_name or client_ip in ("127.0.0.1", "::1"):
+        item["delete_url"] = f"/uploads/{quote(folder_name)}/delete-folder"
+        item["delete_message"] = "Delete this folder and all its files?"
+        item["pin_menu"] = True
+        item["folder_name"] = folder_name
+        item["has_pin"] = pin_service.folder_has_pin(folder_name)
+    return item
+
+
+def file_listing_item(folder, file_name, size, mtime, can_delete):
+    """Row of a folder's file table; `can_delete` adds the owner's delete and share actions."""
+    item = {
+        "url": f"/uploads/{folder}/{quote(file_name)}",
+        "label": file_name,
+        "size": size,
+        "mtime": mtime,
+    }
+    if can_delete:
+        item["delete_url"] = f"/uploads/{folder}/{quote(file_name)}/delete"
+        item["delete_message"] = "Delete this file?"
+        item["share"] = {"folder": folder, "name": file_name}
+    return item
+
+
+def _wants_json():
+    # The listing pages delete over XHR and patch the page instead of following the redirect.
+    return request.accept_mimetypes.best == "application/json"
+
+
+def _hours_to_seconds(value):
+    if value is None:
+        return None
+    return max(0.0, float(value)) * 3600
 
 
 def register_upload_routes(
     app,
     pin_service,
-    safe_upload_path,
+    storage,
+    usage_service,
+    retention_service,
+    digest_service,
+    delta_service,
+    search_service,
+    resumable_uploads,
     get_client_ip,
     render_uploads_page,
+    stream_uploads_page,
     render_folder_not_found_page,
     render_home_page,
+    decrypt_cache=None,
 ):
     @app.route("/api/uploader-folder", methods=["GET"])
     def api_uploader_folder():
@@ -26,49 +112,259 @@ def register_upload_routes(
     @app.route("/api/uploader-has-folder", methods=["GET"])
     def api_uploader_has_folder():
         folder = get_client_ip().strip()
-        path = pathlib.Path(app.config["UPLOAD_FOLDER"], folder)
-        return {"has_folder": path.is_dir()}
+        return {"has_folder": storage.folder_exists(folder)}
+
+    @app.route("/api/upload-preflight", methods=["POST"])
+    def api_upload_preflight():
+        """Tell the browser which of its selected files the folder already holds unchanged."""
+        folder = get_client_ip().strip()
+        data = request.get_json(force=True, silent=True) or {}
+        entries = data.get("files")
+        if not isinstance(entries, list):
+            return {"ok": False, "error": "Expected a list of files."}, 400
+        if not storage.folder_exists(folder):
+            return {"ok": True, "have": []}
+        if pin_service.folder_has_pin(folder) and not pin_service.is_folder_unlocked(folder):
+            # Don't confirm contents of a locked folder; the client uploads everything.
+            return {"ok": True, "have": []}
+        candidates = {}
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            name = secure_filename(str(entry.get("name") or ""))
+            sha256 = str(entry.get("sha256") or "")
+            try:
+                size = int(entry.get("size"))
+            except (TypeError, ValueError):
+                continue
+            if name and len(sha256) == 64:
+                # Keyed by the name the browser sent, answered with it too.
+                candidates[name] = (size, sha256, entry.get("name"))
+        with timed_phase("io"):
+            same = digest_service.unchanged(folder, {n: c[:2] for n, c in candidates.items()})
+        return {"ok": True, "have": [candidates[name][2] for name in same]}
+
+    def _delta_target():
+        """(folder, name, fernet) for a delta request on the caller's own file, or an error response."""
+        folder = get_client_ip().strip()
+        name = secure_filename(request.args.get("name") or "")
+        if not name:
+            return None, ({"ok": False, "error": "Missing file name."}, 400)
+        if not storage.folder_exists(folder) or storage.stat(folder, name) is None:
+            return None, ({"ok": False, "error": "No such file to update."}, 404)
+        if pin_service.folder_has_pin(folder) and not pin_service.is_folder_unlocked(folder):
+            return None, ({"ok": False, "error": "Unlock your folder with its PIN first."}, 403)
+        fernet = None
+        if pin_service.folder_has_encryption(folder):
+            fernet = pin_service.get_fek_for_folder(folder)
+            if not fernet:
+                return None, ({"ok": False, "error": "Unlock your folder with its PIN first."}, 403)
+        return (folder, name, fernet), None
+
+    @app.route("/api/delta/signatures", methods=["GET"])
+    def api_delta_signatures():
+        """Block signatures of one of the caller's files, for an rsync-style delta upload."""
+        target, error = _delta_target()
+        if error:
+            return error
+        folder, name, fernet = target
+        try:
+            block_size = int(request.args["block_size"]) if request.args.get("block_size") else None
+        except ValueError:
+            return {"ok": False, "error": "block_size must be a number."}, 400
+        annotate_request(folder=folder, file=name, encrypted=bool(fernet))
+        with timed_phase("io"):
+            signatures = delta_service.signatures(folder, name, fernet, block_size)
+        if signatures is None:
+            return {"ok": False, "error": "No such file to update."}, 404
+        return dict(signatures, ok=True)
+
+    @app.route("/api/delta/upload", methods=["POST"])
+    def api_delta_upload():
+        """Apply a delta stream (request body) to one of the caller's files."""
+        target, error = _delta_target()
+        if error:
+            return error
+        folder, name, fernet = target
+        try:
+            block_size = int(request.args["block_size"])
+            size = int(request.args["size"])
+        except (KeyError, ValueError):
+            return {"ok": False, "error": "block_size and size are required."}, 400
+        if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+            return {"ok": False, "error": "block_size is out of range."}, 400
+        if size < 0:
+            return {"ok": False, "error": "size must not be negative."}, 400
+        sha256 = request.args.get("sha256") or ""
+        if len(sha256) != 64:
+            return {"ok": False, "error": "sha256 of the new content is required."}, 400
+        existing = storage.stat(folder, name)
+        quota_error = usage_service.check_quota(folder, size, 1, existing.size, 1)
+        if quota_error:
+            return {"ok": False, "error": quota_error}, 413
+        annotate_request(folder=folder, file=name, size=size, encrypted=bool(fernet))
+        try:
+            with timed_phase("io"):
+                delta_service.apply(folder, name, request.stream, block_size, sha256, size, fernet)
+        except DeltaError as exc:
+            return {"ok": False, "error": str(exc)}, 409
+        return {"ok": True, "name": name, "size": size}
+
+    @app.route("/api/search", methods=["GET"])
+    def api_search():
+        """Filename search across folders; PIN folders only when this browser has unlocked them."""
+        query = (request.args.get("q") or "").strip()
+        try:
+            limit = int(request.args.get("limit") or 50)
+        except ValueError:
+            return {"ok": False, "error": "limit must be a number."}, 400
+        hidden = [f for f in pin_service.pinned_folders() if not pin_service.is_folder_unlocked(f)]
+        with timed_phase("io"):
+            results = search_service.search(query, hidden_folders=hidden, limit=limit)
+        for item in results:
+            item["url"] = f"/uploads/{quote(item['folder'])}/{quote(item['name'])}"
+            item["folder_url"] = f"/uploads/{quote(item['folder'])}"
+        annotate_request(file_count=len(results))
+        return {"ok": True, "query": query, "results": results}
+
+    @app.route("/api/folders/<folder>/files", methods=["GET"])
+    def api_folder_files(folder):
+        """JSON listing of a folder for `fts pull` (sha256 is the plaintext digest, when known)."""
+        if not storage.folder_exists(folder):
+            return {"ok": False, "error": "Folder not found."}, 404
+        if pin_service.folder_has_pin(folder) and not pin_service.is_folder_unlocked(folder):
+            return {"ok": False, "locked": True, "error": "Folder is locked with a PIN."}, 403
+        encrypted = bool(pin_service.folder_has_encryption(folder))
+        annotate_request(folder=folder, encrypted=encrypted)
+        files = []
+        with timed_phase("io"):
+            for stored in storage.iter_files(folder):
+                digest = digest_service.get(folder, stored.name, stored)
+                files.append({
+                    "name": stored.name,
+                    # Encrypted files are stored larger than they download.
+                    "size": digest["size"] if digest else (None if encrypted else stored.size),
+                    "mtime": stored.mtime,
+                    "sha256": digest["sha256"] if digest else None,
+                })
+        annotate_request(file_count=len(files))
+        return {"ok": True, "folder": folder, "encrypted": encrypted, "files": files}
+
+    def _resumable_target():
+        """(folder, name, fernet) for a resumable upload into the caller's folder, or an error response."""
+        folder = get_client_ip().strip()
+        name = secure_filename(request.args.get("name") or "")
+        if not name:
+            return None, ({"ok": False, "error": "Missing file name."}, 400)
+        if pin_service.folder_has_pin(folder) and not pin_service.is_folder_unlocked(folder):
+            return None, ({"ok": False, "locked": True, "error": "Unlock your folder with its PIN first."}, 403)
+        fernet = None
+        if pin_service.folder_has_encryption(folder):
+            fernet = pin_service.get_fek_for_folder(folder)
+            if not fernet:
+                return None, ({"ok": False, "locked": True, "error": "Unlock your folder with its PIN first."}, 403)
+        return (folder, name, fernet), None
+
+    @app.route("/api/resumable", methods=["GET", "PUT"])
+    def api_resumable():
+        """GET: how much of `name` the server already holds. PUT: append the body at `offset`."""
+        target, error = _resumable_target()
+        if error:
+            return error
+        folder, name, fernet = target
+        if request.method == "GET":
+            return {"ok": True, "name": name, "offset": resumable_uploads.offset(folder, name, bool(fernet))}
+        try:
+            offset = int(request.args["offset"])
+            total = int(request.args["total"])
+        except (KeyError, ValueError):
+            return {"ok": False, "error": "offset and total are required."}, 400
+        if offset < 0 or total < offset:
+            return {"ok": False, "error": "offset is out of range."}, 400
+        if offset == 0:
+            existing = storage.stat(folder, name)
+            quota_error = usage_service.check_quota(
+                folder,
+                total,
+                1,
+                existing.size if existing else 0,
+                1 if existing else 0,
+            )
+            if quota_error:
+                return {"ok": False, "error": quota_error}, 413
+            storage.create_folder(folder)
+        annotate_request(folder=folder, file=name, size=request.content_length, encrypted=bool(fernet))
+        try:
+            with timed_phase("io"):
+                new_offset, done = resumable_uploads.append(
+                    folder, name, offset, request.stream, total, fernet, request.args.get("sha256")
+                )
+        except ResumeConflict as exc:
+            return {"ok": False, "error": str(exc), "offset": exc.offset}, 409
+        except ResumeError as exc:
+            return {"ok": False, "error": str(exc)}, 400
+        return {"ok": True, "name": name, "offset": new_offset, "done": done}
+
+    @app.route("/uploads/<folder>/retention", methods=["GET", "POST"])
+    def folder_retention(folder):
+        client_ip = get_client_ip().strip()
+        if client_ip != folder and client_ip not in ("127.0.0.1", "::1"):
+            return {"ok": False, "error": "You can only manage your own folder."}, 403
+        if not storage.folder_exists(folder):
+            return {"ok": False, "error": "Folder not found."}, 404
+        if request.method == "POST":
+            data = request.get_json(force=True, silent=True) or {}
+            try:
+                max_age = _hours_to_seconds(data.get("max_age_hours"))
+                max_idle = _hours_to_seconds(data.get("max_idle_hours"))
+                max_bytes = None if data.get("max_bytes") is None else max(0, int(data["max_bytes"]))
+            except (TypeError, ValueError):
+                return {"ok": False, "error": "Retention limits must be numbers."}, 400
+            retention_service.set_policy(folder, max_age=max_age, max_idle=max_idle, max_bytes=max_bytes)
+        policy = retention_service.get_policy(folder)
+        return {
+            "ok": True,
+            "max_age_hours": policy["max_age"] / 3600,
+            "max_idle_hours": policy["max_idle"] / 3600,
+            "max_bytes": policy["max_bytes"],
+        }
 
     @app.route("/uploads", methods=["GET"])
     @app.route("/uploads/<path:subpath>", methods=["GET", "POST"])
     def list_or_download_uploads(subpath=None):
         if not subpath:
-            base = app.config["UPLOAD_FOLDER"]
-            if not os.path.isdir(base):
-                return render_uploads_page("Uploads", '<a href="/">Home</a> / Uploads', [])
-            folders = [d for d in os.listdir(base) if os.path.isdir(os.path.join(base, d))]
+            with timed_phase("io"):
+                folders = storage.list_folders()
             folders.sort(reverse=True)
+            usage = usage_service.all_usage()
             client_ip = get_client_ip().strip()
-            items = []
-            for folder_name in folders:
-                item = {"url": f"/uploads/{quote(folder_name)}", "label": folder_name}
-                if client_ip == folder_name or client_ip in ("127.0.0.1", "::1"):
-                    item["delete_url"] = f"/uploads/{quote(folder_name)}/delete-folder"
-                    item["delete_message"] = "Delete this folder and all its files?"
-                    item["pin_menu"] = True
-                    item["folder_name"] = folder_name
-                    item["has_pin"] = pin_service.folder_has_pin(folder_name)
-                items.append(item)
-            return render_uploads_page("Uploads", '<a href="/">Home</a> / Uploads', items)
+            items = [
+                folder_listing_item(
+                    pin_service, folder_name, usage.get(folder_name, {"bytes": 0, "files": 0}), client_ip
+                )
+                for folder_name in folders
+            ]
+            with timed_phase("render"):
+                return render_uploads_page("Uploads", '<a href="/">Home</a> / Uploads', items)
 
         parts = subpath.strip("/").split("/")
         folder = parts[0]
-        path = safe_upload_path(folder)
-        if path is None:
+        annotate_request(folder=folder)
+        if not storage.folder_exists(folder):
             return render_folder_not_found_page(), 404
 
         if request.method == "POST" and len(parts) == 2 and parts[-1] == "delete-folder":
             client_ip = get_client_ip().strip()
             if client_ip != folder and client_ip not in ("127.0.0.1", "::1"):
                 return "Forbidden: you can only delete your own folder.", 403
-            if not os.path.isdir(path):
-                return "Not found", 404
             try:
-                shutil.rmtree(path)
+                storage.delete_folder(folder)
             except OSError:
                 return "Could not delete folder.", 500
             if not pin_service.remove_folder_details(folder):
                 return "Folder deleted, but failed to remove PIN details.", 500
+            if _wants_json():
+                return {"ok": True}
             return redirect(url_for("list_or_download_uploads"))
 
         if request.method == "POST" and len(parts) >= 2 and parts[-1] == "delete":
@@ -76,58 +372,47 @@ def register_upload_routes(
             if client_ip != folder and client_ip not in ("127.0.0.1", "::1"):
                 return "Forbidden: you can only delete your own files.", 403
             filename = "/".join(parts[1:-1])
-            file_path = safe_upload_path(folder, filename)
-            if file_path is None or not os.path.isfile(file_path):
+            if storage.stat(folder, filename) is None:
                 return "Not found", 404
             try:
-                os.remove(file_path)
+                storage.delete(folder, filename)
             except OSError:
                 return "Could not delete file.", 500
+            if _wants_json():
+                return {"ok": True}
             return redirect(url_for("list_or_download_uploads", subpath=folder))
 
         if len(parts) == 1:
-            if not os.path.isdir(path):
-                return render_folder_not_found_page(), 404
             if pin_service.folder_has_pin(folder) and not pin_service.is_folder_unlocked(folder):
                 next_url = url_for("list_or_download_uploads", subpath=folder)
                 return redirect(url_for("pin_entry", folder=folder, next=next_url))
             client_ip = get_client_ip().strip()
             can_delete = client_ip == folder or client_ip in ("127.0.0.1", "::1")
-            files = [f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
             sort = request.args.get("sort", "-mtime")
             if sort not in {"name", "-name", "size", "-size", "mtime", "-mtime"}:
                 sort = "-mtime"
-            items = []
-            for file_name in files:
-                file_abs = os.path.join(path, file_name)
-                try:
-                    stat = os.stat(file_abs)
-                    size = int(stat.st_size)
-                    mtime = int(stat.st_mtime)
-                except OSError:
-                    size = 0
-                    mtime = 0
-                item = {
-                    "url": f"/uploads/{folder}/{quote(file_name)}",
-                    "label": file_name,
-                    "size": size,
-                    "mtime": mtime,
-                }
-                if can_delete:
-                    item["delete_url"] = f"/uploads/{folder}/{quote(file_name)}/delete"
-                    item["delete_message"] = "Delete this file?"
-                items.append(item)
-            reverse = sort.startswith("-")
-            key = sort[1:] if reverse else sort
-            if key == "name":
-                items.sort(key=lambda i: (i["label"] or "").lower(), reverse=reverse)
-            else:
-                items.sort(key=lambda i: i.get(key, 0), reverse=reverse)
+
+            def _items():
+                # Runs while the response streams: the page header is already out.
+                # Only the (name, size, mtime) tuples are kept for sorting; rows
+                # are built one batch at a time.
+                with timed_phase("io"):
+                    files = storage.list_files(folder)
+                reverse = sort.startswith("-")
+                key = sort[1:] if reverse else sort
+                if key == "name":
+                    files.sort(key=lambda f: f.name.lower(), reverse=reverse)
+                else:
+                    files.sort(key=lambda f: getattr(f, key) or 0, reverse=reverse)
+                annotate_request(file_count=len(files))
+                for stored in files:
+                    yield file_listing_item(folder, stored.name, stored.size, stored.mtime, can_delete)
+
             breadcrumb = f'<a href="/">Home</a> / <a href="/uploads">Uploads</a> / {folder}'
-            return render_uploads_page(
+            return stream_uploads_page(
                 folder,
                 breadcrumb,
-                items,
+                _items(),
                 list_class="files-table",
                 current_sort=sort,
             )
@@ -135,38 +420,44 @@ def register_upload_routes(
         if pin_service.folder_has_pin(folder) and not pin_service.is_folder_unlocked(folder):
             return redirect(url_for("pin_entry", folder=folder, next=request.url))
 
-        file_path = safe_upload_path(*parts)
-        if file_path is None or not os.path.isfile(file_path):
+        filename = "/".join(parts[1:])
+        stored = storage.stat(folder, filename)
+        if stored is None:
             return "Not found", 404
 
         preview_mode = request.args.get("preview") == "1"
-        guessed_mimetype = mimetypes.guess_type(os.path.basename(file_path))[0] or "application/octet-stream"
+        guessed_mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        encrypted = bool(pin_service.folder_has_encryption(folder))
+        annotate_request(file=filename, size=stored.size, encrypted=encrypted)
+        retention_service.record_access(folder, filename)
 
-        if pin_service.folder_has_encryption(folder):
+        if encrypted:
             fernet = pin_service.get_fek_for_folder(folder)
             if fernet:
                 try:
-                    ciphertext = pathlib.Path(file_path).read_bytes()
-                    plaintext = fernet.decrypt(ciphertext)
+                    fek_b64 = pin_service.get_fek_b64_for_folder(folder) if decrypt_cache is not None else None
+                    if fek_b64:
+                        key_id = key_fingerprint(fek_b64)
+                        plaintext, hit = decrypt_cache.read(folder, filename, stored, fernet, key_id)
+                        annotate_request(cache="hit" if hit else "miss")
+                    else:
+                        with timed_phase("io"):
+                            ciphertext = storage.read_bytes(folder, filename)
+                        with timed_phase("crypto"):
+                            plaintext = fernet.decrypt(ciphertext)
                     return send_file(
                         BytesIO(plaintext),
                         as_attachment=not preview_mode,
-                        download_name=os.path.basename(file_path),
+                        download_name=filename,
                         mimetype=guessed_mimetype,
                     )
                 except Exception:
                     return "Decryption failed", 500
-        return send_file(
-            file_path,
-            as_attachment=not preview_mode,
-            download_name=os.path.basename(file_path),
-            mimetype=guessed_mimetype,
-        )
+        return send_stored_file(storage, folder, filename, not preview_mode, guessed_mimetype)
 
     @app.route("/", methods=["GET", "POST"])
     def upload_file():
         uploader_ip = str(get_client_ip())
-        upload_dir = pathlib.Path(app.config["UPLOAD_FOLDER"], uploader_ip)
 
         if request.method == "POST":
             if "file" not in request.files:
@@ -177,19 +468,55 @@ def register_upload_routes(
                 flash("No selected file")
                 return redirect(request.url)
             if files:
-                upload_dir.mkdir(parents=True, exist_ok=True)
+                storage.create_folder(uploader_ip)
                 folder_name = uploader_ip
                 if pin_service.folder_has_encryption(folder_name) and not pin_service.get_fek_for_folder(folder_name):
                     flash("Open your folder and enter PIN first to upload encrypted files.")
                     return redirect(request.url)
                 fernet = pin_service.get_fek_for_folder(folder_name) if pin_service.folder_has_encryption(folder_name) else None
+                incoming_bytes = 0
+                incoming_files = 0
+                replaced_bytes = 0
+                replaced_files = 0
+                for file in files:
+                    filename = secure_filename(file.filename)
+                    if not filename:
+                        continue
+                    file.stream.seek(0, os.SEEK_END)
+                    incoming_bytes += file.stream.tell()
+                    file.stream.seek(0)
+                    incoming_files += 1
+                    existing = storage.stat(folder_name, filename)
+                    if existing is not None:
+                        replaced_bytes += existing.size
+                        replaced_files += 1
+                quota_error = usage_service.check_quota(
+                    folder_name, incoming_bytes, incoming_files, replaced_bytes, replaced_files
+                )
+                if quota_error:
+                    return quota_error, 413
+                total_size = 0
                 for file in files:
                     filename = secure_filename(file.filename)
-                    content = file.read()
-                    out_path = upload_dir / filename
+                    if not filename:
+                        continue
                     if fernet:
-                        out_path.write_bytes(fernet.encrypt(content))
+                        # Fernet tokens are not streamable: encrypt the whole file.
+                        with timed_phase("io"):
+                            content = file.read()
+                        total_size += len(content)
+                        with timed_phase("crypto"):
+                            sha256 = hashlib.sha256(content).hexdigest()
+                            plain_size = len(content)
+                            content = fernet.encrypt(content)
+                        with timed_phase("io"):
+                            storage.write_bytes(folder_name, filename, content)
                     else:
-                        out_path.write_bytes(content)
+                        reader = HashingReader(file.stream)
+                        with timed_phase("io"):
+                            total_size += storage.put_stream(folder_name, filename, reader)
+                        sha256, plain_size = reader.hexdigest(), reader.size
+                    digest_service.record(folder_name, filename, sha256, plain_size)
+                annotate_request(folder=folder_name, size=total_size, file_count=len(files), encrypted=bool(fernet))
                 return redirect(url_for("upload_file", name=filename))
         return render_home_page(uploader_ip)
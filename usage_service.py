@@ -0,0 +1,178 @@
+import logging
+import os
+import time
+
+
+logger = logging.getLogger("fts.usage")
+
+
+class UsageService:
+    """Per-folder byte and file counts, kept up to date from storage events.
+
+    Counters live in the metadata store, so every answer is a single-row
+    lookup instead of a walk over the uploads tree. The tree is scanned once,
+    the first time the server starts with usage accounting.
+    """
+
+    ALERT_PERCENT = 80
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS folder_usage (
+            folder TEXT PRIMARY KEY,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            files INTEGER NOT NULL DEFAULT 0,
+            quota_bytes INTEGER,
+            quota_files INTEGER,
+            alerted INTEGER NOT NULL DEFAULT 0,
+            updated REAL NOT NULL DEFAULT 0
+        )""",
+    ]
+
+    def __init__(self, metadata, storage, quota_bytes=0, quota_files=0, alert_percent=None):
+        self.metadata = metadata
+        self.storage = storage
+        self.default_quota_bytes = int(quota_bytes or 0)
+        self.default_quota_files = int(quota_files or 0)
+        self.alert_percent = int(alert_percent or self.ALERT_PERCENT)
+        self.metadata.ensure_schema("usage", self.SCHEMA)
+
+    @classmethod
+    def from_env(cls, metadata, storage):
+        return cls(
+            metadata,
+            storage,
+            quota_bytes=_env_int("FTS_QUOTA_BYTES"),
+            quota_files=_env_int("FTS_QUOTA_FILES"),
+            alert_percent=_env_int("FTS_QUOTA_ALERT_PERCENT") or None,
+        )
+
+    def ensure_initialized(self):
+        """Seed the counters from one full scan; later updates are incremental."""
+        if self.metadata.get_flag("usage_initialized"):
+            return
+        totals = {}
+        for folder in self.storage.list_folders():
+            size = 0
+            count = 0
+            for item in self.storage.iter_files(folder):
+                size += item.size
+                count += 1
+            totals[folder] = (size, count)
+        now = time.time()
+        with self.metadata.transaction() as conn:
+            for folder, (size, count) in totals.items():
+                conn.execute(
+                    "INSERT INTO folder_usage (folder, bytes, files, updated) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(folder) DO UPDATE SET bytes = excluded.bytes, files = excluded.files, "
+                    "updated = excluded.updated",
+                    (folder, size, count, now),
+                )
+        self.metadata.set_flag("usage_initialized", now)
+
+    def on_storage_change(self, event, folder, name, old, new):
+        if event == "delete_folder":
+            self.metadata.execute(
+                "UPDATE folder_usage SET bytes = 0, files = 0, alerted = 0, updated = ? WHERE folder = ?",
+                (time.time(), folder),
+            )
+            return
+        delta_bytes = (new.size if new else 0) - (old.size if old else 0)
+        delta_files = (1 if new else 0) - (1 if old else 0)
+        if not delta_bytes and not delta_files:
+            return
+        self._apply(folder, delta_bytes, delta_files)
+
+    def _apply(self, folder, delta_bytes, delta_files):
+        with self.metadata.transaction() as conn:
+            conn.execute(
+                "INSERT INTO folder_usage (folder, bytes, files, updated) VALUES (?, MAX(0, ?), MAX(0, ?), ?) "
+                "ON CONFLICT(folder) DO UPDATE SET bytes = MAX(0, bytes + ?), files = MAX(0, files + ?), "
+                "updated = excluded.updated",
+                (folder, delta_bytes, delta_files, time.time(), delta_bytes, delta_files),
+            )
+            row = conn.execute(
+                "SELECT bytes, files, quota_bytes, quota_files, alerted FROM folder_usage WHERE folder = ?",
+                (folder,),
+            ).fetchone()
+            used_bytes, used_files, quota_bytes, quota_files, alerted = row
+            percent = self._percent_of_quota(used_bytes, used_files, quota_bytes, quota_files)
+            should_alert = percent >= self.alert_percent
+            if should_alert != bool(alerted):
+                conn.execute("UPDATE folder_usage SET alerted = ? WHERE folder = ?", (int(should_alert), folder))
+        if should_alert and not alerted:
+            logger.warning(
+                "Folder %s is at %d%% of its quota (%d bytes, %d files).",
+                folder,
+                percent,
+                used_bytes,
+                used_files,
+            )
+
+    def _limits(self, quota_bytes, quota_files):
+        limit_bytes = self.default_quota_bytes if quota_bytes is None else quota_bytes
+        limit_files = self.default_quota_files if quota_files is None else quota_files
+        return int(limit_bytes or 0), int(limit_files or 0)
+
+    def _percent_of_quota(self, used_bytes, used_files, quota_bytes, quota_files):
+        limit_bytes, limit_files = self._limits(quota_bytes, quota_files)
+        percent = 0
+        if limit_bytes:
+            percent = max(percent, used_bytes * 100 // limit_bytes)
+        if limit_files:
+            percent = max(percent, used_files * 100 // limit_files)
+        return percent
+
+    def _row(self, folder):
+        return self.metadata.execute(
+            "SELECT bytes, files, quota_bytes, quota_files FROM folder_usage WHERE folder = ?",
+            (folder,),
+        ).fetchone()
+
+    def get_usage(self, folder):
+        row = self._row(folder)
+        if row is None:
+            return {"bytes": 0, "files": 0}
+        return {"bytes": int(row[0]), "files": int(row[1])}
+
+    def all_usage(self):
+        rows = self.metadata.execute("SELECT folder, bytes, files FROM folder_usage").fetchall()
+        return {folder: {"bytes": int(size), "files": int(count)} for folder, size, count in rows}
+
+    def get_quota(self, folder):
+        row = self._row(folder)
+        quota_bytes, quota_files = (row[2], row[3]) if row else (None, None)
+        limit_bytes, limit_files = self._limits(quota_bytes, quota_files)
+        return {"bytes": limit_bytes, "files": limit_files}
+
+    def set_quota(self, folder, quota_bytes=None, quota_files=None):
+        """Per-folder override of the server-wide quota; 0 means unlimited, None leaves it as is."""
+        with self.metadata.transaction() as conn:
+            conn.execute(
+                "INSERT INTO folder_usage (folder, updated) VALUES (?, ?) ON CONFLICT(folder) DO NOTHING",
+                (folder, time.time()),
+            )
+            if quota_bytes is not None:
+                conn.execute("UPDATE folder_usage SET quota_bytes = ? WHERE folder = ?", (int(quota_bytes), folder))
+            if quota_files is not None:
+                conn.execute("UPDATE folder_usage SET quota_files = ? WHERE folder = ?", (int(quota_files), folder))
+
+    def check_quota(self, folder, extra_bytes, extra_files, replaced_bytes=0, replaced_files=0):
+        """Return an error message if adding the upload would exceed the folder quota."""
+        quota = self.get_quota(folder)
+        if not quota["bytes"] and not quota["files"]:
+            return None
+        usage = self.get_usage(folder)
+        new_bytes = usage["bytes"] - replaced_bytes + extra_bytes
+        new_files = usage["files"] - replaced_files + extra_files
+        if quota["bytes"] and new_bytes > quota["bytes"]:
+            return f"Folder quota exceeded: {quota['bytes']} bytes allowed."
+        if quota["files"] and new_files > quota["files"]:
+            return f"Folder quota exceeded: {quota['files']} files allowed."
+        return None
+
+
+def _env_int(name):
+    try:
+        return int(os.environ.get(name) or 0)
+    except ValueError:
+        return 0
@@ -0,0 +1,312 @@
+import base64
+import binascii
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from storage_service import create_storage
+
+
+# Statuses a check can end in. The BAD ones are reported as damage (and quarantined on request).
+OK = "ok"
+UNVERIFIED = "unverified"
+SUSPECT = "suspect"
+CHANGED = "changed"
+CORRUPT = "corrupt"
+NOT_ENCRYPTED = "not_encrypted"
+DOUBLE_ENCRYPTED = "double_encrypted"
+DAMAGED = "damaged"
+UNREADABLE = "unreadable"
+BAD = (CORRUPT, NOT_ENCRYPTED, DOUBLE_ENCRYPTED, DAMAGED, UNREADABLE)
+
+# Smallest Fernet token: version, timestamp, IV, one AES block and the HMAC.
+_MIN_TOKEN_BYTES = 1 + 8 + 16 + 16 + 32
+
+
+def looks_like_token(data):
+    """Whether `data` has the shape of a Fernet token (no key needed, nothing authenticated)."""
+    if len(data) < 100 or not data.startswith(b"gAAAAA"):
+        return False
+    try:
+        raw = base64.urlsafe_b64decode(data)
+    except (binascii.Error, ValueError):
+        return False
+    return raw[0] == 0x80 and len(raw) >= _MIN_TOKEN_BYTES and (len(raw) - 57) % 16 == 0
+
+
+def _sha256(storage, folder, name):
+    digest = hashlib.sha256()
+    for chunk in storage.iter_range(folder, name):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def check_file(storage, folder, name, encrypted, fernet=None, recorded=None):
+    """Check one stored file. Returns (status, detail, stored).
+
+    `encrypted` says the folder has a key; `fernet` is that key when it is
+    known. `recorded` is the digest row (sha256, stored_size, stored_mtime)
+    for the file, used only while the file is still the version it was
+    recorded for. A file that fails but was replaced while it was being
+    read (an upload during the scan) is reported as changed, not damaged.
+    `stored` is the version that was checked (None if the file is gone).
+    """
+    stored = storage.stat(folder, name)
+    if stored is None:
+        return CHANGED, "deleted during the scan", None
+    status, detail = _check(storage, folder, name, stored, encrypted, fernet, recorded)
+    if status in BAD and storage.stat(folder, name) != stored:
+        return CHANGED, "rewritten during the scan", stored
+    return status, detail, stored
+
+
+def _check(storage, folder, name, stored, encrypted, fernet, recorded):
+    current = recorded is not None and (stored.size, stored.mtime) == (recorded[1], recorded[2])
+    try:
+        if not encrypted:
+            sha256 = _sha256(storage, folder, name)
+            if current:
+                if sha256 == recorded[0]:
+                    return OK, ""
+                return CORRUPT, "content does not match the recorded SHA-256"
+            if stored.size >= 100:
+                head = b"".join(storage.iter_range(folder, name, 0, 64))
+                if head.startswith(b"gAAAAA") and looks_like_token(storage.read_bytes(folder, name)):
+                    return SUSPECT, "looks like an encrypted file left behind in a plaintext folder"
+            return UNVERIFIED, "no recorded digest"
+
+        data = storage.read_bytes(folder, name)
+    except OSError as exc:
+        return UNREADABLE, str(exc)
+    if len(data) != stored.size:
+        return CHANGED, "rewritten during the scan"
+
+    if not looks_like_token(data):
+        if data.startswith(b"gAAAAA"):
+            return DAMAGED, "truncated or altered Fernet token"
+        if current and hashlib.sha256(data).hexdigest() == recorded[0]:
+            return NOT_ENCRYPTED, "stored as plaintext (matches the recorded SHA-256)"
+        return NOT_ENCRYPTED, "not a Fernet token"
+    if fernet is None:
+        return UNVERIFIED, "folder key not given; token shape only"
+    try:
+        plaintext = fernet.decrypt(data)
+    except InvalidToken:
+        return DAMAGED, "does not authenticate under the folder key (altered, or another key)"
+    if looks_like_token(plaintext):
+        try:
+            fernet.decrypt(plaintext)
+            return DOUBLE_ENCRYPTED, "encrypted twice with the folder key"
+        except InvalidToken:
+            pass
+    if current and hashlib.sha256(plaintext).hexdigest() != recorded[0]:
+        return CORRUPT, "decrypts, but does not match the recorded SHA-256"
+    return OK, ""
+
+
+_STORAGE = None
+
+
+def _init_worker(upload_folder):
+    global _STORAGE
+    _STORAGE = create_storage(upload_folder)
+
+
+def _check_batch(batch):
+    """Pool side: check a list of files of one folder.
+
+    Returns [(name, status, detail, version)]; `version` is the (size,
+    mtime) that was checked, or None.
+    """
+    folder, encrypted, fek_b64, files = batch
+    fernet = Fernet(fek_b64.encode("ascii")) if fek_b64 else None
+    results = []
+    for name, recorded in files:
+        try:
+            status, detail, stored = check_file(_STORAGE, folder, name, encrypted, fernet, recorded)
+        except Exception as exc:
+            status, detail, stored = UNREADABLE, f"{type(exc).__name__}: {exc}", None
+        results.append((name, status, detail, None if stored is None else (stored.size, stored.mtime)))
+    return results
+
+
+class IntegrityScan:
+    """Parallel integrity check of stored files, resumable across runs.
+
+    Files are checked in batches by a process pool; each worker opens the
+    storage backend itself and reads files directly. Results go to
+    `verify_results` under the current run as they arrive, so a scan that
+    is interrupted picks up with the files it had not reached yet when the
+    same scan is started again. A run is finished once every file was
+    checked; the next scan then starts from scratch.
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS verify_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scope TEXT NOT NULL,
+            started REAL NOT NULL,
+            finished REAL
+        )""",
+        """CREATE TABLE IF NOT EXISTS verify_results (
+            run_id INTEGER NOT NULL,
+            folder TEXT NOT NULL,
+            name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            detail TEXT,
+            PRIMARY KEY (run_id, folder, name)
+        )""",
+    ]
+
+    BATCH_FILES = 32
+    AHEAD_PER_JOB = 4
+    QUARANTINE_DIR = ".fts_quarantine"
+    REPORT_EVERY_SEC = 5.0
+
+    def __init__(self, storage, metadata, pin_service, upload_folder, jobs=None, out=print):
+        self.storage = storage
+        self.metadata = metadata
+        self.pin_service = pin_service
+        self.upload_folder = upload_folder
+        self.quarantine_root = os.path.join(upload_folder, self.QUARANTINE_DIR)
+        self.jobs = max(1, int(jobs or os.cpu_count() or 1))
+        self.out = out
+        self.metadata.ensure_schema("verify", self.SCHEMA)
+
+    def _run_id(self, scope, restart):
+        """The unfinished run for this scope to resume, or a new one."""
+        row = self.metadata.execute(
+            "SELECT id FROM verify_runs WHERE scope = ? AND finished IS NULL ORDER BY id DESC LIMIT 1", (scope,)
+        ).fetchone()
+        if row is not None and not restart:
+            return row[0], True
+        if row is not None:
+            self.metadata.execute("UPDATE verify_runs SET finished = ? WHERE id = ?", (time.time(), row[0]))
+        inserted = self.metadata.execute(
+            "INSERT INTO verify_runs (scope, started) VALUES (?, ?)", (scope, time.time())
+        )
+        # Only the last few runs are worth keeping.
+        self.metadata.execute("DELETE FROM verify_results WHERE run_id < ?", (inserted.lastrowid - 5,))
+        return inserted.lastrowid, False
+
+    def _batches(self, run_id, folders, keys):
+        """Yield (folder, encrypted, fek_b64, [(name, recorded)]) for files not yet checked in this run."""
+        for folder in folders:
+            done = {
+                row[0]
+                for row in self.metadata.execute(
+                    "SELECT name FROM verify_results WHERE run_id = ? AND folder = ?", (run_id, folder)
+                )
+            }
+            recorded = {
+                row[0]: tuple(row[1:])
+                for row in self.metadata.execute(
+                    "SELECT name, sha256, stored_size, stored_mtime FROM file_digests WHERE folder = ?", (folder,)
+                )
+            }
+            encrypted = self.pin_service.folder_has_encryption(folder)
+            batch = []
+            for stored in self.storage.iter_files(folder):
+                if stored.name in done:
+                    continue
+                batch.append((stored.name, recorded.get(stored.name)))
+                if len(batch) >= self.BATCH_FILES:
+                    yield folder, encrypted, keys.get(folder), batch
+                    batch = []
+            if batch:
+                yield folder, encrypted, keys.get(folder), batch
+
+    def run(self, folders, keys=None, quarantine=False, restart=False):
+        """Check `folders` (names); `keys` maps encrypted folders to their key (base64).
+
+        Returns {"run": id, "resumed": bool, "counts": {status: n}, "bad": [(folder, name, status, detail)]}.
+        """
+        keys = keys or {}
+        scope = json.dumps(sorted(folders))
+        run_id, resumed = self._run_id(scope, restart)
+        if resumed:
+            self.out(f"Resuming scan #{run_id}.")
+        started = time.monotonic()
+        last_report = started
+        checked = 0
+        with ProcessPoolExecutor(
+            max_workers=self.jobs, initializer=_init_worker, initargs=(self.upload_folder,)
+        ) as pool:
+            queued = self._batches(run_id, folders, keys)
+            pending = deque()
+            while True:
+                while len(pending) < self.jobs * self.AHEAD_PER_JOB:
+                    batch = next(queued, None)
+                    if batch is None:
+                        break
+                    pending.append((batch[0], pool.submit(_check_batch, batch)))
+                if not pending:
+                    break
+                folder, future = pending.popleft()
+                rows = []
+                for name, status, detail, version in future.result():
+                    if status in BAD:
+                        self.out(f"{status}: {folder}/{name}: {detail}")
+                        if quarantine:
+                            status, detail = self._quarantine(folder, name, status, detail, version)
+                    rows.append((run_id, folder, name, status, detail))
+                with self.metadata.transaction() as conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO verify_results (run_id, folder, name, status, detail) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        rows,
+                    )
+                checked += len(rows)
+                if time.monotonic() - last_report >= self.REPORT_EVERY_SEC:
+                    last_report = time.monotonic()
+                    self.out(f"{checked} file(s) checked, {checked / (last_report - started):.0f}/s")
+        self.metadata.execute("UPDATE verify_runs SET finished = ? WHERE id = ?", (time.time(), run_id))
+        return self.report(run_id, resumed)
+
+    def report(self, run_id, resumed=False):
+        counts = {}
+        for status, count in self.metadata.execute(
+            "SELECT status, COUNT(*) FROM verify_results WHERE run_id = ? GROUP BY status", (run_id,)
+        ):
+            counts[status] = count
+        bad = self.metadata.execute(
+            f"SELECT folder, name, status, detail FROM verify_results WHERE run_id = ? "
+            f"AND status IN ({', '.join('?' * len(BAD))}) ORDER BY folder, name",
+            (run_id, *BAD),
+        ).fetchall()
+        return {"run": run_id, "resumed": resumed, "counts": counts, "bad": [tuple(row) for row in bad]}
+
+    def _unchanged(self, folder, name, version):
+        stored = self.storage.stat(folder, name)
+        return stored is not None and version is not None and (stored.size, stored.mtime) == version
+
+    def _quarantine(self, folder, name, status, detail, version):
+        """Move a bad file out of its folder into .fts_quarantine/<folder>/, through storage so usage etc. follow.
+
+        Only the version that was checked is moved: a file replaced since
+        (an upload after its check) is left in place and reported as changed.
+        Returns the (status, detail) to record.
+        """
+        if not self._unchanged(folder, name, version):
+            return CHANGED, f"{detail}; replaced after the check, not quarantined"
+        target_dir = os.path.join(self.quarantine_root, folder)
+        os.makedirs(target_dir, exist_ok=True)
+        target = os.path.join(target_dir, name)
+        if os.path.exists(target):
+            target += f".{int(time.time())}"
+        try:
+            with open(target, "wb") as out:
+                for chunk in self.storage.iter_range(folder, name):
+                    out.write(chunk)
+            if not self._unchanged(folder, name, version):
+                os.unlink(target)
+                return CHANGED, f"{detail}; replaced after the check, not quarantined"
+            self.storage.delete(folder, name)
+        except OSError as exc:
+            return status, f"{detail}; not quarantined: {exc}"
+        return status, f"{detail}; quarantined to {target}"
@@ -0,0 +1,396 @@
+import errno
+import os
+import secrets
+import select
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+
+SHARED_STATE_ADDR_ENV = "FTS_SHARED_STATE_ADDR"
+SHARED_STATE_KEY_ENV = "FTS_SHARED_STATE_KEY"
+
+
+class SharedStateManager(BaseManager):
+    pass
+
+
+_shared_objects = {}
+
+
+def _shared_unlock_store():
+    if "unlock" not in _shared_objects:
+        from pin_service import UnlockStore
+
+        _shared_objects["unlock"] = UnlockStore()
+    return _shared_objects["unlock"]
+
+
+def _shared_attempt_store():
+    if "attempts" not in _shared_objects:
+        from pin_service import PinAttemptStore
+
+        _shared_objects["attempts"] = PinAttemptStore()
+    return _shared_objects["attempts"]
+
+
+def _shared_pin_limiter():
+    if "limiter" not in _shared_objects:
+        from rate_limit_service import PinRateLimiter
+
+        _shared_objects["limiter"] = PinRateLimiter.from_env()
+    return _shared_objects["limiter"]
+
+
+SharedStateManager.register("unlock_store", callable=_shared_unlock_store)
+SharedStateManager.register("attempt_store", callable=_shared_attempt_store)
+SharedStateManager.register("pin_limiter", callable=_shared_pin_limiter)
+
+
+def connect_shared_state():
+    """In a pool worker, return (unlock_store, attempt_store, pin_limiter) proxies; otherwise Nones."""
+    address = os.environ.get(SHARED_STATE_ADDR_ENV)
+    key = os.environ.get(SHARED_STATE_KEY_ENV)
+    if not address or not key:
+        return None, None, None
+    manager = SharedStateManager(address=address, authkey=bytes.fromhex(key))
+    manager.connect()
+    return manager.unlock_store(), manager.attempt_store(), manager.pin_limiter()
+
+
+def supports_workers():
+    return hasattr(os, "fork")
+
+
+class WorkerPool:
+    """Pre-fork supervisor: one listening socket shared by N waitress processes.
+
+    The supervisor never imports the Flask app; each worker imports it after
+    fork. Workers send heartbeats over a pipe; a worker that dies or stops
+    beating is replaced. PIN unlock tokens, wrong-PIN counters and the PIN
+    rate limiter are served to all workers from a manager process owned by
+    the supervisor.
+
+    SIGHUP reloads: a new generation of workers is forked on the same socket,
+    and once all of them are up the old generation stops accepting and
+    finishes its in-flight transfers (up to `drain_timeout`) before exiting.
+    """
+
+    HEARTBEAT_INTERVAL_SEC = 1.0
+    HEARTBEAT_TIMEOUT_SEC = 30.0
+    STOP_GRACE_SEC = 5.0
+    CRASH_WINDOW_SEC = 5.0
+    MAX_RESTART_DELAY_SEC = 30.0
+    DRAIN_TIMEOUT_SEC = 600.0
+    RELOAD_READY_TIMEOUT_SEC = 60.0
+
+    def __init__(self, host, port, workers, on_pids_changed=None, threads=4, drain_timeout=None):
+        self.host = host
+        self.port = port
+        self.size = max(1, int(workers))
+        self.threads = threads
+        self.on_pids_changed = on_pids_changed
+        self.drain_timeout = float(drain_timeout or _env_float("FTS_DRAIN_TIMEOUT") or self.DRAIN_TIMEOUT_SEC)
+        # pid -> {"fd", "started", "last_beat", "beats", "generation"}
+        self.workers = {}
+        self.generation = 0
+        self._retiring = set()  # old-generation workers waiting for the new ones to come up
+        self._reload_started = None
+        self._reload_requested = False
+        self._sock = None
+        self._manager = None
+        self._stopping = False
+        self._quick_failures = 0
+        self._next_spawn_at = 0.0
+
+    def worker_pids(self):
+        return sorted(self.workers)
+
+    def _create_socket(self):
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(1024)
+        sock.set_inheritable(True)
+        return sock
+
+    def _start_shared_state(self):
+        address = os.path.join(tempfile.mkdtemp(prefix="fts-"), "state.sock")
+        authkey = secrets.token_bytes(32)
+        self._manager = SharedStateManager(address=address, authkey=authkey)
+        self._manager.start(initializer=signal.signal, initargs=(signal.SIGINT, signal.SIG_IGN))
+        os.environ[SHARED_STATE_ADDR_ENV] = address
+        os.environ[SHARED_STATE_KEY_ENV] = authkey.hex()
+
+    def _spawn(self):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            code = 1
+            try:
+                code = _worker_main(self._sock, write_fd, self.threads, self.drain_timeout)
+            except BaseException:
+                import traceback
+
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+        os.close(write_fd)
+        os.set_blocking(read_fd, False)
+        now = time.monotonic()
+        self.workers[pid] = {
+            "fd": read_fd,
+            "started": now,
+            "last_beat": now,
+            "beats": 0,
+            "generation": self.generation,
+        }
+        self._pids_changed()
+        return pid
+
+    def _pids_changed(self):
+        if self.on_pids_changed:
+            self.on_pids_changed(self.worker_pids())
+
+    def _forget(self, pid):
+        self._retiring.discard(pid)
+        info = self.workers.pop(pid, None)
+        if info:
+            try:
+                os.close(info["fd"])
+            except OSError:
+                pass
+        self._pids_changed()
+        return info
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            info = self._forget(pid)
+            if info is None or self._stopping or info["generation"] != self.generation:
+                continue
+            if self._reload_started is not None and not info["beats"]:
+                self._abort_reload(f"new worker {pid} exited during startup")
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            print(f"Worker {pid} exited ({code}); starting a replacement.", file=sys.stderr)
+            if time.monotonic() - info["started"] < self.CRASH_WINDOW_SEC:
+                self._quick_failures += 1
+                delay = min(self.MAX_RESTART_DELAY_SEC, 2 ** min(self._quick_failures, 5))
+                self._next_spawn_at = time.monotonic() + delay
+            else:
+                self._quick_failures = 0
+
+    def _read_heartbeats(self, timeout):
+        fds = {info["fd"]: pid for pid, info in self.workers.items()}
+        if not fds:
+            time.sleep(timeout)
+            return
+        try:
+            ready, _, _ = select.select(list(fds), [], [], timeout)
+        except InterruptedError:
+            return
+        now = time.monotonic()
+        for fd in ready:
+            try:
+                data = os.read(fd, 4096)
+            except BlockingIOError:
+                continue
+            except OSError:
+                data = b""
+            pid = fds[fd]
+            if data and pid in self.workers:
+                self.workers[pid]["last_beat"] = now
+                self.workers[pid]["beats"] += 1
+
+    def _check_health(self):
+        now = time.monotonic()
+        for pid, info in list(self.workers.items()):
+            if now - info["last_beat"] > self.HEARTBEAT_TIMEOUT_SEC:
+                print(f"Worker {pid} stopped responding; killing it.", file=sys.stderr)
+                _signal(pid, signal.SIGKILL)
+                info["last_beat"] = now
+
+    def _current(self):
+        return [pid for pid, info in self.workers.items() if info["generation"] == self.generation]
+
+    def _fill(self):
+        if self._stopping or time.monotonic() < self._next_spawn_at:
+            return
+        while len(self._current()) < self.size:
+            self._spawn()
+
+    def _request_stop(self, signum, frame):
+        self._stopping = True
+
+    def _request_reload(self, signum, frame):
+        self._reload_requested = True
+
+    def _begin_reload(self):
+        self._reload_requested = False
+        if self._reload_started is not None:
+            return
+        print("Reloading: starting a new generation of workers.", file=sys.stderr)
+        self._retiring.update(self._current())
+        self.generation += 1
+        self._reload_started = time.monotonic()
+        self._quick_failures = 0
+        self._next_spawn_at = 0.0
+
+    def _abort_reload(self, reason):
+        print(f"Reload failed ({reason}); keeping the running workers.", file=sys.stderr)
+        for pid in self._current():
+            self.workers[pid]["generation"] = None
+            _signal(pid, signal.SIGTERM)
+        self.generation -= 1
+        self._retiring.clear()
+        self._reload_started = None
+
+    def _check_reload(self):
+        if self._reload_started is None:
+            return
+        current = self._current()
+        if len(current) == self.size and all(self.workers[pid]["beats"] for pid in current):
+            # The new generation is serving: let the old one drain and exit.
+            for pid in self._retiring:
+                _signal(pid, signal.SIGUSR1)
+            print(f"Reload complete; draining {len(self._retiring)} old worker(s).", file=sys.stderr)
+            self._retiring.clear()
+            self._reload_started = None
+        elif time.monotonic() - self._reload_started > self.RELOAD_READY_TIMEOUT_SEC:
+            self._abort_reload("new workers did not come up in time")
+
+    def _stop_workers(self):
+        for pid in list(self.workers):
+            _signal(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.STOP_GRACE_SEC + 2
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.05)
+        for pid in list(self.workers):
+            _signal(pid, signal.SIGKILL)
+        while self.workers:
+            try:
+                pid, _ = os.waitpid(-1, 0)
+            except ChildProcessError:
+                self.workers.clear()
+                break
+            self._forget(pid)
+
+    def run(self):
+        self._sock = self._create_socket()
+        self._start_shared_state()
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGHUP, self._request_reload)
+        try:
+            self._fill()
+            while not self._stopping:
+                self._read_heartbeats(WorkerPool.HEARTBEAT_INTERVAL_SEC)
+                if self._reload_requested:
+                    self._begin_reload()
+                self._reap()
+                self._check_health()
+                self._fill()
+                self._check_reload()
+        finally:
+            self._stopping = True
+            self._stop_workers()
+            self._sock.close()
+            if self._manager is not None:
+                self._manager.shutdown()
+        return 0
+
+
+def _signal(pid, signum):
+    try:
+        os.kill(pid, signum)
+    except OSError as exc:
+        if exc.errno != errno.ESRCH:
+            raise
+
+
+def _worker_main(sock, heartbeat_fd, threads, drain_timeout):
+    """Body of one forked worker: serve on the inherited socket until told to stop.
+
+    SIGTERM (shutdown) drains for a few seconds, SIGUSR1 (reload) for up to
+    `drain_timeout`; either way the worker stops accepting at once.
+    """
+    from waitress import create_server
+    from waitress import wasyncore
+
+    state = {"stop_at": None, "last_loop": time.monotonic()}
+
+    def _stop_within(seconds):
+        deadline = time.monotonic() + seconds
+        if state["stop_at"] is None or deadline < state["stop_at"]:
+            state["stop_at"] = deadline
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: _stop_within(WorkerPool.STOP_GRACE_SEC))
+    signal.signal(signal.SIGUSR1, lambda signum, frame: _stop_within(drain_timeout))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # Import the app only now, so every worker (and every reload) loads fresh code.
+    from server import app
+
+    server = create_server(app, sockets=[sock], threads=threads)
+
+    def _heartbeat():
+        while True:
+            time.sleep(WorkerPool.HEARTBEAT_INTERVAL_SEC)
+            # Only beat while the event loop is turning; a wedged loop gets replaced.
+            if time.monotonic() - state["last_loop"] > WorkerPool.HEARTBEAT_TIMEOUT_SEC / 2:
+                continue
+            try:
+                os.write(heartbeat_fd, b".")
+            except OSError:
+                os._exit(0)
+
+    threading.Thread(target=_heartbeat, name="fts-heartbeat", daemon=True).start()
+
+    try:
+        while True:
+            wasyncore.loop(timeout=1.0, map=server._map, use_poll=True, count=1)
+            state["last_loop"] = time.monotonic()
+            if state["stop_at"] is None:
+                continue
+            server.accepting = False
+            if _drained(server) or time.monotonic() >= state["stop_at"]:
+                break
+    finally:
+        server.task_dispatcher.shutdown(timeout=1)
+        # os._exit skips atexit: write out queued access-log records here.
+        access_log = app.extensions.get("fts_access_log")
+        if access_log is not None:
+            access_log.close()
+    return 0
+
+
+def _drained(server):
+    busy = False
+    for channel in list(server.active_channels.values()):
+        if channel.requests or channel.request is not None or channel.total_outbufs_len:
+            busy = True
+        else:
+            # Idle keep-alive connection: close it so the client reconnects elsewhere.
+            channel.will_close = True
+    return not busy
+
+
+def _env_float(name):
+    try:
+        return float(os.environ.get(name) or 0)
+    except ValueError:
+        return 0.0